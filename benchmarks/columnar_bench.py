@@ -0,0 +1,92 @@
+"""
+Benchmark of the analysts' re-read: parsing the indented JSON output and running the
+Foreignfortune checks in Python, against reading the columnar dataset written by
+`columnar.py` and running the same checks vectorised.
+
+Usage:
+    python benchmarks/columnar_bench.py [--records 10000] [--file output.json] [--repeat 3]
+
+Without `--file` a Foreignfortune-like output is generated as in `validation_bench.py`.
+Needs pyarrow.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import columnar
+import validation
+from validation_bench import write_records, MANDATORY_KEYS
+
+
+def json_python(file_path):
+    ff_validator = validation.Validation.FFValidation()
+    data = validation.Validation().read_json_from_path(file_path)
+    ff_validator.validate_mandatory_keys(data, MANDATORY_KEYS)
+    ff_validator.calculate_rate_difference(data)
+    ff_validator.check_variants_images_prices(data)
+    return len(data)
+
+
+def columnar_vectorised(file_path,format="parquet"):
+    paths = columnar.dataset_paths(file_path,format)
+    column_names = columnar.read_schema(paths["products"]).names
+    products = columnar.read_table(paths["products"], columns=["id", "price_min", "price_max", "images", columnar.MISSING_KEYS])
+    variants = columnar.read_table(paths["variants"], columns=["product_index", "product_id", "price"])
+    columnar.missing_keys(products, MANDATORY_KEYS, column_names)
+    columnar.rate_differences(products)
+    columnar.variant_checks(products, variants)
+    return products.num_rows
+
+
+def timed(function,repeat,*args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        records = function(*args)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return {"records": records, "seconds": round(best, 4), "records_per_second": round(records / best)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000, help="Records in the generated output file.")
+    parser.add_argument("--file", help="Foreignfortune output file to use instead of a generated one.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the fastest is reported.")
+    args = parser.parse_args(argv)
+    columnar.require_arrow()
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "foreignfortune.json")
+        if args.file:
+            shutil.copyfile(args.file, file_path)
+        else:
+            write_records(file_path,args.records)
+        sizes = {"json": round(os.path.getsize(file_path) / 2**20, 2)}
+        results = {"json_python": timed(json_python, args.repeat, file_path)}
+        for format in columnar.FORMATS:
+            started = time.perf_counter()
+            columnar.convert(file_path,format)
+            convert_seconds = round(time.perf_counter() - started, 3)
+            paths = columnar.dataset_paths(file_path,format)
+            sizes[format] = round(sum(os.path.getsize(path) for path in paths.values() if os.path.exists(path)) / 2**20, 2)
+            results[f"{format}_vectorised"] = dict(timed(columnar_vectorised, args.repeat, file_path, format),
+                                                   convert_seconds=convert_seconds)
+        report_path = os.path.join(directory, "validation.json")
+        checks = [validation.MandatoryKeysCheck("invalid_data", MANDATORY_KEYS),
+                  validation.RateDifferenceCheck("rate_diff"),
+                  validation.VariantsCheck("variants")]
+        validation.run_validation({file_path: checks}, output_path=report_path)
+        with open(report_path, 'r') as file:
+            same = columnar.validate(file_path, MANDATORY_KEYS) == json.load(file)
+    print(json.dumps({"size_mb": sizes, "results": results, "same_report": same}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Offline replay benchmark: runs the scrapers end to end against a local server.
+
+Usage:
+    python benchmarks/replay_bench.py [--sites foreignfortune lechocolat traderjoes]
+                                      [--recorded CACHE_DIR] [--results FILE]
+                                      [--baseline FILE] [--max-regression 0.2]
+
+Each site is served from its own local server process and scraped in its own process,
+so CPU time and peak RSS belong to the scraper alone. Pages come either from a crawl
+recorded with `crawl.py --cache-dir CACHE_DIR` (`--recorded`), or, by default, from
+synthetic pages rendered from the records in `output/`.
+
+The results (pages/sec, p50/p95 page latency, CPU time, peak RSS, bytes transferred)
+are written as JSON to `--results`. With `--baseline`, the run is compared with an
+earlier results file and exits with status 1 if any site's pages/sec dropped by more
+than `--max-regression`.
+"""
+import os
+import re
+import sys
+import json
+import html
+import math
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import urllib.request
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, unquote
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utility
+import responsecache
+from crawl import SITE_REGISTRY
+from traderjoes import Traderjoes
+from traderjoes_cards import render_listing
+
+PRODUCTS_PER_PAGE = 24
+STATS_PATH = "/__replay_stats__"
+# The Foreignfortune XPaths read from the environment, matching the synthetic pages.
+SYNTHETIC_ENV = {
+    "ffProductDetailsXpath": '//script[@id="ProductJson-product-template"]/text()',
+    "ffPaginationXpath": '//ul[@class="pagination"]/li/a/@href',
+}
+# Scripts of recorded browser documents would re-render the page against the live site.
+EXECUTABLE_SCRIPT = re.compile(r'<script\b(?![^>]*type="application/(?:ld\+)?json")[^>]*>.*?</script>', re.S | re.I)
+
+
+def chunks(items,size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def path_key(url):
+    """Path and query of `url`, unquoted: clients may re-quote a URL differently than it was recorded."""
+    parts = urlsplit(url)
+    return unquote((parts.path or "/") + (f"?{parts.query}" if parts.query else ""))
+
+
+def foreignfortune_pages(records,base_url):
+    """Home page, paginated collection pages and product pages with the product JSON script tag."""
+    pages = {}
+    categories = chunks(records, 20)
+    nav = "".join(f'<li><a href="/collections/collection-{n}">Collection {n}</a></li>' for n in range(1, len(categories) + 1))
+    pages[base_url] = f'<ul class="site-nav list--inline site-nav--centered">{nav}</ul>'
+    for n,category in enumerate(categories, 1):
+        category_path = f"/collections/collection-{n}"
+        listing_pages = chunks(category, PRODUCTS_PER_PAGE)
+        pagination = "".join(f'<li><a href="{category_path}?page={page_no}">{page_no}</a></li>'
+                             for page_no in range(2, len(listing_pages) + 1))
+        for page_no,products in enumerate(listing_pages, 1):
+            cards = "".join(f'<div class="grid-view-item product-card"><a href="{category_path}/products/{html.escape(product["handle"])}"></a></div>'
+                            for product in products)
+            url = base_url + category_path + (f"?page={page_no}" if page_no > 1 else "")
+            pages[url] = (f'<h1 class="collection-hero__title page-width">Collection {n}</h1>'
+                          f'<ul class="pagination">{pagination if page_no == 1 else ""}</ul>{cards}')
+            for product in products:
+                product_json = json.dumps(product).replace("</", "<\\/")
+                pages[f"{base_url}{category_path}/products/{product['handle']}"] = (
+                    f'<h1 class="product-single__title">{html.escape(product["title"])}</h1>'
+                    f'<script type="application/json" id="ProductJson-product-template">{product_json}</script>')
+    return pages
+
+
+def lechocolat_pages(records,base_url):
+    """Home page with the category menu, category pages and one product page per record."""
+    pages = {}
+    categories = {}
+    for record in records:
+        categories.setdefault(record["categoty"], []).append(record)
+    menu = "".join(f'<li class="siteMenuItem" data-depth="2"><a href="{base_url}category-{n}">{html.escape(name or "")}</a></li>'
+                   for n,name in enumerate(categories, 1))
+    pages[base_url] = f'<h1 class="headerLogo__image"></h1><ul>{menu}</ul>'
+    for n,products in enumerate(categories.values(), 1):
+        pages[f"{base_url}category-{n}"] = "".join(
+            f'<section class="productMiniature__data"><a href="{html.escape(product["url"])}"></a></section>' for product in products)
+        for product in products:
+            pages[product["url"]] = (
+                f'<ul><li class="productImages__item keen-slider__slide"><a href="{html.escape(product["image_url"] or "")}"></a></li></ul>'
+                f'<h1 class="productCard__title">{html.escape(product["title"] or "")}</h1>'
+                f'<h2 class="productCard__subtitle">{html.escape(product["categoty"] or "")}</h2>'
+                f'<div class="productAccordion__content"><p>{html.escape(product["description"] or "")}</p>'
+                f'<p>{html.escape(product["price"] or "")}</p></div>'
+                f'<p class="productCard__weight">{html.escape(product["weight"] or "")}</p>')
+    return pages
+
+
+def traderjoes_pages(records,base_url):
+    """Rendered listing pages: the pagination list and `PRODUCTS_PER_PAGE` product cards each."""
+    pages = {}
+    listing_pages = chunks(records, PRODUCTS_PER_PAGE)
+    pagination = "".join(f"<li>{page_no}</li>" for page_no in range(1, len(listing_pages) + 1))
+    for page_no,products in enumerate(listing_pages, 1):
+        scraper = Traderjoes(base_url)
+        pages[scraper.listing_url(page_no)] = (f'<ul class="Pagination_pagination__list__1JUIg">{pagination}</ul>'
+                                               + render_listing(products, len(products)))
+    return pages
+
+
+SYNTHETIC_PAGES = {
+    "foreignfortune": foreignfortune_pages,
+    "lechocolat": lechocolat_pages,
+    "traderjoes": traderjoes_pages,
+}
+
+
+def synthetic_pages(name):
+    with open(os.path.join(ROOT, "output", SITE_REGISTRY[name]["output_file"]), 'r') as file:
+        records = json.load(file)
+    return SYNTHETIC_PAGES[name](records, SITE_REGISTRY[name]["url"])
+
+
+def recorded_pages(name,cache_dir):
+    """The responses of `name`'s host in a response cache; browser documents win over browser bodies."""
+    origin = origin_of(SITE_REGISTRY[name]["url"])
+    cache = responsecache.ResponseCache(cache_dir, mode="replay")
+    pages = {}
+    variants = {}
+    try:
+        for entry in cache.entries():
+            if origin_of(entry["url"]) != origin or entry.get("status") != 200:
+                continue
+            variant = entry.get("variant", "")
+            if variants.get(entry["url"], "").endswith(":document") and not variant.endswith(":document"):
+                continue
+            text = entry["text"]
+            if variant.startswith("browser"):
+                text = EXECUTABLE_SCRIPT.sub("", text)
+            pages[entry["url"]] = text
+            variants[entry["url"]] = variant
+    finally:
+        cache.close()
+    return pages
+
+
+def serve(pages,origin,ready):
+    """
+    Server process: serves `pages` with `origin` rewritten to the local address, and
+    the number of requests and bytes served at `STATS_PATH`.
+    """
+    from aiohttp import web
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    local_origin = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    bodies = {path_key(url): text.replace(origin, local_origin).encode("utf-8") for url,text in pages.items()}
+    stats = {"requests": 0, "bytes": 0, "not_found": 0}
+
+    async def handle(request):
+        if request.path == STATS_PATH:
+            return web.json_response(stats)
+        body = bodies.get(unquote(request.raw_path))
+        if body is None:
+            stats["not_found"] += 1
+            return web.Response(status=404)
+        stats["requests"] += 1
+        stats["bytes"] += len(body)
+        return web.Response(body=body, content_type="text/html", charset="utf-8")
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        ready.put(local_origin)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class TimedHttpFetcher(utility.HttpFetcher):
+    """HTTP backend recording the latency of every page."""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.latencies = []
+
+    async def fetch_response(self,url,headers=None,wait_selector=None,full_page=False):
+        started = time.perf_counter()
+        try:
+            return await super().fetch_response(url,headers=headers,wait_selector=wait_selector,full_page=full_page)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+class TimedBrowserFetcher(utility.BrowserFetcher):
+    """Browser backend recording the latency of every page."""
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.latencies = []
+
+    async def fetch_response(self,url,headers=None,wait_selector=None,full_page=False):
+        started = time.perf_counter()
+        try:
+            return await super().fetch_response(url,headers=headers,wait_selector=wait_selector,full_page=full_page)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    async def extract_response(self,url,spec=None,script=None,headers=None,wait_selector=None):
+        started = time.perf_counter()
+        try:
+            return await super().extract_response(url,spec=spec,script=script,headers=headers,wait_selector=wait_selector)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values,fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+async def measure_site(scraper_class,base_url,options,output_path,browser):
+    fetchers = {"http": TimedHttpFetcher()}
+    if browser:
+        fetchers["browser"] = TimedBrowserFetcher()
+    for fetcher in fetchers.values():
+        await fetcher.start()
+    scraper = scraper_class(base_url,shared_fetchers=fetchers,**options)
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    try:
+        records = await scraper.write_output(output_path)
+    finally:
+        for fetcher in fetchers.values():
+            await fetcher.close()
+    wall_seconds = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = [latency for fetcher in fetchers.values() for latency in fetcher.latencies]
+    return {
+        "records": records,
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_seconds": round((usage_after.ru_utime - usage_before.ru_utime)
+                             + (usage_after.ru_stime - usage_before.ru_stime), 3),
+        "peak_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+        "p50_latency_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p95_latency_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+    }
+
+
+def run_site(name,base_url,output_dir,requests_per_second,browser,env):
+    """
+    Scraper process: runs `name` against `base_url` with the politeness limit raised
+    to `requests_per_second` and, unless `browser`, every page type fetched over HTTP.
+    """
+    os.environ.update(env)
+    site = SITE_REGISTRY[name]
+    overrides = {"REQUESTS_PER_SECOND": requests_per_second}
+    if not browser:
+        overrides["PAGE_BACKENDS"] = {page_type: utility.HttpFetcher.name for page_type in site["scraper"].PAGE_BACKENDS}
+    scraper_class = type(site["scraper"].__name__, (site["scraper"],), overrides)
+    output_path = os.path.join(output_dir, site["output_file"])
+    try:
+        return asyncio.run(measure_site(scraper_class,base_url,site["options"],output_path,browser))
+    except Exception as err:
+        # Reported as text: exceptions carrying response headers cannot be sent back to the parent process.
+        return {"error": repr(err)}
+
+
+def benchmark_site(name,pages,env,output_dir,requests_per_second,browser):
+    origin = origin_of(SITE_REGISTRY[name]["url"])
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(pages,origin,ready), daemon=True)
+    server.start()
+    try:
+        local_origin = ready.get(timeout=60)
+        base_url = SITE_REGISTRY[name]["url"].replace(origin, local_origin)
+        result = {"site": name, "fixture_pages": len(pages)}
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result.update(executor.submit(run_site,name,base_url,output_dir,requests_per_second,browser,env).result())
+        except Exception as err:
+            result["error"] = repr(err)
+        with urllib.request.urlopen(local_origin + STATS_PATH) as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.join()
+    result["pages"] = stats["requests"]
+    result["pages_not_found"] = stats["not_found"]
+    result["bytes_transferred"] = stats["bytes"]
+    if result.get("wall_seconds"):
+        result["pages_per_second"] = round(stats["requests"] / result["wall_seconds"], 2)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results,baseline,max_regression):
+    """Prints the pages/sec change of every site against `baseline` and returns the regressed sites."""
+    previous = {site["site"]: site for site in baseline["sites"]}
+    regressed = []
+    for site in results["sites"]:
+        before = previous.get(site["site"], {}).get("pages_per_second")
+        after = site.get("pages_per_second")
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        print(f"{site['site']}: {before} -> {after} pages/sec ({change:+.1%})")
+        if change < -max_regression:
+            regressed.append(site["site"])
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sites", nargs="+", choices=sorted(SITE_REGISTRY), default=sorted(SITE_REGISTRY))
+    parser.add_argument("--recorded", help="Response cache directory of a recorded crawl (default: synthetic pages).")
+    parser.add_argument("--results", help="Results file (default: benchmarks/results/replay-<UTC time>.json).")
+    parser.add_argument("--rate", type=float, default=1000, help="Requests per second allowed per host during the run.")
+    parser.add_argument("--browser", action="store_true", help="Keep the browser backend for browser page types.")
+    parser.add_argument("--baseline", help="Earlier results file to compare pages/sec with.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed pages/sec drop against the baseline.")
+    args = parser.parse_args(argv)
+
+    created_at = datetime.now(timezone.utc)
+    results = {
+        "created_at": created_at.isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixtures": args.recorded or "synthetic",
+        "sites": [],
+    }
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name in args.sites:
+            if args.recorded:
+                pages,env = recorded_pages(name,args.recorded),{}
+            else:
+                pages,env = synthetic_pages(name),SYNTHETIC_ENV
+            results["sites"].append(benchmark_site(name,pages,env,output_dir,args.rate,args.browser))
+
+    results_path = args.results or os.path.join(ROOT, "benchmarks", "results", f"replay-{created_at:%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(json.dumps(results["sites"], indent=4))
+    print(f"Results written to {results_path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressed = compare(results,json.load(file),args.max_regression)
+        if regressed:
+            print(f"Regressed by more than {args.max_regression:.0%}: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
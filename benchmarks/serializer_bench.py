@@ -0,0 +1,82 @@
+"""
+Benchmark of the output serializers: file size, encode (write) and decode (read) time of
+every file in `output/` for each installed JSON backend, indented and compact, plain,
+gzip- and zstd-compressed.
+
+Usage:
+    python benchmarks/serializer_bench.py [--repeat 3] [--files output/traderjoes.json ...]
+
+Writes go through `serializers.Serializer.write()` without fsync, reads through
+`Serializer.read()`; the fastest of `--repeat` runs is reported. Ratios are against the
+current default, stdlib `json` indented by 4 and uncompressed.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import serializers
+
+
+def best_of(repeat,function,*args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def benchmark_file(file_path,directory,repeat):
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    stdlib = serializers.Serializer()
+    path = os.path.join(directory, "out.json")
+    baseline = {"encode": best_of(repeat,stdlib.write,data,path,False), "decode": best_of(repeat,stdlib.read,path),
+                "size": os.path.getsize(path)}
+    results = []
+    compressions = [None, "gzip"] + (["zstd"] if serializers.zstandard is not None else [])
+    for backend in serializers.available_backends():
+        for indent in (4, None):
+            for compression in compressions:
+                serializer = serializers.Serializer(backend,indent,compression)
+                path = os.path.join(directory, f"out.json{serializer.suffix}")
+                encode = best_of(repeat,serializer.write,data,path,False)
+                decode = best_of(repeat,serializer.read,path)
+                size = os.path.getsize(path)
+                results.append({
+                    "backend": backend,
+                    "layout": "indent" if indent else "compact",
+                    "compression": compression or "none",
+                    "size_kb": round(size / 1024, 1),
+                    "encode_ms": round(encode * 1000, 2),
+                    "decode_ms": round(decode * 1000, 2),
+                    "size_vs_stdlib": round(size / baseline["size"], 3),
+                    "encode_speedup": round(baseline["encode"] / encode, 2),
+                    "decode_speedup": round(baseline["decode"] / decode, 2),
+                })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", nargs="+", default=sorted(glob.glob(os.path.join(ROOT, "output", "*.json"))),
+                        help="Output files to serialize (default: every file in output/).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest is reported.")
+    args = parser.parse_args(argv)
+    report = {"backends": serializers.available_backends(), "files": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for file_path in args.files:
+            report["files"][os.path.basename(file_path)] = benchmark_file(file_path,directory,args.repeat)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Microbenchmark of page parsing and extraction: the compiled `site_selectors` specs
+against parsel with the same XPath strings evaluated from scratch on every page.
+
+Usage:
+    python benchmarks/site_selectors_bench.py [--fixtures benchmarks/fixtures] [--repeat 20]
+
+Fixtures are saved pages named `<site>_<page type>.html`, e.g. `lechocolat_product.html`
+or `traderjoes_listing.html`; the page type selects the spec of that site. Without any
+fixture a Trader Joe's listing rendered from `output/traderjoes.json` is used.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from parsel import Selector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import site_selectors
+from traderjoes_cards import render_listing
+
+SITES = {
+    "foreignfortune": site_selectors.FOREIGNFORTUNE,
+    "lechocolat": site_selectors.LECHOCOLAT,
+    "traderjoes": site_selectors.TRADERJOES,
+}
+
+
+def parsel_extract(spec,node):
+    """The former pattern: every XPath string evaluated anew on a parsel Selector."""
+    if isinstance(spec,site_selectors.Field):
+        matches = node.xpath(spec.expression)
+        if spec.regex:
+            return matches.re_first(spec.regex)
+        return matches.getall() if spec.many else matches.get()
+    def record(element):
+        return {name: parsel_extract(field,element) for name,field in spec.fields.items()}
+    return [record(element) for element in node.xpath(spec.container.expression)] if spec.container else record(node)
+
+
+def with_parsel(spec,page_html):
+    return parsel_extract(spec,Selector(text=page_html))
+
+
+def with_spec(spec,page_html):
+    return spec.extract_page(page_html)
+
+
+def load_fixtures(directory):
+    fixtures = []
+    if os.path.isdir(directory):
+        for file_name in sorted(os.listdir(directory)):
+            site,_,page_type = file_name[:-len(".html")].partition("_")
+            if file_name.endswith(".html") and page_type in SITES.get(site,{}):
+                with open(os.path.join(directory,file_name), 'r') as file:
+                    fixtures.append((file_name,SITES[site][page_type],file.read()))
+    if not fixtures:
+        with open(os.path.join(ROOT, "output", "traderjoes.json"), 'r') as file:
+            fixtures.append(("traderjoes_listing (rendered)",site_selectors.TRADERJOES["listing"],render_listing(json.load(file),1000)))
+    return fixtures
+
+
+def timed(extract,spec,page_html,repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        records = extract(spec,page_html)
+    return (time.perf_counter() - started) / repeat * 1000, records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", default=os.path.join(ROOT, "benchmarks", "fixtures"), help="Directory of saved pages.")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per fixture and approach.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name,spec,page_html in load_fixtures(args.fixtures):
+        with_spec(spec,page_html) # compiles the spec's expressions
+        parsel_ms,expected = timed(with_parsel,spec,page_html,args.repeat)
+        spec_ms,records = timed(with_spec,spec,page_html,args.repeat)
+        results.append({
+            "fixture": name,
+            "same_output": records == expected,
+            "parsel_ms": round(parsel_ms, 3),
+            "compiled_spec_ms": round(spec_ms, 3),
+            "speedup": round(parsel_ms / spec_ms, 2) if spec_ms else None,
+        })
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the Trader Joe's listing extraction: per-card `ProductCard` records
+against the former seven column lists zipped back together by index.
+
+Usage:
+    python benchmarks/traderjoes_cards.py [--cards 10000] [--html saved_listing.html]
+
+Without `--html` a listing page is rendered from the records of
+`output/traderjoes.json`, repeated until it holds `--cards` product cards.
+"""
+import os
+import sys
+import html
+import json
+import time
+import argparse
+import tracemalloc
+from parsel import Selector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from traderjoes import Traderjoes
+
+BASE_URL = "https://www.traderjoes.com"
+
+CARD_TEMPLATE = """<li class="ProductList_productList__item__1EIvq"><article class="ProductCard_card__4WLVz">
+<a class="Link_link__1AZfr ProductCard_card__img_link__2bBqA" href="{href}"><picture>{sources}<img src="{img}"></picture></a>
+<a class="Link_link__1AZfr ProductCard_card__category__Hh3rT" href="#">{category}</a>
+<h2 class="ProductCard_card__title__text__uiWLe"><a href="{href}">{title}</a></h2>
+<div class="ProductPrice_productPrice__1Rq1r"><span class="ProductPrice_productPrice__price__3-50j">{price}</span><span class="ProductPrice_productPrice__unit__2jvkA">/{unit}</span></div>
+</article></li>"""
+
+
+def render_listing(records,no_of_cards):
+    """Renders a listing page with `no_of_cards` product cards built from previously scraped records."""
+    cards = []
+    for index in range(no_of_cards):
+        record = records[index % len(records)]
+        paths = [url[len(BASE_URL):] for url in record["image"]]
+        cards.append(CARD_TEMPLATE.format(
+            href=html.escape(record["url"][len(BASE_URL):]),
+            sources="".join(f'<source srcset="{html.escape(path)}">' for path in paths[:-1]),
+            img=html.escape(paths[-1]) if paths else "",
+            category=html.escape(record["category"] or ""),
+            title=html.escape(record["title"] or ""),
+            price=html.escape(record["price"] or ""),
+            unit=html.escape(record["unit"] or "")))
+    return f'<ul class="ProductList_productList__list__3-dGs">{"".join(cards)}</ul>'
+
+
+def column_lists(scraper,page_html):
+    """The former extraction: seven `getall()` columns, then one dict per index."""
+    selector = Selector(text=page_html)
+    product_url = selector.xpath('//a[@class="Link_link__1AZfr ProductCard_card__img_link__2bBqA"]/@href').getall()
+    id = [i.split('/')[-1] for i in product_url]
+    product_url = [scraper.url+i for i in product_url]
+    product_name = selector.xpath('.//h2[@class="ProductCard_card__title__text__uiWLe"]/a/text()').getall()
+    price = selector.xpath('.//span[@class="ProductPrice_productPrice__price__3-50j"]/text()').getall()
+    category = selector.xpath('.//a[@class="Link_link__1AZfr ProductCard_card__category__Hh3rT"]/text()').getall()
+    unit = [i.strip("/") for i in selector.xpath('.//span[@class="ProductPrice_productPrice__unit__2jvkA"]/text()').getall()]
+    image_url = []
+    for li in selector.xpath('//ul[@class="ProductList_productList__list__3-dGs"]/li'):
+        all_urls = li.xpath('.//source/@srcset').getall() + li.xpath('.//img/@src').getall()
+        image_url.append([scraper.url+i.strip() if i.strip().endswith(".webp") else scraper.url+i.strip()+".webp" for i in all_urls])
+    columns = {"id": id, "title": product_name, "url": product_url, "price": price,
+               "category": category, "unit": unit, "image": image_url}
+    return [{key: values[i] for key,values in columns.items()} for i in range(len(product_name))]
+
+
+def product_cards(scraper,page_html):
+    return scraper.parse_listing_page(scraper.SELECTORS["listing"].extract_page(page_html))
+
+
+def measure(name,extract,scraper,page_html,no_of_cards):
+    tracemalloc.start()
+    started = time.perf_counter()
+    products = extract(scraper,page_html)
+    elapsed = time.perf_counter() - started
+    _,peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_10k = 10000 / max(1,len(products))
+    return {
+        "name": name,
+        "products": len(products),
+        "seconds_per_10k_cards": round(elapsed * per_10k, 4),
+        "peak_mb_per_10k_cards": round(peak * per_10k / 2**20, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cards", type=int, default=10000, help="Cards in the rendered listing page.")
+    parser.add_argument("--html", help="Saved listing HTML to parse instead of a rendered page.")
+    args = parser.parse_args(argv)
+    if args.html:
+        with open(args.html, 'r') as file:
+            page_html = file.read()
+    else:
+        with open(os.path.join(ROOT, "output", "traderjoes.json"), 'r') as file:
+            page_html = render_listing(json.load(file),args.cards)
+
+    scraper = Traderjoes(BASE_URL)
+    results = [measure("column_lists",column_lists,scraper,page_html,args.cards),
+               measure("product_cards",product_cards,scraper,page_html,args.cards)]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark of output validation: the former load-everything, one-pass-per-check
+validation against the streaming single-pass engine of `validation.py`, sequential
+and sharded over worker processes.
+
+Usage:
+    python benchmarks/validation_bench.py [--records 10000] [--file output.json] [--workers 4] [--shard-mb 8]
+
+Without `--file` a Foreignfortune-like output is written from the records of
+`output/foreignfortune.json`, repeated with new ids until it holds `--records`
+records. Each mode runs in its own process, so its peak RSS is its own (the
+parallel mode reports its parent's; each worker holds about one shard's state).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validation
+
+MANDATORY_KEYS = ["id","title","price","vendor"]
+WORKERS = os.cpu_count()
+SHARD_MB = 8
+
+
+def write_records(path,no_of_records):
+    with open(os.path.join(ROOT, "output", "foreignfortune.json"), 'r') as file:
+        records = json.load(file)
+    with open(path, 'w') as file:
+        file.write("[")
+        for index in range(no_of_records):
+            record = dict(records[index % len(records)], id=index)
+            file.write(("," if index else "") + "\n    " + json.dumps(record, indent=4).replace("\n", "\n    "))
+        file.write("\n]")
+
+
+def load_and_pass_per_check(file_path,report_path):
+    """The former validation: `json.load`, one pass per check, whole invalid records copied into the report."""
+    validator = validation.Validation()
+    ff_validator = validator.FFValidation()
+    data = validator.read_json_from_path(file_path)
+    report = {
+        "ff_invalid_data": {"invalid_entries": ff_validator.validate_mandatory_keys(data, MANDATORY_KEYS)},
+        "ff_rate_diff": ff_validator.calculate_rate_difference(data),
+        "ff_variants": ff_validator.check_variants_images_prices(data),
+    }
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=4)
+    return len(data)
+
+
+def ff_checks():
+    return [validation.MandatoryKeysCheck("ff_invalid_data", MANDATORY_KEYS),
+            validation.RateDifferenceCheck("ff_rate_diff"),
+            validation.VariantsCheck("ff_variants")]
+
+
+def streaming_single_pass(file_path,report_path):
+    stats = validation.run_validation({file_path: ff_checks()}, output_path=report_path)
+    return stats[file_path]["records"]
+
+
+def parallel_shards(file_path,report_path,workers=WORKERS,shard_mb=SHARD_MB):
+    stats = validation.run_parallel_validation({file_path: ff_checks()}, output_path=report_path,
+                                               workers=workers, shard_mb=shard_mb)
+    return stats[file_path]["records"]
+
+
+MODES = {
+    "load_and_pass_per_check": load_and_pass_per_check,
+    "streaming_single_pass": streaming_single_pass,
+    "parallel_shards": parallel_shards,
+}
+
+
+def run_mode(name,file_path,report_path,**options):
+    started = time.perf_counter()
+    records = MODES[name](file_path,report_path,**options)
+    seconds = time.perf_counter() - started
+    return {
+        "name": name,
+        "records": records,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(records / seconds),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000, help="Records in the generated output file.")
+    parser.add_argument("--file", help="Foreignfortune output file to validate instead of a generated one.")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes of the parallel mode.")
+    parser.add_argument("--shard-mb", type=float, default=SHARD_MB, help="Shard size of the parallel mode.")
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = args.file
+        if not file_path:
+            file_path = os.path.join(directory, "foreignfortune.json")
+            write_records(file_path,args.records)
+        file_mb = round(os.path.getsize(file_path) / 2**20, 1)
+        results = []
+        for name in MODES:
+            report_path = os.path.join(directory, f"{name}.json")
+            options = {"workers": args.workers, "shard_mb": args.shard_mb} if name == "parallel_shards" else {}
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results.append(executor.submit(run_mode,name,file_path,report_path,**options).result())
+        legacy, streaming, parallel = (os.path.join(directory, f"{name}.json") for name in MODES)
+        with open(legacy, 'r') as file:
+            legacy_report = json.load(file)
+        with open(streaming, 'r') as file:
+            streaming_report = file.read()
+        with open(parallel, 'r') as file:
+            same_parallel = file.read() == streaming_report
+        streaming_report = json.loads(streaming_report)
+        same = {key: legacy_report[key] == streaming_report[key] for key in ("ff_rate_diff", "ff_variants")}
+        same["parallel_identical_to_streaming"] = same_parallel
+    print(json.dumps({"file_mb": file_mb, "results": results, "same_report_sections": same}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import signal
+import logging
+from collections import Counter
+
+
+class Checkpoint():
+    """
+    Crawl frontier checkpoint used to resume an interrupted crawl.
+
+    The frontier (categories already walked, discovered product URLs, next listing
+    page, ...) is a small JSON document kept in `<output_path>.checkpoint.json` and
+    rewritten atomically. The set of already-emitted records is not stored here: it is
+    rebuilt from the sink's NDJSON file with `NdjsonSink.recover()`, so it always
+    matches what actually reached the disk.
+
+    Args:
+        output_path (str): Final `.json` output path of the scraper.
+        sink (utility.NdjsonSink): The sink the scraper writes to.
+        key (str): Record field identifying an emitted record.
+        resume (bool): Load the previous frontier and recover the sink instead of starting over.
+    """
+    def __init__(self,output_path,sink,key,resume=False):
+        self.path = f"{output_path}.checkpoint.json"
+        self.sink = sink
+        self.frontier = {}
+        self.emitted = Counter()
+        if resume:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as file:
+                    self.frontier = json.load(file)
+            self.emitted = sink.recover(key)
+            logging.info(f"Resuming from {self.path}: {sink.count} records already written")
+
+    def already_emitted(self,key_value):
+        """
+        Returns True, once per recovered record, for a record that the interrupted run
+        already wrote. Counting occurrences keeps products listed in several categories
+        emitted as often as in an uninterrupted run.
+        """
+        if self.emitted[key_value] > 0:
+            self.emitted[key_value] -= 1
+            return True
+        return False
+
+    def get(self,name,default=None):
+        return self.frontier.get(name, default)
+
+    def save(self,**frontier):
+        """
+        Updates the frontier and writes it atomically.
+
+        The sink is fsynced first, so every record emitted before this checkpoint is on disk.
+        """
+        self.frontier.update(frontier)
+        if self.sink._file is not None:
+            self.sink.sync()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.frontier, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def exit_on_sigterm():
+    """
+    Turns SIGTERM from the scheduler into `SystemExit`, so sinks are flushed and the
+    checkpoint is kept instead of the process dying mid-write.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
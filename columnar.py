@@ -0,0 +1,312 @@
+import os
+import json
+import logging
+import metrics
+from validation import iter_records
+from serializers import COMPRESSIONS, compression_of
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+BATCH_SIZE = 10000
+# Column of the products table listing the keys a record did not have, so a missing
+# key can be told apart from a key whose value is null.
+MISSING_KEYS = "_missing_keys"
+SCALAR_TYPES = {"bool": "bool_", "int": "int64", "float": "float64", "str": "string"}
+
+
+def require_arrow():
+    if pa is None:
+        raise RuntimeError("Columnar output needs pyarrow: pip install pyarrow")
+
+
+def dataset_paths(output_path,format="parquet"):
+    """
+    Returns the paths of the columnar dataset written next to a JSON output file,
+    e.g. "output/foreignfortune.products.parquet" and "output/foreignfortune.variants.parquet".
+    """
+    stem = os.path.splitext(output_path[:-len(COMPRESSIONS[compression_of(output_path)])]
+                            if compression_of(output_path) else output_path)[0]
+    return {table: f"{stem}.{table}{FORMATS[format]}" for table in ("products", "variants")}
+
+
+class ColumnTypes():
+    """
+    Infers the Arrow type of every key of a stream of records: one scalar type per key
+    (ints and floats widen to float64), lists of one scalar type as Arrow lists, and
+    anything else (nested objects, mixed types) as a JSON string column.
+    """
+    def __init__(self):
+        self.types = {}
+        self.item_types = {}
+
+    def observe(self,record):
+        for key,value in record.items():
+            type_name = type(value).__name__
+            self.types.setdefault(key,set()).add(type_name)
+            if type_name == "list":
+                self.item_types.setdefault(key,set()).update(type(item).__name__ for item in value)
+
+    @staticmethod
+    def scalar_type(type_names):
+        type_names = set(type_names) - {"NoneType"}
+        if type_names == {"int", "float"}:
+            type_names = {"float"}
+        if len(type_names) == 1 and next(iter(type_names)) in SCALAR_TYPES:
+            return getattr(pa, SCALAR_TYPES[type_names.pop()])()
+        if not type_names:
+            return pa.string()
+        return None
+
+    def field(self,key):
+        """Returns (Arrow field, whether its values are stored as JSON text)."""
+        type_names = self.types[key] - {"NoneType"}
+        if type_names == {"list"}:
+            item_type = self.scalar_type(self.item_types.get(key, ()))
+            if item_type is not None:
+                return pa.field(key, pa.list_(item_type)), False
+        arrow_type = self.scalar_type(type_names)
+        if arrow_type is None:
+            return pa.field(key, pa.string()), True
+        return pa.field(key, arrow_type), False
+
+
+class TableWriter():
+    """
+    Writes rows in batches of `batch_size` to a Parquet or Arrow IPC file with a fixed
+    schema, through a temporary file and `os.replace`.
+    """
+    def __init__(self,path,fields,format="parquet",batch_size=BATCH_SIZE):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.batch_size = batch_size
+        self.json_columns = [field.name for field,as_json in fields if as_json]
+        self.schema = pa.schema([field for field,_ in fields],
+                                metadata={"json_columns": json.dumps(self.json_columns)})
+        self.rows = []
+        self.count = 0
+        if format == "parquet":
+            self._writer = pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd")
+        else:
+            self._sink = pa.OSFile(self.tmp_path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+
+    def add(self,row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = []
+        for field in self.schema:
+            values = [row.get(field.name) for row in self.rows]
+            if field.name in self.json_columns:
+                values = [None if value is None else json.dumps(value, ensure_ascii=False) for value in values]
+            columns.append(pa.array(values, type=field.type))
+        self._writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def write_dataset(records,output_path,format="parquet",nested_key="variants",batch_size=BATCH_SIZE):
+    """
+    Writes records as a columnar dataset next to `output_path` (see `dataset_paths()`).
+
+    This function performs the following steps:
+    1. Reads the records once to infer a type for every column (see `ColumnTypes`).
+    2. Reads them again and writes a products table, one row per record, with the keys
+       each record lacks in `_missing_keys`.
+    3. Writes the list of `nested_key` of every record (Foreignfortune's variants) to a
+       variants table, one row per item, linked to its product by `product_index` (the
+       row of the product) and `product_id`. Sites without such lists get no variants table.
+
+    Args:
+        records (callable): Returns a fresh iterable of the records each time it is called,
+            e.g. `lambda: iter_records(path)`, so the records never have to fit in memory.
+        output_path (str): The JSON output file the dataset belongs to.
+        format (str): "parquet" or "arrow" (Arrow IPC / Feather v2).
+
+    Returns:
+        dict: Table name -> number of rows written.
+    """
+    require_arrow()
+    product_types,variant_types = ColumnTypes(),ColumnTypes()
+    for record in records():
+        product_types.observe(record)
+        for variant in record.get(nested_key) or ():
+            if isinstance(variant,dict):
+                variant_types.observe(variant)
+    has_variants = bool(variant_types.types)
+    product_keys = [key for key in product_types.types if not (has_variants and key == nested_key)]
+    id_field,id_as_json = product_types.field("id") if "id" in product_types.types else (pa.field("id", pa.string()), False)
+    paths = dataset_paths(output_path,format)
+    with metrics.span("columnar",output=os.path.basename(output_path),format=format):
+        products = TableWriter(paths["products"],
+                               [product_types.field(key) for key in product_keys] +
+                               [(pa.field(MISSING_KEYS, pa.list_(pa.string())), False)],
+                               format,batch_size)
+        variants = None
+        if has_variants:
+            variants = TableWriter(paths["variants"],
+                                   [(pa.field("product_index", pa.int64()), False),
+                                    (pa.field("product_id", id_field.type), id_as_json),
+                                    (pa.field("variant_index", pa.int32()), False)] +
+                                   [variant_types.field(key) for key in variant_types.types
+                                    if key not in ("product_index", "product_id", "variant_index")],
+                                   format,batch_size)
+        for index,record in enumerate(records()):
+            products.add(dict(record, **{MISSING_KEYS: [key for key in product_types.types if key not in record]}))
+            if variants is not None:
+                for variant_index,variant in enumerate(record.get(nested_key) or ()):
+                    if isinstance(variant,dict):
+                        variants.add(dict(variant, product_index=index, product_id=record.get("id"), variant_index=variant_index))
+        products.close()
+        counts = {"products": products.count}
+        if variants is not None:
+            variants.close()
+            counts["variants"] = variants.count
+        elif os.path.exists(paths["variants"]):
+            os.remove(paths["variants"])
+    logging.info(f"Wrote columnar dataset of {output_path}: {counts}")
+    return counts
+
+
+def convert(output_path,format="parquet",nested_key="variants"):
+    """Writes the columnar dataset of a JSON list or NDJSON output file, streaming it twice."""
+    return write_dataset(lambda: iter_records(output_path),output_path,format,nested_key)
+
+
+def read_table(path,columns=None):
+    """Reads a Parquet or Arrow IPC table, only the given `columns` if any."""
+    require_arrow()
+    if path.endswith(FORMATS["parquet"]):
+        return pq.read_table(path, columns=columns)
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_schema(path):
+    require_arrow()
+    if path.endswith(FORMATS["parquet"]):
+        return pq.read_schema(path)
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).schema
+
+
+def missing_keys(products,mandatory_keys,column_names=None):
+    """
+    Vectorised `Validation.FFValidation.missing_keys()`: the records of a products table
+    missing a mandatory key, as report entries {"id", "index", "reason"} in row order.
+
+    `column_names` are the columns of the file when `products` holds only some of them.
+    """
+    missing = {}
+    absent = [key for key in mandatory_keys if key not in (column_names or products.column_names)]
+    if absent:
+        missing = {index: [] for index in range(products.num_rows)}
+    if MISSING_KEYS in products.column_names:
+        column = products.column(MISSING_KEYS)
+        flat = pc.list_flatten(column)
+        hits = pc.is_in(flat, value_set=pa.array(mandatory_keys, type=pa.string()))
+        for index in pc.filter(pc.list_parent_indices(column), hits).to_pylist():
+            missing.setdefault(index, [])
+    if not missing:
+        return []
+    rows = sorted(missing)
+    ids = (pc.take(products.column("id"), pa.array(rows)).to_pylist() if "id" in products.column_names
+           else [None] * len(rows))
+    row_missing = (pc.take(products.column(MISSING_KEYS), pa.array(rows)).to_pylist()
+                   if MISSING_KEYS in products.column_names else [[] for _ in rows])
+    entries = []
+    for index,record_id,lacking in zip(rows, ids, row_missing):
+        keys = [key for key in mandatory_keys if key in absent or key in lacking]
+        entries.append({"id": record_id, "index": index, "reason": f"missing keys: {', '.join(keys)}"})
+    return entries
+
+
+def rate_differences(products):
+    """
+    Vectorised `Validation.FFValidation.rate_difference()`: a table of `id`, `price`
+    (price_min) and `rate_difference` (price_max - price_min, missing prices as 0).
+    """
+    zeros = pa.scalar(0, pa.int64())
+    price_min = (pc.fill_null(products.column("price_min"), zeros) if "price_min" in products.column_names
+                 else pa.array([0] * products.num_rows, pa.int64()))
+    price_max = (pc.fill_null(products.column("price_max"), zeros) if "price_max" in products.column_names
+                 else pa.array([0] * products.num_rows, pa.int64()))
+    return pa.table({"id": products.column("id"), "price": price_min,
+                     "rate_difference": pc.subtract(price_max, price_min)})
+
+
+def variant_checks(products,variants):
+    """
+    Vectorised `Validation.FFValidation.variant_checks()`: a table of `product_index`,
+    `product_id`, `images_exist` (the product has images) and `price_exists` (the
+    variant has a non-null price), one row per variant.
+    """
+    images = products.column("images") if "images" in products.column_names else None
+    if images is None:
+        has_images = pa.array([False] * products.num_rows)
+    elif pa.types.is_list(images.type):
+        has_images = pc.fill_null(pc.greater(pc.list_value_length(images), 0), False)
+    else:
+        has_images = pc.fill_null(pc.and_(pc.is_valid(images), pc.not_equal(images, "[]")), False)
+    product_index = variants.column("product_index")
+    price_exists = (pc.is_valid(variants.column("price")) if "price" in variants.column_names
+                    else pa.array([False] * variants.num_rows))
+    return pa.table({"product_index": product_index, "product_id": variants.column("product_id"),
+                     "images_exist": pc.take(has_images, product_index), "price_exists": price_exists})
+
+
+def validate(output_path,mandatory_keys,format="parquet"):
+    """
+    Runs the Foreignfortune checks of `validation.SITE_CHECKS` on the columnar dataset
+    of `output_path`, reading only the columns each check needs.
+
+    Returns:
+        dict: The report sections as `validation.run_validation()` writes them:
+        {"invalid_data": {"invalid_entries": [...]}, "rate_diff": {id: ...}, "variants": {id: ...}}.
+    """
+    paths = dataset_paths(output_path,format)
+    schema_names = read_schema(paths["products"]).names
+    needed = [name for name in ("id", "price_min", "price_max", "images", MISSING_KEYS) if name in schema_names]
+    products = read_table(paths["products"], columns=needed)
+    report = {"invalid_data": {"invalid_entries": missing_keys(products, mandatory_keys, schema_names)}}
+
+    rate_diff = {}
+    table = rate_differences(products)
+    for record_id,price,difference in zip(*(table.column(name).to_pylist() for name in table.column_names)):
+        rate_diff.setdefault(str(record_id), [{"price": price}, {"rate_difference": difference}])
+    report["rate_diff"] = rate_diff
+
+    checks = {}
+    product_ids = products.column("id").to_pylist()
+    if os.path.exists(paths["variants"]):
+        variants = read_table(paths["variants"], columns=[name for name in ("product_index", "product_id", "price")
+                                                          if name in read_schema(paths["variants"]).names])
+        table = variant_checks(products, variants)
+        for product_index,images_exist,price_exists in zip(table.column("product_index").to_pylist(),
+                                                          table.column("images_exist").to_pylist(),
+                                                          table.column("price_exists").to_pylist()):
+            checks.setdefault(product_index, []).append({"images_exist": images_exist, "price_exists": price_exists})
+    variants_report = {}
+    for product_index,record_id in enumerate(product_ids):
+        variants_report.setdefault(str(record_id), checks.get(product_index, []))
+    report["variants"] = variants_report
+    return report
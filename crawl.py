@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import utility
+import metrics
+import checkpoint
+import columnar
+import snapshots
+import serializers
+import responsecache
+from foreignfortune import Foreignfortune
+from lechocolat import Lechocolat
+from traderjoes import Traderjoes
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LEVEL = logging.INFO
+
+SITE_REGISTRY = {}
+
+
+def register_site(name,scraper,url,output_file,**options):
+    """
+    Registers a site for the orchestrator.
+
+    Args:
+        name (str): Name used on the command line.
+        scraper (type): Scraper class; constructed as `scraper(url, **options)`.
+        url (str): Site base URL.
+        output_file (str): File name of the site's output inside the output directory.
+        options: Per-site limits and settings passed to the scraper constructor.
+    """
+    SITE_REGISTRY[name] = {"scraper": scraper, "url": url, "output_file": output_file, "options": options}
+
+
+register_site("foreignfortune", Foreignfortune, "https://foreignfortune.com", "foreignfortune.json",
+              no_of_tabs=8, max_per_host=8)
+register_site("lechocolat", Lechocolat, "https://www.lechocolat-alainducasse.com/uk/", "lechocolat.json")
+register_site("traderjoes", Traderjoes, "https://www.traderjoes.com", "traderjoes.json", no_of_tabs=4)
+
+
+def combined_resource_policy(names):
+    """Allows the union of the resource types and domains declared by the selected scrapers."""
+    allowed_types = set()
+    allowed_domains = set()
+    for name in names:
+        policy = SITE_REGISTRY[name]["scraper"].RESOURCE_POLICY
+        allowed_types.update(policy["allowed_types"])
+        allowed_domains.update(policy["allowed_domains"])
+    return utility.ResourcePolicy(allowed_types=allowed_types,allowed_domains=allowed_domains)
+
+
+async def crawl_sites(names,output_dir="./output",incremental=False,resume=False,no_of_browsers=1,cache_options=None,
+                      columnar_format=None,snapshot=False,serializer_options=None):
+    """
+    Crawls several sites concurrently in one event loop.
+
+    This function performs the following steps:
+    1. Starts one HTTP fetcher and one browser pool shared by every selected scraper.
+       The browser pool is only launched if a selected scraper declares a browser page type,
+       and never when replaying from the response cache.
+    2. Opens the response cache described by `cache_options` (`responsecache.ResponseCache` arguments), if any.
+    3. Runs `write_output()` of every scraper concurrently; each writes its own output file,
+       encoded as `serializer_options` (`serializers.Serializer` arguments) say, and keeps
+       its own per-host scheduler. A compressed output file gets the compression's extension.
+    4. With `columnar_format`, converts every finished output file to a columnar dataset
+       (`columnar.convert()`) in a worker thread, while the other sites keep crawling.
+       With `snapshot=True`, records it in the site's snapshot store (`snapshots.snapshot_output()`) the same way.
+    5. Closes the shared backends and the cache.
+
+    The duration and record count of every site are recorded in `metrics.REGISTRY`.
+
+    Returns:
+        dict: Site name -> number of records written, or the exception that stopped it.
+    """
+    replay = bool(cache_options) and cache_options.get("mode") == "replay"
+    scrapers_needing_browser = [name for name in names
+                                if "browser" in SITE_REGISTRY[name]["scraper"].PAGE_BACKENDS.values()] if not replay else []
+    shared_fetchers = {"http": utility.HttpFetcher()}
+    if scrapers_needing_browser:
+        pool = utility.BrowserPool(no_of_browsers=no_of_browsers,
+                                   resource_policy=combined_resource_policy(scrapers_needing_browser))
+        shared_fetchers["browser"] = utility.BrowserFetcher(pool=pool)
+        await pool.start()
+    for fetcher in shared_fetchers.values():
+        await fetcher.start()
+    cache = responsecache.ResponseCache(**cache_options) if cache_options else None
+
+    async def run(name):
+        site = SITE_REGISTRY[name]
+        serializer = serializers.Serializer(**serializer_options) if serializer_options else serializers.DEFAULT
+        scraper = site["scraper"](site["url"],shared_fetchers=shared_fetchers,cache=cache,serializer=serializer,**site["options"])
+        output_path = os.path.join(output_dir,site["output_file"] + serializer.suffix)
+        started = time.perf_counter()
+        try:
+            count = await scraper.write_output(output_path,incremental=incremental,resume=resume)
+        except Exception as err:
+            metrics.count("crawl_site_failures_total",site=name,type=type(err).__name__)
+            raise
+        finally:
+            metrics.set_gauge("crawl_site_duration_seconds",round(time.perf_counter() - started,3),site=name)
+        metrics.set_gauge("crawl_site_records",count,site=name)
+        loop = asyncio.get_running_loop()
+        if columnar_format:
+            await loop.run_in_executor(None,columnar.convert,output_path,columnar_format)
+        if snapshot:
+            await loop.run_in_executor(None,snapshots.snapshot_output,output_path,name)
+        return count
+
+    try:
+        results = await asyncio.gather(*[run(name) for name in names],return_exceptions=True)
+    finally:
+        for fetcher in shared_fetchers.values():
+            await fetcher.close()
+        if "browser" in shared_fetchers:
+            await shared_fetchers["browser"].pool.close()
+        if cache is not None:
+            cache.close()
+    return dict(zip(names,results))
+
+
+class SiteFailed(Exception):
+    """
+    The error that stopped a site crawled in its own process, as its `repr()`: the error
+    itself may not survive pickling (e.g. aiohttp's `ClientResponseError` and its headers).
+    """
+
+def crawl_site_in_process(name,output_dir,incremental,resume,cache_options,columnar_format=None,snapshot=False,
+                          serializer_options=None):
+    """
+    Process pool entry point: crawls one site with its own event loop and backends.
+
+    Returns:
+        tuple: The site's result (or a `SiteFailed` with the exception that stopped it) and a
+        `metrics.Metrics.snapshot()` of the process, merged by the parent in both cases.
+    """
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    checkpoint.exit_on_sigterm()
+    result = asyncio.run(crawl_sites([name],output_dir=output_dir,incremental=incremental,resume=resume,
+                                     cache_options=cache_options,columnar_format=columnar_format,
+                                     snapshot=snapshot,serializer_options=serializer_options))[name]
+    if isinstance(result,BaseException):
+        result = SiteFailed(repr(result))
+    return result, metrics.REGISTRY.snapshot()
+
+
+def crawl_sites_in_processes(names,output_dir="./output",incremental=False,resume=False,max_workers=None,cache_options=None,
+                             columnar_format=None,snapshot=False,serializer_options=None):
+    """
+    Crawls every site in its own process. Nothing is shared between sites, but parsing
+    of one site no longer competes for the same CPU core as the others. The metrics of
+    every site process, finished or failed, are merged into `metrics.REGISTRY`.
+
+    Returns:
+        dict: Site name -> number of records written, or the exception that stopped it.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers or len(names)) as executor:
+        futures = {name: executor.submit(crawl_site_in_process,name,output_dir,incremental,resume,cache_options,
+                                       columnar_format,snapshot,serializer_options)
+                   for name in names}
+        for name,future in futures.items():
+            try:
+                result,snapshot = future.result()
+                metrics.REGISTRY.merge(snapshot)
+                results[name] = result
+            except Exception as err:
+                results[name] = err
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Crawl one or more registered sites.")
+    parser.add_argument("--sites", nargs="+", choices=sorted(SITE_REGISTRY), default=sorted(SITE_REGISTRY),
+                        help="Sites to crawl (default: all registered sites).")
+    parser.add_argument("--output-dir", default="./output", help="Directory for the output files.")
+    parser.add_argument("--processes", action="store_true", help="Run each site in its own process.")
+    parser.add_argument("--browsers", type=int, default=1, help="Browsers in the shared pool (single-loop mode).")
+    parser.add_argument("--incremental", action="store_true", help="Skip unchanged products using the crawl state.")
+    parser.add_argument("--resume", action="store_true", help="Continue interrupted crawls from their checkpoints.")
+    parser.add_argument("--cache-dir", help="Directory of the on-disk response cache (default: no cache).")
+    parser.add_argument("--cache-mode", choices=responsecache.CACHE_MODES, default="read-through",
+                        help="read-through fetches and stores misses; replay serves the cache only, without network.")
+    parser.add_argument("--cache-ttl", type=float, help="Seconds after which cached responses are refetched.")
+    parser.add_argument("--cache-max-mb", type=int, default=1024, help="Cache size above which old entries are evicted.")
+    parser.add_argument("--metrics", help="Write the run's metrics to this file at the end: Prometheus "
+                                           "text for a .prom file, a JSON summary otherwise.")
+    parser.add_argument("--columnar", choices=sorted(columnar.FORMATS),
+                        help="Also write every output as a columnar dataset (products and variants tables); needs pyarrow.")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Record every output in its snapshot store, for `snapshots.py diff` and price history.")
+    parser.add_argument("--serializer", choices=serializers.BACKENDS, default="json",
+                        help="JSON backend of the output files; auto picks orjson or msgspec when installed.")
+    parser.add_argument("--compact", action="store_true", help="Write the output files without indentation.")
+    parser.add_argument("--compress", choices=sorted(serializers.COMPRESSIONS),
+                        help="Compress the output files; .gz or .zst is added to their names.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    checkpoint.exit_on_sigterm()
+    names = list(dict.fromkeys(args.sites))
+    if args.columnar:
+        columnar.require_arrow()
+    serializer_options = {"backend": args.serializer, "indent": None if args.compact else 4, "compression": args.compress}
+    # Fails now rather than after the crawl when the backend or the compressor is not installed.
+    serializers.Serializer(**serializer_options)
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache_options = None
+    if args.cache_dir:
+        cache_options = {"directory": args.cache_dir, "mode": args.cache_mode,
+                         "ttl": args.cache_ttl, "max_bytes": args.cache_max_mb * 1024**2}
+    if args.processes:
+        results = crawl_sites_in_processes(names,args.output_dir,args.incremental,args.resume,cache_options=cache_options,
+                                           columnar_format=args.columnar,snapshot=args.snapshot,
+                                           serializer_options=serializer_options)
+    else:
+        results = asyncio.run(crawl_sites(names,args.output_dir,args.incremental,args.resume,args.browsers,cache_options,
+                                          args.columnar,args.snapshot,serializer_options))
+    failed = False
+    for name,result in results.items():
+        if isinstance(result,BaseException):
+            failed = True
+            logging.error(f"{name}: failed with {result!r}")
+        else:
+            logging.info(f"{name}: {result} records written")
+    if args.metrics:
+        metrics.REGISTRY.write(args.metrics)
+        logging.info(f"Metrics written to {args.metrics}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
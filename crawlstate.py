@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import serializers
+
+
+def content_hash(record):
+    """
+    Returns a stable SHA-256 hex digest of a scraped record.
+
+    The record is serialised with sorted keys so that the hash only changes when
+    the scraped content changes, not when dictionary ordering does.
+    """
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CrawlState():
+    """
+    Persistent per-URL crawl state used for incremental (delta) crawls.
+
+    For every product URL the store keeps the id of the record it produced, the
+    ETag / Last-Modified validators of the last response, the content hash of the
+    record and the time of the last fetch. Together with the records of the
+    previous output file this lets a scraper send conditional requests, reuse the
+    previous record on "304 Not Modified" and count what actually changed.
+
+    Args:
+        db_path (str): Path of the SQLite database file.
+        commit_every (int): Number of updates between two commits.
+    """
+    def __init__(self,db_path,commit_every=100):
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                record_id TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                fetched_at REAL
+            )""")
+        self.connection.commit()
+        self.previous_records = {}
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0}
+        self._pending = 0
+
+    def load_previous_output(self,output_path,key="id"):
+        """
+        Indexes the records of the previous output file by `key`.
+
+        Only URLs whose record is present in the previous output are fetched
+        conditionally; anything else is fetched in full.
+        """
+        if not os.path.exists(output_path):
+            return
+        self.previous_records = {str(record[key]): record for record in serializers.read_json(output_path) if key in record}
+        logging.info(f"Loaded {len(self.previous_records)} records from previous output {output_path}")
+
+    def get(self,url):
+        return self.connection.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def conditional_headers(self,url):
+        """
+        Returns the If-None-Match / If-Modified-Since headers for `url`, or an empty
+        dict when there is no previous record to fall back on.
+        """
+        row = self.get(url)
+        if row is None or row["record_id"] not in self.previous_records:
+            return {}
+        headers = {}
+        if row["etag"]:
+            headers["If-None-Match"] = row["etag"]
+        if row["last_modified"]:
+            headers["If-Modified-Since"] = row["last_modified"]
+        return headers
+
+    def previous_record(self,url):
+        """Returns the previous output record produced by `url` and marks it as fetched."""
+        row = self.get(url)
+        self.connection.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+        self._count("unchanged")
+        return self.previous_records[row["record_id"]]
+
+    def update(self,url,record_id,record,etag=None,last_modified=None):
+        """
+        Stores the state of a freshly scraped record.
+
+        Returns:
+            bool: True if the record is new or its content differs from the last crawl.
+        """
+        digest = content_hash(record)
+        row = self.get(url)
+        changed = row is None or row["content_hash"] != digest
+        if row is None:
+            self._count("new")
+        else:
+            self._count("changed" if changed else "unchanged")
+        self.connection.execute(
+            """INSERT INTO pages (url, record_id, etag, last_modified, content_hash, fetched_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET
+                   record_id = excluded.record_id,
+                   etag = excluded.etag,
+                   last_modified = excluded.last_modified,
+                   content_hash = excluded.content_hash,
+                   fetched_at = excluded.fetched_at""",
+            (url, str(record_id), etag, last_modified, digest, time.time()))
+        return changed
+
+    def unchecked_previous(self,seen_ids,dead_letters):
+        """
+        Yields the previous output records, not in `seen_ids`, that this crawl could not check.
+
+        If a listing or category page failed, every product may have been on it, so all of
+        them are carried over; otherwise only those whose own product page failed. A previous
+        record whose pages were all fetched but that was not found again is dropped: the
+        product was delisted.
+
+        Args:
+            seen_ids (set of str): Ids of the records this crawl produced.
+            dead_letters (resilience.DeadLetters): The pages that still failed at the end of the crawl.
+        """
+        listing_failed = any(entry["page_type"] != "product" for entry in dead_letters.entries.values())
+        failed_ids = set()
+        for entry in dead_letters.entries.values():
+            row = self.get(entry["url"]) if entry["page_type"] == "product" else None
+            if row is not None:
+                failed_ids.add(row["record_id"])
+        for record_id,record in self.previous_records.items():
+            if record_id not in seen_ids and (listing_failed or record_id in failed_ids):
+                yield record
+
+    def _count(self,key):
+        self.stats[key] += 1
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+        logging.info(f"Crawl state {self.db_path}: {self.stats}")
+
+
+def open_for_output(output_path,key="id"):
+    """
+    Opens the crawl state kept next to `output_path` (`<output_path>.state.sqlite3`)
+    and loads the records of the previous run from `output_path`.
+    """
+    state = CrawlState(f"{output_path}.state.sqlite3")
+    state.load_previous_output(output_path,key=key)
+    return state
@@ -1,133 +1,421 @@
-import asyncio
 import os
+import asyncio
+import sys
 import json
 import logging
-from parsel import Selector
-from functools import wraps
+from decimal import Decimal
+from urllib.parse import urljoin, urlsplit
+from functools import partial
+import metrics
+import urlfrontier
 import utility 
+import site_selectors
+import checkpoint
+import scheduler
 
 
-def logger(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        log = logging.getLogger(fn.__name__)
-        log.info('About to run %s' % fn.__name__)
-        out = fn(*args, **kwargs)
-        log.info('Done running %s' % fn.__name__)
-        return out
-    return wrapper
-
 FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LEVEL = logging.INFO
-logging.basicConfig(format=FORMAT, level=LEVEL)
 log = logging.getLogger(__name__)
 log.info('Entered module: %s' % __name__)
 
+SHOPIFY_PAGE_LIMIT = 250
+
+class ShopifyEndpointBlocked(Exception):
+    """Raised when the store refuses or disguises its `products.json` endpoints."""
+
+def to_cents(price):
+    """Converts a Shopify decimal price string ("180.00") to integer cents (18000)."""
+    if price in (None, ""):
+        return None
+    return int(Decimal(str(price)) * 100)
+
+def product_handle(url):
+    """Returns the Shopify product handle of a product URL ("/collections/x/products/<handle>")."""
+    return url.split("?")[0].rstrip("/").split("/")[-1]
+
+def strip_scheme(url):
+    """Theme JSON uses protocol-relative asset URLs ("//host/path")."""
+    if url and url.startswith("https:"):
+        return url[len("https:"):]
+    return url
+
+def shopify_product_to_record(product):
+    """
+    Converts one product from Shopify's `products.json` into the theme product JSON
+    that the per-page crawl reads from the product page (`ffProductDetailsXpath`).
+
+    `products.json` does not expose `inventory_management` or `barcode`, so those
+    variant fields are left as None.
+
+    Args:
+        product (dict): One element of the `products` list returned by the endpoint.
+
+    Returns:
+        dict: A record with the same keys as those in `output/foreignfortune.json`.
+    """
+    images = product.get("images") or []
+    image_urls = [strip_scheme(image["src"]) for image in images]
+    tags = product.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
+
+    variants = []
+    for variant in product.get("variants") or []:
+        options = [variant.get(f"option{i}") for i in (1,2,3) if variant.get(f"option{i}") is not None]
+        default_variant = variant.get("title") == "Default Title"
+        featured_image = variant.get("featured_image")
+        if featured_image:
+            featured_image = dict(featured_image, src=strip_scheme(featured_image.get("src")))
+        variants.append({
+            "id": variant["id"],
+            "title": variant.get("title"),
+            "option1": variant.get("option1"),
+            "option2": variant.get("option2"),
+            "option3": variant.get("option3"),
+            "sku": variant.get("sku") or "",
+            "requires_shipping": variant.get("requires_shipping"),
+            "taxable": variant.get("taxable"),
+            "featured_image": featured_image,
+            "available": variant.get("available"),
+            "name": product["title"] if default_variant else f'{product["title"]} - {variant.get("title")}',
+            "public_title": None if default_variant else variant.get("title"),
+            "options": options,
+            "price": to_cents(variant.get("price")),
+            "weight": variant.get("grams", 0),
+            "compare_at_price": to_cents(variant.get("compare_at_price")),
+            "inventory_management": None,
+            "barcode": None,
+            "requires_selling_plan": False,
+            "selling_plan_allocations": [],
+        })
+
+    prices = [v["price"] for v in variants if v["price"] is not None] or [0]
+    compare_prices = [v["compare_at_price"] for v in variants if v["compare_at_price"] is not None]
+    media = [{
+        "alt": image.get("alt"),
+        "id": image.get("id"),
+        "position": image.get("position"),
+        "preview_image": {
+            "aspect_ratio": round(image["width"] / image["height"], 3) if image.get("height") else None,
+            "height": image.get("height"),
+            "width": image.get("width"),
+            "src": strip_scheme(image["src"]),
+        },
+        "aspect_ratio": round(image["width"] / image["height"], 3) if image.get("height") else None,
+        "height": image.get("height"),
+        "media_type": "image",
+        "src": strip_scheme(image["src"]),
+        "width": image.get("width"),
+    } for image in images]
+
+    return {
+        "id": product["id"],
+        "title": product["title"],
+        "handle": product.get("handle"),
+        "description": product.get("body_html") or "",
+        "published_at": product.get("published_at"),
+        "created_at": product.get("created_at"),
+        "vendor": product.get("vendor"),
+        "type": product.get("product_type") or "",
+        "tags": tags,
+        "price": min(prices),
+        "price_min": min(prices),
+        "price_max": max(prices),
+        "available": any(v["available"] for v in variants),
+        "price_varies": min(prices) != max(prices),
+        "compare_at_price": min(compare_prices) if compare_prices else None,
+        "compare_at_price_min": min(compare_prices) if compare_prices else 0,
+        "compare_at_price_max": max(compare_prices) if compare_prices else 0,
+        "compare_at_price_varies": len(set(compare_prices)) > 1,
+        "variants": variants,
+        "images": image_urls,
+        "featured_image": image_urls[0] if image_urls else None,
+        "options": [option["name"] if isinstance(option, dict) else option for option in product.get("options") or []],
+        "media": media,
+        "requires_selling_plan": False,
+        "selling_plan_groups": [],
+        "content": product.get("body_html") or "",
+    }
+
 class Foreignfortune():
-    def __init__(self,url):
+    # Shopify renders navigation, collections and the product JSON server-side,
+    # so no page type needs JavaScript.
+    PAGE_BACKENDS = {
+        "home": "http",
+        "category": "http",
+        "product": "http",
+        "products_json": "http",
+    }
+    # If a page type is switched to the browser, the product JSON is inline in the
+    # document, so every subresource can be blocked.
+    RESOURCE_POLICY = {
+        "allowed_types": ("document",),
+        "allowed_domains": ("foreignfortune.com",),
+    }
+    # Token-bucket rate per host, enforced by `scheduler.Scheduler` on every fetch.
+    REQUESTS_PER_SECOND = 8
+    # Product links of every collection resolve to one canonical /products/<handle> page, see `urlfrontier`.
+    CANONICAL_PATH_RULES = urlfrontier.SHOPIFY_PATH_RULES
+    # Compiled selectors per page type, see `site_selectors`.
+    SELECTORS = site_selectors.FOREIGNFORTUNE
+
+    def __init__(self,url,no_of_tabs=8,max_per_host=8,crawl_mode="pages",shared_fetchers=None,cache=None,serializer=None):
+        """
+        Args:
+            url (str): Store base URL.
+            no_of_tabs (int): Number of concurrent product page workers.
+            max_per_host (int): Maximum concurrent requests to the store.
+            crawl_mode (str): "pages" renders every product page; "json" pages through
+                the Shopify `products.json` endpoints and falls back to "pages" if they are blocked.
+            shared_fetchers (dict): Started fetch backends shared with other scrapers, see `utility.FetcherSet`.
+            cache (responsecache.ResponseCache): Optional on-disk response cache used underneath every fetch.
+            serializer (serializers.Serializer): Encoding and compression of the output file, see `utility.NdjsonSink`.
+        """
         self.url = url
+        self.shared_fetchers = shared_fetchers
+        self.cache = cache
+        self.serializer = serializer
+        self.crawl_mode = crawl_mode
+        self.no_of_tabs = no_of_tabs
+        self.host_limiter = utility.HostLimiter(max_per_host=max_per_host)
+        self.scheduler = scheduler.Scheduler(requests_per_second=self.REQUESTS_PER_SECOND,
+                                             burst=max_per_host,
+                                             max_concurrency=max_per_host)
+        self.state = None
+        self.checkpoint = None
+        self.dead_letters = None
+        self.frontier = None
+
+    async def get_product_data(self,fetchers,url):
+        """
+        Fetches one product page and returns its embedded product JSON.
+
+        On incremental runs (`self.state` set) the request carries the stored ETag /
+        Last-Modified validators, and a "304 Not Modified" reuses the previous record.
+
+        Args:
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
+            url (str): Absolute product URL.
+
+        Returns:
+            dict: The product details parsed from the page's JSON script tag.
+        """
+        headers = self.state.conditional_headers(url) if self.state else None
+        response = await fetchers.extract_response("product",url,self.SELECTORS["product"],headers=headers,wait_selector='//h1[@class="product-single__title"]')
+        if response.status == 304:
+            return self.state.previous_record(url)
+        Product_details = response.data["details"]
+        prod_data = json.loads(Product_details)
+        if self.state:
+            self.state.update(url,prod_data["id"],prod_data,
+                              etag=response.headers.get("ETag"),
+                              last_modified=response.headers.get("Last-Modified"))
+        return prod_data
+
+    async def get_category_urls(self,fetchers):
+        """
+        Reads the site navigation and returns the category name -> absolute URL mapping.
+        """
+        links = await fetchers.extract("home",self.url,self.SELECTORS["home"],wait_selector='//ul[@class="site-nav list--inline site-nav--centered"]')
+        return {link["name"]:self.url + link["url"] for link in links if link["url"]}
+
+    async def get_json_page(self,fetchers,url):
+        """
+        Fetches one `products.json` page and returns its list of products.
 
-    @logger
-    async def get_prod_details(self,page):
+        Raises:
+            ShopifyEndpointBlocked: If the request fails or the body is not the expected JSON
+                (e.g. a password page, a bot challenge or a 4xx/5xx status).
+        """
+        try:
+            body = await fetchers.fetch("products_json",url)
+            return json.loads(body)["products"]
+        except Exception as err:
+            raise ShopifyEndpointBlocked(f"{url}: {err}") from err
+
+    @metrics.traced
+    async def get_prod_details_json(self,fetchers):
+        """
+        Retrieves product details through the Shopify bulk JSON endpoints.
+
+        This method performs the following steps:
+        1. Reads the category URLs from the site navigation, like the per-page crawl.
+        2. For each category, pages through `collections/<handle>/products.json?limit=250&page=N`
+           (or `/products.json` for the "all products" category) until an empty page is returned.
+        3. Converts each product into the theme product JSON with `shopify_product_to_record()`.
+
+        Args:
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
+
+        Yields:
+            dict: Product records, in category and then listing order.
+
+        Raises:
+            ShopifyEndpointBlocked: If any endpoint request is refused.
+        """
+        category_urls = await self.get_category_urls(fetchers)
+        frontier = self.frontier or urlfrontier.Frontier(base=self.url,path_rules=self.CANONICAL_PATH_RULES)
+        for category,url in category_urls.items():
+            path = urlsplit(url).path.rstrip("/")
+            if "/collections/" not in path and path not in ("", "/collections"):
+                raise ShopifyEndpointBlocked(f"category {category} ({url}) is not a collection")
+            endpoint = self.url + (path if "/collections/" in path else "") + "/products.json"
+            page_no = 1
+            while True:
+                products = await self.get_json_page(fetchers,f"{endpoint}?limit={SHOPIFY_PAGE_LIMIT}&page={page_no}")
+                logging.info(f"{category}: page {page_no} returned {len(products)} products")
+                for product in products:
+                    if not frontier.add(f"/products/{product.get('handle')}"):
+                        continue
+                    if self.checkpoint and self.checkpoint.already_emitted(product.get("handle")):
+                        continue
+                    yield shopify_product_to_record(product)
+                if len(products) < SHOPIFY_PAGE_LIMIT:
+                    break
+                page_no += 1
+
+    @metrics.traced
+    async def get_prod_details(self,fetchers):
         """
         Asynchronously retrieves product details from a series of categories on a website.
 
         This method navigates through a list of categories and their respective pages, extracts product URLs, 
-        and collects detailed information for each product.
+        and collects detailed information for each product. Product pages are fetched concurrently by a pool
+        of `self.no_of_tabs` workers, capped per host by `self.host_limiter`; records are yielded as soon
+        as they are scraped, in the order in which product URLs were discovered.
+
+        With a checkpoint (`self.checkpoint`), walked categories and the discovered product URLs are
+        saved after every category, and products already written by an interrupted run are skipped.
+
+        A category or product page that still fails after the retries of `utility.FetcherSet` is
+        skipped and becomes a dead letter; failed product pages are retried once more at the end.
 
         Args:
-            page (puppeteer.Page): The Puppeteer page object used for interacting with the web pages.
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
 
-        Returns:
-            list: A list of dictionaries, each containing product details extracted from the website.
+        Yields:
+            dict: The product details extracted from one product page.
 
         Raises:
-            Exception: If there are issues with navigating pages or extracting data.
+            Exception: If the site navigation cannot be read.
 
         Notes:
             - The method assumes that the page structure and XPaths are consistent with those specified in the code.
             - It uses environment variables to fetch the XPath for product details.
         """
-        try:
-            html_content = await utility.get_html_data(page=page,wait_selector='//ul[@class="site-nav list--inline site-nav--centered"]')
-            selector =  Selector(text=html_content)
-            list_of_category = selector.xpath('//ul[@class="site-nav list--inline site-nav--centered"]/li/a/text()').getall()
-            list_of_category_urls = selector.xpath('//ul[@class="site-nav list--inline site-nav--centered"]/li/a/@href').getall()
-
-            Product_data_list = []
-            category_urls = {k:self.url + v for k,v in zip(list_of_category,list_of_category_urls)}
-
-            ffHeaderXpath = '//h1[@class="collection-hero__title page-width"]'
-            for category,url in category_urls.items():
-                await page.goto(url=url)
-                category_html_data = await utility.get_html_data(page=page,wait_selector=ffHeaderXpath)
-                selector =  Selector(text=category_html_data)
-                check_pagination = selector.xpath(os.environ['ffPaginationXpath']).getall()
+        product_urls = self.checkpoint.get("product_urls",[]) if self.checkpoint else []
+        categories_done = self.checkpoint.get("categories_done",[]) if self.checkpoint else []
+        category_urls = await self.get_category_urls(fetchers)
+
+        ffHeaderXpath = '//h1[@class="collection-hero__title page-width"]'
+        for category,url in category_urls.items():
+            if category in categories_done:
+                continue
+            category_product_urls = []
+            try:
+                category_page = await fetchers.extract("category",url,self.SELECTORS["category"],wait_selector=ffHeaderXpath)
+                check_pagination = category_page["pagination"]
                 check_pagination = ["page1"] if not check_pagination else ["page1"]+check_pagination
                 for page_ in check_pagination:
                     if page_ != "page1":
-                        await page.goto(url= self.url + page_)
-                        html_content = await utility.get_html_data(page=page,wait_selector=ffHeaderXpath)
-                        selector =  Selector(text=html_content)
-
-                        
-                    product_url_list = selector.xpath('//div[@class="grid-view-item product-card"]/a/@href').getall()
-                    for pr_url in product_url_list:
-                        await page.goto(url=self.url+pr_url)
-                        html_content = await utility.get_full_html_data(page=page,wait_selector='//h1[@class="product-single__title"]')
-                        selector =  Selector(text=html_content)
-                        Product_details = selector.xpath(os.environ["ffProductDetailsXpath"]).get()
-                        prod_data = json.loads(Product_details)
-                        Product_data_list.append(prod_data)
-
-            return Product_data_list
-        except Exception as err:
-            raise err
+                        category_page = await fetchers.extract("category",self.url + page_,self.SELECTORS["category"],wait_selector=ffHeaderXpath)
+
+                    product_url_list = [card["url"] for card in category_page["products"] if card["url"]]
+                    category_product_urls.extend([urljoin(self.url,pr_url) for pr_url in product_url_list])
+            except Exception as err:
+                # Not marked as done, so a resumed run walks the category again.
+                logging.error(f"Skipping category {category} ({url}): {err!r}")
+                continue
+            product_urls.extend(category_product_urls)
+            categories_done.append(category)
+            if self.checkpoint:
+                self.checkpoint.save(categories_done=categories_done,product_urls=product_urls)
+
+        # A product listed in several collections is fetched once, products new since the last run first.
+        frontier = self.frontier or urlfrontier.Frontier(base=self.url,path_rules=self.CANONICAL_PATH_RULES)
+        product_urls = frontier.prioritise(product_urls)
+        if self.checkpoint:
+            product_urls = [url for url in product_urls if not self.checkpoint.already_emitted(product_handle(url))]
+
+        async def get_product_or_skip(url):
+            try:
+                return await self.get_product_data(fetchers,url)
+            except Exception as err:
+                logging.error(f"Skipping product {url}: {err!r}")
+                if url not in fetchers.dead_letters:
+                    fetchers.dead_letters.add(url,"product",err)
+                return None
+
+        logging.info(f"Fetching {len(product_urls)} products with {self.no_of_tabs} workers...")
+        async for prod_data in utility.iter_worker_pool(
+                urls=product_urls,
+                handler=get_product_or_skip,
+                no_of_workers=self.no_of_tabs,
+                host_limiter=self.host_limiter):
+            if prod_data is not None:
+                yield prod_data
+        async for prod_data in fetchers.retry_dead_letters("product",partial(self.get_product_data,fetchers)):
+            yield prod_data
 
-    @logger
+    @metrics.traced
     async def GetData(self):
         """
-        Asynchronously retrieves product details from a specified category page using a headless browser.
+        Asynchronously retrieves product details using the fetch backends declared in `PAGE_BACKENDS`.
 
         This method performs the following steps:
-        1. Launches a headless browser and opens a new page.
-        2. Navigates to the product category page using the `base_url` attribute.
-        3. Calls `self.get_prod_details(page)` to fetch product details from all the pages.
-        4. Closes the browser.
-        5. Returns the product details as a dictionary.
+        1. Opens a `utility.FetcherSet`; backends are started lazily on first use.
+        2. In "json" mode calls `self.get_prod_details_json(fetchers)`; if the endpoints are
+           blocked, or in "pages" mode, calls `self.get_prod_details(fetchers)` to fetch product
+           details from all the pages.
+           The JSON path only falls back while nothing has been yielded yet, so records are never duplicated.
+        3. Closes every backend that was started (HTTP session, browser).
 
-        Returns:
-            dict: A dictionary containing product details retrieved from the page.
+        Yields:
+            dict: Product details retrieved from the site, one record at a time.
         """
-        browser = await utility.get_browser()
-        page = await browser.newPage()
-        await page.goto(self.url)
-        logging.info('Sucessfull navigated to Products page...')   
-        
-        Product_data_list = await self.get_prod_details(page)
-
-        await browser.close()
-
-        return Product_data_list
+        backend_options = {"browser": {"no_of_tabs": self.no_of_tabs,
+                                       "resource_policy": utility.ResourcePolicy(**self.RESOURCE_POLICY)}}
+        async with utility.FetcherSet(self.PAGE_BACKENDS,backend_options,scheduler=self.scheduler,shared_fetchers=self.shared_fetchers,cache=self.cache,dead_letters=self.dead_letters) as fetchers:
+            if self.crawl_mode == "json":
+                yielded = 0
+                try:
+                    async for prod_data in self.get_prod_details_json(fetchers):
+                        yielded += 1
+                        yield prod_data
+                    return
+                except ShopifyEndpointBlocked as err:
+                    if yielded:
+                        raise
+                    logging.warning(f"Shopify JSON endpoints unavailable ({err}), falling back to product pages...")
+                    # The product pages cover the catalog instead, so the blocked endpoint is not a failed page.
+                    fetchers.dead_letters.take("products_json")
+            async for prod_data in self.get_prod_details(fetchers):
+                yield prod_data
     
     
-    @logger
-    def output(self,output_path):
+    async def write_output(self,output_path,incremental=False,resume=False):
         """
-        Retrieves product data asynchronously, converts it to a custom JSON format, and saves it to a specified file.
-
-        This method performs the following steps:
-        1. Calls the asynchronous method `GetData()` to fetch product data.
-        2. Converts the fetched data into a custom JSON format using `convert_to_custom_format()`.
-        3. Saves the converted JSON data to a file at the path specified using `utility.output()`.
+        Crawls the site and writes the products to `output_path` with `utility.run_output()`; on
+        incremental runs, unchanged product pages reuse their previous record.
+        """
+        return await utility.run_output(self,self.GetData(),output_path,checkpoint_key="handle",incremental=incremental,resume=resume)
 
+    @metrics.traced
+    def output(self,output_path,incremental=False,resume=False):
         """
-        json_data = asyncio.get_event_loop().run_until_complete(self.GetData())
+        Retrieves product data and saves it to a specified file by running `write_output()` on the event loop.
 
-        return utility.output(json_data,output_path)
+        Returns:
+            int: Number of records written.
+        """
+        return asyncio.get_event_loop().run_until_complete(self.write_output(output_path,incremental=incremental,resume=resume))
 
 
-Foreignfortune("https://foreignfortune.com").output(output_path = "./output/foreignfortune.json")
+if __name__ == "__main__":
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    checkpoint.exit_on_sigterm()
+    Foreignfortune("https://foreignfortune.com").output(output_path = "./output/foreignfortune.json",resume="--resume" in sys.argv)
 
 ### Note not able to replicate discount part Unlock 20% off your first order.
 
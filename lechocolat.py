@@ -1,133 +1,196 @@
 import asyncio
 import os
+import sys
 import json
 import logging
-from parsel import Selector
-from functools import wraps
+from functools import partial
+import metrics
+import urlfrontier
 import utility 
+import site_selectors
+import checkpoint
+import scheduler
 
 
-def logger(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        log = logging.getLogger(fn.__name__)
-        log.info('About to run %s' % fn.__name__)
-        out = fn(*args, **kwargs)
-        log.info('Done running %s' % fn.__name__)
-        return out
-    return wrapper
-
 FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LEVEL = logging.INFO
-logging.basicConfig(format=FORMAT, level=LEVEL)
 log = logging.getLogger(__name__)
 log.info('Entered module: %s' % __name__)
 
 class Lechocolat():
-    def __init__(self,url):
+    # PrestaShop serves complete HTML for every page type, so no page needs JavaScript.
+    PAGE_BACKENDS = {
+        "home": "http",
+        "category": "http",
+        "product": "http",
+    }
+    # If a page type is switched to the browser, only the HTML document is needed.
+    RESOURCE_POLICY = {
+        "allowed_types": ("document",),
+        "allowed_domains": ("lechocolat-alainducasse.com",),
+    }
+    # Politeness limit: token-bucket rate per host, enforced by `scheduler.Scheduler` on every fetch.
+    REQUESTS_PER_SECOND = 1
+    # Product pages have a single URL; only tracking parameters and trailing slashes are normalised, see `urlfrontier`.
+    CANONICAL_PATH_RULES = ()
+    # Compiled selectors per page type, see `site_selectors`.
+    SELECTORS = site_selectors.LECHOCOLAT
+
+    def __init__(self,url,shared_fetchers=None,cache=None,serializer=None):
+        """
+        Args:
+            url (str): Site base URL.
+            shared_fetchers (dict): Started fetch backends shared with other scrapers, see `utility.FetcherSet`.
+            cache (responsecache.ResponseCache): Optional on-disk response cache used underneath every fetch.
+            serializer (serializers.Serializer): Encoding and compression of the output file, see `utility.NdjsonSink`.
+        """
         self.url = url
+        self.shared_fetchers = shared_fetchers
+        self.cache = cache
+        self.serializer = serializer
+        self.state = None
+        self.checkpoint = None
+        self.dead_letters = None
+        self.frontier = None
+
+    async def get_product_data(self,fetchers,url):
+        """
+        Fetches one product page and returns its details.
 
-    @logger
-    async def get_prod_details(self,page):
+        On incremental runs (`self.state` set) the request carries the stored ETag /
+        Last-Modified validators, and a "304 Not Modified" reuses the previous record.
+
+        Args:
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
+            url (str): Absolute product URL.
+
+        Returns:
+            dict: The product ID, image URL, title, category, description, price, weight and URL.
+        """
+        headers = self.state.conditional_headers(url) if self.state else None
+        response = await fetchers.extract_response("product",url,self.SELECTORS["product"],headers=headers)
+        if response.status == 304:
+            return self.state.previous_record(url)
+        fields = response.data
+        product_unit = {}
+        product_unit["id"] = url.split("/")[-1]
+        product_unit['image_url'] = fields["image_url"]
+        product_unit["title"] = fields["title"]
+        product_unit["categoty"] = fields["categoty"]
+        product_unit["description"] = " ".join([desc.strip() for desc in fields["description"]])
+        product_unit["price"] = fields["price"]
+        product_unit["weight"] = fields["weight"]
+        product_unit['url'] = url
+        if self.state:
+            # Keyed by URL: products that differ only in their "#/..." option share the id.
+            self.state.update(url,url,product_unit,
+                              etag=response.headers.get("ETag"),
+                              last_modified=response.headers.get("Last-Modified"))
+        return product_unit
+
+    @metrics.traced
+    async def get_prod_details(self,fetchers):
         """
         Scrapes product details from a website.
 
         This method navigates through category and product pages to collect detailed information about each product. It extracts various attributes such as product ID, image URL, title, category, description, price, weight, and the URL of the product page.
+        With a checkpoint (`self.checkpoint`), each finished category is saved, and on resume finished categories and products already written are skipped.
+        A category or product page that still fails after the retries of `utility.FetcherSet` is skipped and becomes a dead letter; failed product pages are retried once more at the end.
 
         Args:
-            page (pyppeteer.page.Page): The Pyppeteer page object used for navigation and scraping.
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
 
-        Returns:
-            list[dict]: A list of dictionaries where each dictionary contains details of a single product.
+        Yields:
+            dict: The details of a single product, as soon as its page has been scraped.
 
         Raises:
             Exception: If an error occurs during the scraping process, it raises the exception.
         """
         try:
-            html_content = await utility.get_html_data(page=page,wait_selector='//h1[@class="headerLogo__image"]')
-            selector =  Selector(text=html_content)
-            Product_data_list=[]
-            category_urls = selector.xpath('//li[@class="siteMenuItem" and @data-depth="2"]/a/@href').getall()
+            home_page = await fetchers.extract("home",self.url,self.SELECTORS["home"],wait_selector='//h1[@class="headerLogo__image"]')
+            category_urls = home_page["category_urls"]
+            categories_done = self.checkpoint.get("categories_done",[]) if self.checkpoint else []
+            frontier = self.frontier or urlfrontier.Frontier(base=self.url,path_rules=self.CANONICAL_PATH_RULES)
             for cat_url in category_urls:
+                if cat_url in categories_done:
+                    continue
                 print(f"Navigating to {cat_url}")
-                await page.goto(cat_url)
-                html_content = await utility.get_html_data(page=page,wait_selector='//section[@class="productMiniature__data"]')
-                selector =  Selector(text=html_content)
-                each_prod_url = selector.xpath('//section[@class="productMiniature__data"]/a/@href').getall()
+                try:
+                    cards = await fetchers.extract("category",cat_url,self.SELECTORS["category"],wait_selector='//section[@class="productMiniature__data"]')
+                except Exception as err:
+                    log.error(f"Skipping category {cat_url}: {err!r}")
+                    continue
+                # A product shown in several categories is fetched once, products new since the last run first.
+                each_prod_url = frontier.prioritise([card["url"] for card in cards if card["url"]])
                 for n,each_prod in enumerate(each_prod_url):
                     # if n==2:
                         # break
+                    if self.checkpoint and self.checkpoint.already_emitted(each_prod):
+                        continue
                     print(f"Navigating to {each_prod}")
                     try:
-                        product_unit= {}
-                        await page.goto(each_prod)
-                        html_content = await utility.get_html_data(page=page)
-                        selector = Selector(text=html_content)
-                        product_unit["id"] = each_prod.split("/")[-1]
-                        product_unit['image_url'] = selector.xpath('//li[@class="productImages__item keen-slider__slide"]/a/@href').get()
-                        product_unit["title"] = selector.xpath('//h1[@class="productCard__title"]/text()').get()
-                        product_unit["categoty"] = selector.xpath('//h2[@class="productCard__subtitle"]/text()').get()
-                        description = selector.css('div.productAccordion__content > p::text').getall()
-                        product_unit["description"] = " ".join([desc.strip() for desc in description])
-                        product_unit["price"] = selector.css('div.productAccordion__content > p::text').re_first(r'£\d+\.\d+')
-                        product_unit["weight"] = selector.xpath('//p[@class="productCard__weight"]/text()').get()
-                        product_unit['url'] = each_prod
-                        Product_data_list.append(product_unit)
-                        await asyncio.sleep(1)
+                        product_unit = await self.get_product_data(fetchers,each_prod)
                     except Exception as err:
                         id = each_prod.split("/")[-1]
-                        logger.error(f"Error occuered while fetching {id} error : {err}...")
-                        await asyncio.sleep(5) 
+                        log.error(f"Error occuered while fetching {id} error : {err}...")
+                        metrics.count("crawl_errors_total",stage="product",type=type(err).__name__)
+                        if each_prod not in fetchers.dead_letters:
+                            fetchers.dead_letters.add(each_prod,"product",err)
+                        continue
+                    yield product_unit
+                categories_done.append(cat_url)
+                if self.checkpoint:
+                    self.checkpoint.save(categories_done=categories_done)
+            async for product_unit in fetchers.retry_dead_letters("product",partial(self.get_product_data,fetchers)):
+                yield product_unit
 
-            return Product_data_list
         except Exception as err:
-            logger.error(f"Error occuered : {err}...")
-            return Product_data_list
+            log.error(f"Error occuered : {err}...")
+            metrics.count("crawl_errors_total",stage="crawl",type=type(err).__name__)
+            return
 
-    @logger
+    @metrics.traced
     async def GetData(self):
         """
-        Asynchronously retrieves product details from a specified category page using a headless browser.
+        Asynchronously retrieves product details using the fetch backends declared in `PAGE_BACKENDS`.
 
         This method performs the following steps:
-        1. Launches a headless browser and opens a new page.
-        2. Navigates to the product category page using the `base_url` attribute.
-        3. Calls `self.get_prod_details(page)` to fetch product details from all the pages.
-        4. Closes the browser.
-        5. Returns the product details as a dictionary.
+        1. Opens a `utility.FetcherSet`; backends are started lazily on first use.
+        2. Calls `self.get_prod_details(fetchers)` to fetch product details from all the pages.
+        3. Closes every backend that was started (HTTP session, browser).
 
-        Returns:
-            dict: A dictionary containing product details retrieved from the page.
+        Yields:
+            dict: Product details retrieved from the site, one record at a time.
         """
-        browser = await utility.get_browser()
-        page = await browser.newPage()
-        await page.goto(self.url)
-        logging.info('Sucessfull navigated to Products page...')   
-        
-        Product_data_list = await self.get_prod_details(page)
-
-        await browser.close()
-
-        return Product_data_list
+        backend_options = {"browser": {"resource_policy": utility.ResourcePolicy(**self.RESOURCE_POLICY)}}
+        crawl_scheduler = scheduler.Scheduler(requests_per_second=self.REQUESTS_PER_SECOND)
+        async with utility.FetcherSet(self.PAGE_BACKENDS,backend_options,scheduler=crawl_scheduler,shared_fetchers=self.shared_fetchers,cache=self.cache,dead_letters=self.dead_letters) as fetchers:
+            async for product_unit in self.get_prod_details(fetchers):
+                yield product_unit
     
     
-    @logger
-    def output(self,output_path):
+    async def write_output(self,output_path,incremental=False,resume=False):
         """
-        Retrieves product data asynchronously, converts it to a custom JSON format, and saves it to a specified file.
-
-        This method performs the following steps:
-        1. Calls the asynchronous method `GetData()` to fetch product data.
-        2. Converts the fetched data into a custom JSON format using `convert_to_custom_format()`.
-        3. Saves the converted JSON data to a file at the path specified using `utility.output()`.
+        Crawls the site and writes the products to `output_path` with `utility.run_output()`; on
+        incremental runs, unchanged product pages reuse their previous record.
+        """
+        return await utility.run_output(self,self.GetData(),output_path,checkpoint_key="url",state_key="url",incremental=incremental,resume=resume)
 
+    @metrics.traced
+    def output(self,output_path,incremental=False,resume=False):
         """
-        json_data = asyncio.get_event_loop().run_until_complete(self.GetData())
+        Retrieves product data and saves it to a specified file by running `write_output()` on the event loop.
 
-        return utility.output(json_data,output_path)
+        Returns:
+            int: Number of records written.
+        """
+        return asyncio.get_event_loop().run_until_complete(self.write_output(output_path,incremental=incremental,resume=resume))
 
 
-Lechocolat("https://www.lechocolat-alainducasse.com/uk/").output(output_path = "./output/lechocolat.json")
+if __name__ == "__main__":
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    checkpoint.exit_on_sigterm()
+    Lechocolat("https://www.lechocolat-alainducasse.com/uk/").output(output_path = "./output/lechocolat.json",resume="--resume" in sys.argv)
 
 ### Note not able to replicate discount part Unlock 20% off your first order.
 
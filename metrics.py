@@ -0,0 +1,273 @@
+import json
+import time
+import asyncio
+import inspect
+import logging
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds in seconds of the latency histogram buckets; the last bucket is +Inf.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Exceptions that end a span without being an error.
+NOT_ERRORS = (GeneratorExit, asyncio.CancelledError, StopAsyncIteration)
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key,value in labels.items()))
+
+
+class Histogram():
+    """Cumulative-bucket histogram, as exported by Prometheus."""
+    def __init__(self,buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self,value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self,fraction):
+        """Estimates a quantile as the upper bound of the bucket it falls in (the max for the last bucket)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound,count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Span():
+    """
+    Times one stage of the crawl; usable with `with` and `async with`.
+
+    The duration goes to the `crawl_stage_seconds` histogram and an exception raised
+    inside the span is counted in `crawl_errors_total` by stage and exception type.
+    """
+    def __init__(self,registry,stage,labels):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+        self.seconds = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.seconds = time.perf_counter() - self.started
+        self.registry.observe("crawl_stage_seconds",self.seconds,stage=self.stage,**self.labels)
+        if exc_type is not None and not issubclass(exc_type,NOT_ERRORS):
+            self.registry.count("crawl_errors_total",stage=self.stage,type=exc_type.__name__)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self,exc_type,exc_value,traceback):
+        return self.__exit__(exc_type,exc_value,traceback)
+
+
+class Metrics():
+    """
+    In-process registry of crawl counters, gauges and histograms.
+
+    Metrics are identified by name and labels. At the end of a run they are exported
+    as Prometheus text exposition (`to_prometheus()`, e.g. for the node_exporter
+    textfile collector) or as a JSON summary (`summary()`). `snapshot()` and `merge()`
+    combine the registries of crawls that ran in other processes.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self,name,value=1,**labels):
+        key = (name, label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self,name,value,**labels):
+        self.gauges[(name, label_key(labels))] = value
+
+    def observe(self,name,value,**labels):
+        key = (name, label_key(labels))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def span(self,stage,**labels):
+        return Span(self,stage,labels)
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def snapshot(self):
+        """Returns the registry as plain data that can be sent to another process and `merge()`d there."""
+        return {
+            "counters": [[name, list(labels), value] for (name,labels),value in self.counters.items()],
+            "gauges": [[name, list(labels), value] for (name,labels),value in self.gauges.items()],
+            "histograms": [[name, list(labels), list(h.buckets), h.counts, h.count, h.sum, h.max]
+                           for (name,labels),h in self.histograms.items()],
+        }
+
+    def merge(self,snapshot):
+        for name,labels,value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            self.counters[key] = self.counters.get(key, 0) + value
+        for name,labels,value in snapshot["gauges"]:
+            self.gauges[(name, tuple(map(tuple, labels)))] = value
+        for name,labels,buckets,counts,count,total,maximum in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            histogram = self.histograms[key]
+            histogram.counts = [a + b for a,b in zip(histogram.counts, counts)]
+            histogram.count += count
+            histogram.sum += total
+            histogram.max = max(histogram.max, maximum)
+
+    def summary(self):
+        """Returns the metrics as a JSON-serialisable dict, histograms reduced to count, sum, mean, p50, p95 and max."""
+        def grouped(items,describe):
+            result = {}
+            for (name,labels),value in sorted(items):
+                result.setdefault(name, []).append({"labels": dict(labels), **describe(value)})
+            return result
+        def rounded(value):
+            return None if value is None else round(value, 6)
+        return {
+            "counters": grouped(self.counters.items(), lambda value: {"value": value}),
+            "gauges": grouped(self.gauges.items(), lambda value: {"value": value}),
+            "histograms": grouped(self.histograms.items(), lambda h: {
+                "count": h.count,
+                "sum": round(h.sum, 6),
+                "mean": round(h.sum / h.count, 6) if h.count else None,
+                "p50": rounded(h.quantile(0.5)),
+                "p95": rounded(h.quantile(0.95)),
+                "max": round(h.max, 6),
+            }),
+        }
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        def labels_text(labels,extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _,value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key,_),value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        for kind,items in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name,_ in items}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric,labels),value in sorted(items.items()):
+                    if metric == name:
+                        lines.append(f"{name}{labels_text(labels)} {value}")
+        for name in sorted({name for name,_ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric,labels),histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound,count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self,path):
+        """Writes the metrics to `path`: Prometheus text for a `.prom` file, the JSON summary otherwise."""
+        with open(path, 'w') as file:
+            if path.endswith(".prom"):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), file, indent=4)
+
+
+REGISTRY = Metrics()
+
+def count(name,value=1,**labels):
+    REGISTRY.count(name,value,**labels)
+
+def set_gauge(name,value,**labels):
+    REGISTRY.set_gauge(name,value,**labels)
+
+def observe(name,value,**labels):
+    REGISTRY.observe(name,value,**labels)
+
+def span(stage,**labels):
+    return REGISTRY.span(stage,**labels)
+
+
+def traced(fn=None,stage=None):
+    """
+    Decorator timing every call of a function as a `span()` named after the function (or `stage`).
+
+    Coroutine functions are timed until they return, not until the coroutine object is
+    created. Async generators are timed only while they run, so the time a consumer spends
+    between two records is not charged to the generator. Start and end of each call are
+    logged at INFO with the function's name.
+    """
+    if fn is None:
+        return lambda fn: traced(fn,stage=stage)
+    name = stage or fn.__qualname__
+    log = logging.getLogger(fn.__name__)
+
+    if inspect.isasyncgenfunction(fn):
+        @wraps(fn)
+        async def wrapper(*args,**kwargs):
+            log.info('About to run %s' % fn.__name__)
+            generator = fn(*args,**kwargs)
+            timer = REGISTRY.span(name)
+            timer.started = time.perf_counter()
+            elapsed = 0.0
+            error = None
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except BaseException as err:
+                        error = err
+                        raise
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    yield item
+            finally:
+                await generator.aclose()
+                timer.started = time.perf_counter() - elapsed
+                timer.__exit__(type(error) if error else None, error, None)
+                log.info('Done running %s in %.2fs' % (fn.__name__, elapsed))
+        return wrapper
+
+    if inspect.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def wrapper(*args,**kwargs):
+            log.info('About to run %s' % fn.__name__)
+            with REGISTRY.span(name) as timer:
+                result = await fn(*args,**kwargs)
+            log.info('Done running %s in %.2fs' % (fn.__name__, timer.seconds))
+            return result
+        return wrapper
+
+    @wraps(fn)
+    def wrapper(*args,**kwargs):
+        log.info('About to run %s' % fn.__name__)
+        with REGISTRY.span(name) as timer:
+            out = fn(*args,**kwargs)
+        log.info('Done running %s in %.2fs' % (fn.__name__, timer.seconds))
+        return out
+    return wrapper
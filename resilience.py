@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+import pyppeteer.errors
+from urllib.parse import urlsplit
+from responsecache import CacheMiss
+import metrics
+
+# Failures worth another attempt: the same request may succeed a moment later.
+RETRYABLE_KINDS = ("network", "timeout", "selector_timeout", "server", "throttled", "browser")
+# Failures that say the host is unhealthy and count towards opening its circuit.
+# A 4xx, a missing selector on one page or a parse error says nothing about the host.
+HOST_FAILURE_KINDS = ("network", "timeout", "server", "browser")
+
+
+class SelectorTimeout(asyncio.TimeoutError):
+    """Raised when the element marking a page as rendered does not appear in time."""
+
+
+class CircuitOpen(Exception):
+    """Raised instead of a request to a host whose circuit is open."""
+
+
+def classify(err):
+    """
+    Returns the kind of a fetch failure, which decides whether it is retried:
+
+    "circuit_open", "cache_miss", "throttled" (429/503), "server" (other 5xx),
+    "client" (4xx), "selector_timeout", "timeout", "network", "browser" (crashed or
+    closed page) or "other" (e.g. a parse error).
+    """
+    if isinstance(err,CircuitOpen):
+        return "circuit_open"
+    if isinstance(err,CacheMiss):
+        return "cache_miss"
+    status = getattr(err,"status",None)
+    if isinstance(status,int):
+        if status in (429, 503):
+            return "throttled"
+        if status >= 500:
+            return "server"
+        if status >= 400:
+            return "client"
+    if isinstance(err,SelectorTimeout):
+        return "selector_timeout"
+    if isinstance(err,asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(err,(aiohttp.ClientError, ConnectionError)):
+        return "network"
+    if isinstance(err,pyppeteer.errors.PageError) and "net::" in str(err):
+        return "network"
+    if isinstance(err,(pyppeteer.errors.NetworkError, pyppeteer.errors.BrowserError)):
+        return "browser"
+    return "other"
+
+
+class RetryPolicy():
+    """
+    How often and how patiently a request is attempted.
+
+    Args:
+        attempts (int): Attempts per request, including the first one.
+        timeout (float): Seconds one attempt may take (navigation, rendering and extraction), or None.
+        backoff (float): Base delay in seconds; attempt n waits up to `backoff * 2**(n-1)`.
+        max_backoff (float): Upper bound of a single delay.
+        retry_kinds (tuple): Failure kinds (see `classify()`) that are retried.
+    """
+    def __init__(self,attempts=3,timeout=60,backoff=1.0,max_backoff=30,retry_kinds=RETRYABLE_KINDS):
+        self.attempts = attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_kinds = retry_kinds
+
+    def delay(self,attempt):
+        """Exponential backoff with full jitter, so workers that failed together do not retry together."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker():
+    """
+    Per-host circuit breaker.
+
+    After `failure_threshold` consecutive host failures (see `HOST_FAILURE_KINDS`) the
+    circuit of the host opens and its requests fail at once with `CircuitOpen` instead
+    of each waiting for its own timeouts. After `reset_after` seconds one trial request
+    is let through (half-open): success closes the circuit, failure opens it again.
+    """
+    def __init__(self,failure_threshold=5,reset_after=60):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = {}
+        self.opened_at = {}
+        self.trial_running = set()
+
+    def before_request(self,host):
+        opened_at = self.opened_at.get(host)
+        if opened_at is None:
+            return
+        if time.monotonic() - opened_at < self.reset_after or host in self.trial_running:
+            raise CircuitOpen(f"circuit open for {host}")
+        self.trial_running.add(host)
+
+    def record_success(self,host):
+        self.failures.pop(host,None)
+        self.trial_running.discard(host)
+        if self.opened_at.pop(host,None) is not None:
+            logging.info(f"Circuit closed for {host}")
+
+    def record_failure(self,host):
+        self.failures[host] = self.failures.get(host,0) + 1
+        if host in self.trial_running or self.failures[host] >= self.failure_threshold:
+            self.trial_running.discard(host)
+            if host not in self.opened_at:
+                metrics.count("crawl_circuit_opened_total",host=host)
+            self.opened_at[host] = time.monotonic()
+            logging.warning(f"Circuit opened for {host} after {self.failures[host]} failures, "
+                            f"pausing it for {self.reset_after}s")
+
+    def release(self,host):
+        """Ends a trial request whose failure said nothing about the host's health."""
+        self.trial_running.discard(host)
+
+    async def wait_until_closed(self,url):
+        """Sleeps until the circuit of the URL's host lets a trial request through."""
+        opened_at = self.opened_at.get(urlsplit(url).netloc)
+        if opened_at is not None:
+            await asyncio.sleep(max(0, opened_at + self.reset_after - time.monotonic()))
+
+
+class DeadLetters():
+    """
+    URLs that still failed after every attempt, kept for a retry pass at the end of the
+    crawl and saved next to the output (`<output_path>.deadletter.json`) for a later run.
+    One entry per URL: a URL that fails again replaces its entry.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    @classmethod
+    def load(cls,path):
+        """Returns the dead letters saved by an earlier run, e.g. to retry them when resuming."""
+        dead_letters = cls()
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                dead_letters.entries = {entry["url"]: entry for entry in json.load(file)}
+        return dead_letters
+
+    def add(self,url,page_type,error,attempts=1):
+        kind = classify(error)
+        self.entries[url] = {"url": url, "page_type": page_type, "kind": kind,
+                             "error": f"{type(error).__name__}: {error}", "attempts": attempts,
+                             "failed_at": time.time()}
+
+    def discard(self,url):
+        self.entries.pop(url,None)
+
+    def take(self,page_type):
+        """Removes and returns the entries of one page type, e.g. to retry them."""
+        taken = [entry for entry in self.entries.values() if entry["page_type"] == page_type]
+        for entry in taken:
+            del self.entries[entry["url"]]
+        return taken
+
+    def __contains__(self,url):
+        return url in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def save(self,path):
+        """Writes the entries to `path` atomically, or removes a stale file when there are none."""
+        if not self.entries:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(list(self.entries.values()), file, indent=4)
+        os.replace(tmp_path, path)
+        logging.warning(f"{len(self.entries)} URLs failed, listed in {path}")
+
+
+class Resilience():
+    """
+    Runs every request of a `utility.FetcherSet` with a per-attempt timeout, retries with
+    backoff for the retryable failure kinds, a per-host circuit breaker, and records the
+    URLs that still fail in `dead_letters`.
+    """
+    def __init__(self,policy=None,breaker=None,dead_letters=None):
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.dead_letters = dead_letters if dead_letters is not None else DeadLetters()
+
+    async def attempt(self,awaitable):
+        """Awaits one attempt within the policy's timeout."""
+        if self.policy.timeout is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, self.policy.timeout)
+
+    async def call(self,url,page_type,request):
+        """
+        Calls `await request()` until it succeeds, the failure is not retryable, or the
+        attempts are used up; the last error is then re-raised unchanged.
+
+        `request` should wrap only the network part of its work with `attempt()`, so time
+        spent waiting for a scheduler slot does not count against the timeout.
+        """
+        host = urlsplit(url).netloc
+        for number in range(1, self.policy.attempts + 1):
+            try:
+                self.breaker.before_request(host)
+                result = await request()
+            except Exception as err:
+                kind = classify(err)
+                metrics.count("crawl_fetch_failures_total",kind=kind,page_type=page_type)
+                if kind in HOST_FAILURE_KINDS:
+                    self.breaker.record_failure(host)
+                elif kind != "circuit_open":
+                    self.breaker.release(host)
+                if kind not in self.policy.retry_kinds or number == self.policy.attempts:
+                    if kind != "cache_miss":
+                        self.dead_letters.add(url,page_type,err,attempts=number)
+                    raise
+                delay = self.policy.delay(number)
+                metrics.count("crawl_retries_total",kind=kind,page_type=page_type)
+                logging.warning(f"Attempt {number} of {url} failed ({kind}: {type(err).__name__}: {err}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success(host)
+                self.dead_letters.discard(url)
+                return result
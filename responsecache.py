@@ -0,0 +1,179 @@
+import os
+import json
+import gzip
+import time
+import sqlite3
+import hashlib
+import logging
+from collections import Counter
+
+CACHE_MODES = ("off", "read-through", "replay")
+# Conditional request headers change how the server answers, not which page is asked for.
+UNKEYED_HEADERS = {"if-none-match", "if-modified-since"}
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode for a request that is not in the cache."""
+
+
+def cache_key(variant,url,headers=None):
+    """
+    Returns the SHA-256 hex digest identifying a request: the fetch variant (backend and
+    page part), the URL and the request headers that select a different response.
+    """
+    relevant = sorted((key.lower(), value) for key,value in (headers or {}).items()
+                      if key.lower() not in UNKEYED_HEADERS)
+    payload = json.dumps([variant, url, relevant], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache():
+    """
+    On-disk cache of fetched pages, used underneath `utility.FetcherSet` for both the
+    HTTP and the browser backend.
+
+    Every response is stored in its own file under `directory`, named after its
+    `cache_key()` and gzip-compressed by default. A SQLite index next to the files
+    keeps the size and the store and access times of every entry, for TTL checks and
+    least-recently-used eviction once the cache grows beyond `max_bytes`.
+
+    Modes:
+        "off": Nothing is read or stored.
+        "read-through": Fresh entries are served from the cache; misses and expired
+            entries are fetched and stored.
+        "replay": Only the cache is used, whatever the age of the entries; a miss raises
+            `CacheMiss`, so a replayed crawl never touches the network.
+
+    Args:
+        directory (str): Cache directory; created if needed.
+        mode (str): One of `CACHE_MODES`.
+        ttl (float): Age in seconds after which an entry is refetched in read-through mode.
+            None keeps entries until they are evicted.
+        max_bytes (int): Size of the stored files above which the least recently used entries are evicted.
+        compress (bool): Store new entries gzip-compressed.
+    """
+    def __init__(self,directory,mode="read-through",ttl=None,max_bytes=1024**3,compress=True):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.directory = directory
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.stats = Counter()
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                path TEXT,
+                size INTEGER,
+                stored_at REAL,
+                accessed_at REAL
+            )""")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def get(self,variant,url,headers=None):
+        """
+        Returns the cached response for a request as a dict with "variant", "url", "status",
+        "text", "headers" and "stored_at", or None if it has to be fetched.
+
+        Raises:
+            CacheMiss: In replay mode, if the request is not in the cache.
+        """
+        if not self.enabled:
+            return None
+        key = cache_key(variant,url,headers)
+        row = self.connection.execute("SELECT * FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(row["path"]):
+            self.stats["misses"] += 1
+            if self.mode == "replay":
+                raise CacheMiss(url)
+            return None
+        if self.mode != "replay" and self.ttl is not None and time.time() - row["stored_at"] > self.ttl:
+            self.stats["expired"] += 1
+            return None
+        self.connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.stats["hits"] += 1
+        return self.load(row["path"])
+
+    def load(self,path):
+        with open(path, 'rb') as file:
+            body = file.read()
+        if path.endswith(".gz"):
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    def entries(self):
+        """Yields every cached response (see `get()`), e.g. to serve a recorded crawl from a local server."""
+        for row in self.connection.execute("SELECT path FROM entries ORDER BY stored_at").fetchall():
+            if os.path.exists(row["path"]):
+                yield self.load(row["path"])
+
+    def put(self,variant,url,status,text,headers,request_headers=None):
+        """
+        Stores a fetched response in read-through mode. Responses without a body
+        (e.g. "304 Not Modified") are not stored.
+        """
+        if self.mode != "read-through" or text is None:
+            return
+        key = cache_key(variant,url,request_headers)
+        now = time.time()
+        body = json.dumps({"variant": variant, "url": url, "status": status, "text": text,
+                           "headers": dict(headers or {}), "stored_at": now}, ensure_ascii=False).encode("utf-8")
+        if self.compress:
+            body = gzip.compress(body)
+        path = os.path.join(self.directory, key[:2], key + (".json.gz" if self.compress else ".json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(body)
+        os.replace(tmp_path, path)
+
+        previous = self.connection.execute("SELECT path, size FROM entries WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            self.total_bytes -= previous["size"]
+            if previous["path"] != path and os.path.exists(previous["path"]):
+                os.remove(previous["path"])
+        self.connection.execute(
+            """INSERT INTO entries (key, url, path, size, stored_at, accessed_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   url = excluded.url,
+                   path = excluded.path,
+                   size = excluded.size,
+                   stored_at = excluded.stored_at,
+                   accessed_at = excluded.accessed_at""",
+            (key, url, path, len(body), now, now))
+        self.total_bytes += len(body)
+        self.stats["stores"] += 1
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in `max_bytes`."""
+        while self.total_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, path, size FROM entries ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if os.path.exists(row["path"]):
+                    os.remove(row["path"])
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (row["key"],))
+                self.total_bytes -= row["size"]
+                self.stats["evictions"] += 1
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+        logging.info(f"Response cache {self.directory} ({self.mode}): {dict(self.stats)}, {self.total_bytes} bytes")
@@ -0,0 +1,234 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import metrics
+
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value,default):
+    """
+    Returns the number of seconds to wait from a Retry-After header value, which is
+    either a number of seconds or an HTTP date. Falls back to `default`.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+def get_header(headers,name):
+    """Case-insensitive header lookup (the browser reports lower-case header names)."""
+    name = name.lower()
+    for key,value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class TokenBucket():
+    """
+    Token bucket rate limiter: `rate` tokens per second, at most `burst` saved up.
+    """
+    def __init__(self,rate,burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AimdController():
+    """
+    Additive-increase / multiplicative-decrease concurrency limit for one host.
+
+    Every healthy response (no error, latency under `target_latency`) grows the limit
+    by `1 / limit`, i.e. by about one slot per round of requests. A throttling status,
+    an error or a slow response halves it, at most once per `target_latency` seconds
+    so that one burst of bad responses only counts once.
+
+    Args:
+        initial (int): Starting concurrency.
+        minimum (int): Lowest concurrency the limit can fall to.
+        maximum (int): Highest concurrency the limit can grow to.
+        target_latency (float): Response time in seconds above which the host is considered loaded.
+    """
+    def __init__(self,initial=2,minimum=1,maximum=16,target_latency=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.latencies = deque(maxlen=100)
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self,latency):
+        self.latencies.append(latency)
+        if latency > self.target_latency:
+            self.on_backoff()
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_backoff(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.target_latency:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+
+class HostState():
+    def __init__(self,bucket,controller):
+        self.bucket = bucket
+        self.controller = controller
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+
+class Scheduler():
+    """
+    Shared fetch scheduler: every request goes through `request(url)`.
+
+    Each host gets its own token bucket (request rate) and AIMD controller (request
+    concurrency). A 429 or 503 response blocks the host for its Retry-After time and
+    halves the concurrency; healthy responses slowly raise it again.
+
+    Usage:
+        async with scheduler.request(url) as ticket:
+            response = await fetch(url)
+            ticket.record(response.status, response.headers)
+
+    Exceptions carrying `status` / `headers` attributes (e.g. aiohttp's
+    `ClientResponseError`) are recorded automatically.
+
+    Args:
+        requests_per_second (float): Token bucket rate per host.
+        burst (int): Token bucket capacity per host.
+        initial_concurrency (int): Starting AIMD limit per host.
+        max_concurrency (int): Highest AIMD limit per host.
+        target_latency (float): Latency in seconds above which a host is backed off.
+        default_retry_after (float): Block time in seconds when a throttling response has no Retry-After.
+    """
+    def __init__(self,requests_per_second=2.0,burst=1,initial_concurrency=2,max_concurrency=16,
+                 target_latency=2.0,default_retry_after=5.0):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.default_retry_after = default_retry_after
+        self.hosts = {}
+
+    def host(self,url):
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostState(
+                TokenBucket(self.requests_per_second,self.burst),
+                AimdController(initial=min(self.initial_concurrency,self.max_concurrency),
+                               maximum=self.max_concurrency,
+                               target_latency=self.target_latency))
+        return self.hosts[host]
+
+    def request(self,url):
+        return Ticket(self,self.host(url))
+
+    def summary(self):
+        return {
+            host: {
+                "requests": state.requests,
+                "throttled": state.throttled,
+                "errors": state.errors,
+                "concurrency_limit": round(state.controller.limit, 2),
+            }
+            for host,state in self.hosts.items()
+        }
+
+
+class Ticket():
+    """One scheduled request; see `Scheduler.request()`."""
+    def __init__(self,scheduler,state):
+        self.scheduler = scheduler
+        self.state = state
+        self.status = None
+        self.headers = {}
+        self.started = None
+
+    def record(self,status,headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        await self.state.controller.acquire()
+        try:
+            # Re-check after every wait: a 429 may arrive while this request is queued.
+            while True:
+                delay = self.state.blocked_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                await self.state.bucket.acquire()
+                if self.state.blocked_until <= time.monotonic():
+                    break
+        except BaseException:
+            await self.state.controller.release()
+            raise
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self,exc_type,exc_value,traceback):
+        latency = time.monotonic() - self.started
+        status = self.status if self.status is not None else getattr(exc_value,"status",None)
+        headers = self.headers or getattr(exc_value,"headers",None) or {}
+        state = self.state
+        state.requests += 1
+        try:
+            if status in THROTTLE_STATUSES:
+                state.throttled += 1
+                metrics.count("crawl_throttled_total",status=status)
+                retry_after = parse_retry_after(get_header(headers,"Retry-After"),self.scheduler.default_retry_after)
+                state.blocked_until = max(state.blocked_until,time.monotonic() + retry_after)
+                state.controller.on_backoff()
+                logging.warning(f"Throttled with {status}, pausing host for {retry_after:.1f}s "
+                                f"(concurrency limit {state.controller.limit:.1f})")
+            elif exc_type is not None or (status is not None and status >= 500):
+                state.errors += 1
+                state.controller.on_backoff()
+            else:
+                state.controller.on_success(latency)
+        finally:
+            await state.controller.release()
+        return False
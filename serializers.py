@@ -0,0 +1,181 @@
+import os
+import io
+import json
+import gzip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKENDS = ("auto", "orjson", "msgspec", "json")
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def available_backends():
+    return [name for name,module in (("orjson", orjson), ("msgspec", msgspec), ("json", json)) if module is not None]
+
+
+def compression_of(path):
+    """Returns the compression named by a file's extension ("gzip", "zstd") or None."""
+    for compression,suffix in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def open_compressed(path,mode='rb',compression=None,level=None):
+    """
+    Opens a file in binary mode, (de)compressing it with gzip or zstd.
+
+    For reading, the compression is detected from the first bytes of the file, so a
+    compressed file is read correctly whatever its name; for writing it is `compression`.
+    """
+    if 'r' in mode:
+        with open(path, 'rb') as file:
+            magic = file.read(4)
+        if magic.startswith(GZIP_MAGIC):
+            return gzip.open(path, 'rb')
+        if magic.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd-compressed: pip install zstandard")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return open(path, 'rb')
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=level if level is not None else 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs zstandard: pip install zstandard")
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).stream_writer(open(path, mode), closefd=True)
+    return open(path, mode)
+
+
+class Serializer():
+    """
+    JSON encoder and decoder with a pluggable backend, used for the output files.
+
+    The default (`backend="json"`, `indent=4`, no compression) writes the same bytes as
+    `json.dump(..., indent=4)`. orjson and msgspec are much faster on large nested
+    records such as Foreignfortune's variants; they write non-ASCII characters as UTF-8
+    instead of \\u escapes, and orjson indents by 2 spaces whatever `indent` asks for.
+
+    Args:
+        backend (str): "orjson", "msgspec", "json", or "auto" for the fastest one installed.
+        indent (int): Spaces per nesting level, or None for compact output without whitespace.
+        compression (str): "gzip", "zstd" or None.
+        level (int): Compression level, or None for the library default.
+    """
+    def __init__(self,backend="json",indent=4,compression=None,level=None):
+        if backend == "auto":
+            backend = available_backends()[0]
+        if backend not in available_backends():
+            raise RuntimeError(f"Serializer backend {backend} is not installed: pip install {backend}")
+        if compression not in (None, *COMPRESSIONS):
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {sorted(COMPRESSIONS)}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs zstandard: pip install zstandard")
+        self.backend = backend
+        self.indent = indent
+        self.compression = compression
+        self.level = level
+
+    @property
+    def suffix(self):
+        """Extension the compression adds to a file name, e.g. ".gz"."""
+        return COMPRESSIONS.get(self.compression, "")
+
+    def dumps(self,value):
+        """Returns `value` encoded as UTF-8 JSON bytes."""
+        if self.backend == "orjson":
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2 if self.indent else 0)
+        if self.backend == "msgspec":
+            encoded = msgspec.json.encode(value)
+            return msgspec.json.format(encoded, indent=self.indent) if self.indent else encoded
+        if self.indent:
+            return json.dumps(value, indent=self.indent).encode("utf-8")
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def loads(self,data):
+        if self.backend == "orjson":
+            return orjson.loads(data)
+        if self.backend == "msgspec":
+            return msgspec.json.decode(data)
+        return json.loads(data)
+
+    def write_items(self,file,items):
+        """
+        Writes an iterable as a JSON list to a binary file, one item at a time, laid out
+        as encoding the whole list would, so a list never has to be held in memory.
+
+        Returns:
+            int: Number of items written.
+        """
+        indent = b" " * (2 if self.backend == "orjson" else self.indent) if self.indent else b""
+        separator = b",\n" + indent if self.indent else b","
+        count = 0
+        for item in items:
+            encoded = self.dumps(item)
+            if self.indent:
+                encoded = encoded.replace(b"\n", b"\n" + indent)
+            file.write((b"[\n" + indent if self.indent else b"[") if not count else separator)
+            file.write(encoded)
+            count += 1
+        file.write((b"\n]" if self.indent else b"]") if count else b"[]")
+        return count
+
+    def write(self,data,path,fsync=True):
+        """
+        Writes `data` to `path` through a temporary file and `os.replace`, so readers see
+        either the previous file or the complete new one. A list is written item by item
+        (see `write_items()`).
+        """
+        tmp_path = f"{path}.tmp"
+        with open_compressed(tmp_path, 'wb', self.compression, self.level) as file:
+            if isinstance(data,list):
+                self.write_items(file,data)
+            else:
+                file.write(self.dumps(data))
+        if fsync:
+            with open(tmp_path, 'rb') as file:
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    def read(self,path):
+        """Reads a JSON file written by any backend, compressed or not."""
+        with open_compressed(path, 'rb') as file:
+            return self.loads(file.read())
+
+
+DEFAULT = Serializer()
+READER = Serializer(backend="auto", indent=None)
+
+
+def read_json(path):
+    """
+    Reads a JSON file (plain, gzip or zstd) with the fastest backend installed; the
+    fast counterpart of `json.load()` for the output files.
+
+    orjson and msgspec reject the NaN and Infinity that stdlib `json` writes for float
+    fields, so a file they cannot decode is read again with stdlib `json`.
+    """
+    try:
+        return READER.read(path)
+    except ValueError:
+        if READER.backend == "json":
+            raise
+        return DEFAULT.read(path)
+
+
+def text_reader(path):
+    """Opens a JSON file (plain, gzip or zstd) for reading as UTF-8 text, e.g. for streaming it."""
+    return io.TextIOWrapper(open_compressed(path, 'rb'), encoding="utf-8")
@@ -0,0 +1,206 @@
+import os
+import re
+from lxml import etree
+from lxml.html import HTMLParser
+from cssselect import GenericTranslator
+import metrics
+
+# Same parser settings as parsel.Selector, so extracted values do not change.
+HTML_PARSER = HTMLParser(recover=True, encoding="utf8")
+CSS_PSEUDO = re.compile(r"::(text|attr\(([^)]+)\))$")
+
+
+def parse_html(text):
+    """
+    Parses an HTML document once into an lxml tree that every `Spec` of the page reuses.
+
+    Returns:
+        lxml.etree._Element: The root element (an empty `<html>` for an empty document).
+    """
+    body = text.encode("utf8") if isinstance(text,str) else text
+    root = etree.fromstring(body, parser=HTML_PARSER) if body and body.strip() else None
+    return root if root is not None else etree.fromstring(b"<html/>")
+
+
+def css_to_xpath(css):
+    """
+    Translates a CSS selector into XPath. Like parsel, a trailing `::text` selects the
+    element's text nodes and `::attr(name)` one of its attributes.
+    """
+    suffix = ""
+    match = CSS_PSEUDO.search(css)
+    if match:
+        css = css[:match.start()]
+        suffix = "/text()" if match.group(1) == "text" else f"/@{match.group(2)}"
+    return GenericTranslator().css_to_xpath(css, prefix="descendant-or-self::") + suffix
+
+
+class Field():
+    """
+    One value extracted from a page or from a container of a page.
+
+    The expression is compiled into an `etree.XPath` on first use and reused for every
+    page afterwards. Expressions starting with "./" or ".//" are relative to the
+    container element of the `Spec` they belong to.
+
+    Args:
+        xpath (str): XPath expression.
+        css (str): CSS selector, used instead of `xpath`.
+        env (str): Name of an environment variable holding the XPath; it is read once, when the
+            field is first used.
+        many (bool): Return every match as a list instead of the first match.
+        regex (str): Return the first match of this pattern in the matched strings instead.
+    """
+    def __init__(self,xpath=None,css=None,env=None,many=False,regex=None):
+        self.expression = xpath
+        self.css = css
+        self.env = env
+        self.many = many
+        self.regex = re.compile(regex) if regex else None
+        self._compiled = None
+
+    @property
+    def compiled(self):
+        if self._compiled is None:
+            if self.env:
+                self.expression = os.environ[self.env]
+            elif self.css:
+                self.expression = css_to_xpath(self.css)
+            self._compiled = etree.XPath(self.expression, smart_strings=False)
+        return self._compiled
+
+    def __call__(self,node):
+        return self.select([self.to_text(value) for value in self.compiled(node)])
+
+    def in_page(self):
+        """Describes the field for `utility.SPEC_EXTRACT_JS`: its XPath and how many matches to return."""
+        limit = 0 if self.many or self.regex else 1
+        return ["xpath", self.compiled.path, limit]
+
+    def from_in_page(self,values):
+        return self.select(values)
+
+    def select(self,values):
+        """Turns the matched strings into the field value (first match, every match or regex match)."""
+        if self.regex:
+            for value in values:
+                match = self.regex.search(value)
+                if match:
+                    return match.group(0)
+            return None
+        if self.many:
+            return values
+        return values[0] if values else None
+
+    @staticmethod
+    def to_text(value):
+        if isinstance(value,etree._Element):
+            return etree.tostring(value, encoding="unicode", method="html", with_tail=False)
+        return str(value)
+
+
+class Spec():
+    """
+    Declarative selector spec of one page type.
+
+    Without `container`, `extract()` evaluates every field against the whole document.
+    With `container`, `extract_all()` evaluates the fields once per matched container
+    element (e.g. one product card), so the values of one record always come from the
+    same element. A field may itself be a `Spec`, e.g. the product cards of a listing
+    page next to its page count.
+
+    A spec is evaluated either in Python on a parsed page (`extract_page()`) or inside
+    the browser (`utility.extract_in_page()`); both return the same value.
+
+    Args:
+        container (str): XPath of the elements the fields are scoped to.
+        fields: Field name -> `Field` or nested `Spec`.
+    """
+    def __init__(self,container=None,**fields):
+        self.container = Field(container, many=True) if container else None
+        self.fields = fields
+
+    def containers(self,root):
+        return self.container.compiled(root)
+
+    def extract(self,node):
+        """Returns the field name -> value mapping of `node`."""
+        return {name: field(node) for name,field in self.fields.items()}
+
+    def extract_all(self,root):
+        """Returns one field name -> value mapping per container element of the document."""
+        return [self.extract(node) for node in self.containers(root)]
+
+    def __call__(self,node):
+        return self.extract_all(node) if self.container else self.extract(node)
+
+    def extract_page(self,text):
+        """Parses an HTML document and returns the spec's value: a list of records with a container, else one record."""
+        with metrics.span("parse"):
+            root = parse_html(text)
+        with metrics.span("extract",backend="lxml"):
+            return self(root)
+
+    def in_page(self):
+        """Describes the spec for `utility.SPEC_EXTRACT_JS`."""
+        container = self.container.compiled.path if self.container else None
+        return ["spec", container, {name: field.in_page() for name,field in self.fields.items()}]
+
+    def from_in_page(self,raw):
+        """Applies the Python-side steps of every field (first match, regex) to the result of `SPEC_EXTRACT_JS`."""
+        def record(values):
+            return {name: field.from_in_page(values[name]) for name,field in self.fields.items()}
+        return [record(values) for values in raw] if self.container else record(raw)
+
+
+FOREIGNFORTUNE = {
+    "home": Spec(
+        container='//ul[@class="site-nav list--inline site-nav--centered"]/li/a',
+        name=Field('./text()'),
+        url=Field('./@href'),
+    ),
+    "category": Spec(
+        pagination=Field(env="ffPaginationXpath", many=True),
+        products=Spec(
+            container='//div[@class="grid-view-item product-card"]',
+            url=Field('./a/@href'),
+        ),
+    ),
+    "product": Spec(
+        details=Field(env="ffProductDetailsXpath"),
+    ),
+}
+
+LECHOCOLAT = {
+    "home": Spec(
+        category_urls=Field('//li[@class="siteMenuItem" and @data-depth="2"]/a/@href', many=True),
+    ),
+    "category": Spec(
+        container='//section[@class="productMiniature__data"]',
+        url=Field('./a/@href'),
+    ),
+    "product": Spec(
+        image_url=Field('//li[@class="productImages__item keen-slider__slide"]/a/@href'),
+        title=Field('//h1[@class="productCard__title"]/text()'),
+        categoty=Field('//h2[@class="productCard__subtitle"]/text()'),
+        description=Field(css='div.productAccordion__content > p::text', many=True),
+        price=Field(css='div.productAccordion__content > p::text', regex=r'£\d+\.\d+'),
+        weight=Field('//p[@class="productCard__weight"]/text()'),
+    ),
+}
+
+TRADERJOES = {
+    "listing": Spec(
+        no_of_pages=Field('//ul[@class="Pagination_pagination__list__1JUIg"]/li[last()]/text()'),
+        cards=Spec(
+            container='//ul[@class="ProductList_productList__list__3-dGs"]/li',
+            href=Field('.//a[@class="Link_link__1AZfr ProductCard_card__img_link__2bBqA"]/@href'),
+            title=Field('.//h2[@class="ProductCard_card__title__text__uiWLe"]/a/text()'),
+            price=Field('.//span[@class="ProductPrice_productPrice__price__3-50j"]/text()'),
+            category=Field('.//a[@class="Link_link__1AZfr ProductCard_card__category__Hh3rT"]/text()'),
+            unit=Field('.//span[@class="ProductPrice_productPrice__unit__2jvkA"]/text()'),
+            srcset=Field('.//source/@srcset', many=True),
+            src=Field('.//img/@src', many=True),
+        ),
+    ),
+}
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import metrics
+from crawlstate import content_hash
+from urlfrontier import canonicalize_url
+from validation import iter_records
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LEVEL = logging.INFO
+
+# Site -> stable product id of a record: Foreignfortune's Shopify id, Lechocolat's
+# URL slug (without the "#/77-size-150g" option fragment that several products share)
+# and Trader Joe's SKU (the digits ending its product slug).
+SITE_KEYS = {
+    "foreignfortune": lambda record: str(record["id"]),
+    "lechocolat": lambda record: canonicalize_url(record["url"]).rsplit("/", 1)[-1] if record.get("url") else str(record["id"]),
+    "traderjoes": lambda record: str(record["id"]).rsplit("-", 1)[-1],
+}
+
+
+def site_of(output_path):
+    """Returns the site an output file belongs to, e.g. "traderjoes" for "output/traderjoes.json"."""
+    return os.path.basename(output_path).split(".", 1)[0]
+
+
+def changed_fields(old,new):
+    """Returns the top-level keys whose values differ between two records, sorted."""
+    return sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+
+
+class SnapshotStore():
+    """
+    Run-to-run snapshots of one site's output, kept in a SQLite database next to it
+    (`<output_path>.snapshots.sqlite3`).
+
+    The store holds the current record and content hash of every product and, for every
+    run, only what changed: added, removed and changed products (with the changed keys
+    and the old and new price) and a price history with one row per price change. A run
+    is recorded in one streaming pass over its output that writes only the changed
+    products; a diff between runs reads only the changes of the runs in between, so it
+    takes time linear in the changed records. Each run is recorded in one transaction,
+    so a run that fails partway (e.g. on a truncated output file) leaves no trace.
+
+    Args:
+        db_path (str): Path of the SQLite database file.
+    """
+    def __init__(self,db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(
+            """CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recorded_at REAL,
+                records INTEGER,
+                added INTEGER,
+                removed INTEGER,
+                changed INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS products (
+                product_id TEXT PRIMARY KEY,
+                content_hash TEXT,
+                price TEXT,
+                record TEXT,
+                first_run INTEGER,
+                changed_run INTEGER,
+                removed_run INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                run_id INTEGER,
+                product_id TEXT,
+                change TEXT,
+                old_hash TEXT,
+                new_hash TEXT,
+                fields TEXT,
+                old_price TEXT,
+                new_price TEXT
+            );
+            CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id);
+            CREATE TABLE IF NOT EXISTS price_history (
+                product_id TEXT,
+                run_id INTEGER,
+                recorded_at REAL,
+                price TEXT
+            );
+            CREATE INDEX IF NOT EXISTS price_history_product ON price_history (product_id, run_id);""")
+        self.connection.commit()
+
+    def record_run(self,records,key):
+        """
+        Records a run and what changed since the previous one.
+
+        This method performs the following steps:
+        1. Loads the content hash of every product of the previous run.
+        2. Streams the run's records; a record whose hash is unchanged is not written at
+           all, a new or changed one is stored with its change, and a new price is
+           appended to the price history.
+        3. Marks the products of the previous run that the run no longer has as removed.
+        4. Commits the run in one transaction; if anything fails, rolls it back and
+           deletes the run.
+
+        Args:
+            records (iterable of dict): The run's records, e.g. from `validation.iter_records()`.
+            key (callable): Returns the product id of a record (see `SITE_KEYS`).
+
+        Returns:
+            dict: {"run_id", "records", "added", "removed", "changed", "unchanged"}.
+        """
+        now = time.time()
+        run_id = self.connection.execute("INSERT INTO runs (recorded_at) VALUES (?)", (now,)).lastrowid
+        try:
+            stats = self._record(run_id,now,records,key)
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            self.connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.connection.commit()
+            raise
+        for change in ("added", "removed", "changed"):
+            metrics.count("crawl_snapshot_changes_total", stats[change], output=os.path.basename(self.db_path), change=change)
+        logging.info(f"Snapshot {self.db_path} run {run_id}: {stats}")
+        return stats
+
+    def _record(self,run_id,now,records,key):
+        previous = {row["product_id"]: row["content_hash"] for row in
+                    self.connection.execute("SELECT product_id, content_hash FROM products WHERE removed_run IS NULL")}
+        stats = {"run_id": run_id, "records": 0, "added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+        seen = set()
+        for record in records:
+            stats["records"] += 1
+            product_id = key(record)
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            digest = content_hash(record)
+            if previous.get(product_id) == digest:
+                stats["unchanged"] += 1
+                continue
+            self._store(run_id, now, product_id, record, digest, stats)
+        for product_id in previous.keys() - seen:
+            row = self.connection.execute("SELECT content_hash, price FROM products WHERE product_id = ?",
+                                          (product_id,)).fetchone()
+            self.connection.execute("INSERT INTO changes VALUES (?, ?, 'removed', ?, NULL, NULL, ?, NULL)",
+                                    (run_id, product_id, row["content_hash"], row["price"]))
+            self.connection.execute("UPDATE products SET removed_run = ? WHERE product_id = ?", (run_id, product_id))
+            stats["removed"] += 1
+        self.connection.execute("UPDATE runs SET records = ?, added = ?, removed = ?, changed = ? WHERE run_id = ?",
+                                (stats["records"], stats["added"], stats["removed"], stats["changed"], run_id))
+        return stats
+
+    def _store(self,run_id,now,product_id,record,digest,stats):
+        row = self.connection.execute("SELECT content_hash, price, record, removed_run FROM products WHERE product_id = ?",
+                                      (product_id,)).fetchone()
+        price = json.dumps(record.get("price"))
+        if row is None or row["removed_run"] is not None:
+            change,old_hash,fields,old_price = "added",None,None,None
+        else:
+            change,old_hash = "changed",row["content_hash"]
+            fields = json.dumps(changed_fields(json.loads(row["record"]), record))
+            old_price = row["price"]
+        stats[change] += 1
+        self.connection.execute("INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (run_id, product_id, change, old_hash, digest, fields, old_price, price))
+        if old_price != price:
+            self.connection.execute("INSERT INTO price_history VALUES (?, ?, ?, ?)", (product_id, run_id, now, price))
+        self.connection.execute(
+            """INSERT INTO products (product_id, content_hash, price, record, first_run, changed_run, removed_run)
+               VALUES (?, ?, ?, ?, ?, ?, NULL)
+               ON CONFLICT(product_id) DO UPDATE SET
+                   content_hash = excluded.content_hash,
+                   price = excluded.price,
+                   record = excluded.record,
+                   changed_run = excluded.changed_run,
+                   removed_run = NULL""",
+            (product_id, digest, price, json.dumps(record, ensure_ascii=False), run_id, run_id))
+
+    def runs(self):
+        return [dict(row) for row in self.connection.execute("SELECT * FROM runs ORDER BY run_id")]
+
+    def diff(self,since_run=None,until_run=None):
+        """
+        Returns what changed after run `since_run` up to and including `until_run`
+        (by default: the latest run against the one before it).
+
+        A product changed in several runs appears once, with its price before and after
+        and the keys changed in any of those runs (the price only if it differs in the
+        end); one added and removed again in between, or changed back to the same
+        content, does not appear.
+
+        Returns:
+            dict: {"since_run", "until_run", "added": [ids], "removed": [ids],
+            "changed": [{"id", "fields", "old_price", "new_price"}]}.
+        """
+        if until_run is None:
+            until_run = self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()[0] or 0
+        if since_run is None:
+            since_run = until_run - 1
+        net = {}
+        for row in self.connection.execute("SELECT * FROM changes WHERE run_id > ? AND run_id <= ? ORDER BY run_id",
+                                           (since_run, until_run)):
+            product = net.get(row["product_id"])
+            if product is None:
+                product = net[row["product_id"]] = {"existed": row["change"] != "added", "exists": True, "fields": set(),
+                                                    "old_hash": row["old_hash"], "old_price": row["old_price"]}
+            product["exists"] = row["change"] != "removed"
+            product["new_hash"] = row["new_hash"]
+            product["new_price"] = row["new_price"]
+            if row["fields"]:
+                product["fields"].update(json.loads(row["fields"]))
+        diff = {"since_run": since_run, "until_run": until_run, "added": [], "removed": [], "changed": []}
+        for product_id,product in net.items():
+            if product["existed"] and product["exists"]:
+                if product["old_hash"] != product["new_hash"]:
+                    if product["old_price"] == product["new_price"]:
+                        product["fields"].discard("price")
+                    diff["changed"].append({"id": product_id, "fields": sorted(product["fields"]),
+                                            "old_price": json.loads(product["old_price"] or "null"),
+                                            "new_price": json.loads(product["new_price"] or "null")})
+            elif product["exists"]:
+                diff["added"].append(product_id)
+            elif product["existed"]:
+                diff["removed"].append(product_id)
+        return diff
+
+    def price_history(self,product_id):
+        """Returns the prices of a product as [{"run_id", "recorded_at", "price"}], one per change, oldest first."""
+        return [{"run_id": row["run_id"], "recorded_at": row["recorded_at"], "price": json.loads(row["price"])}
+                for row in self.connection.execute(
+                    "SELECT run_id, recorded_at, price FROM price_history WHERE product_id = ? ORDER BY run_id", (product_id,))]
+
+    def close(self):
+        self.connection.close()
+
+
+def open_for_output(output_path):
+    """Opens the snapshot store kept next to `output_path` (`<output_path>.snapshots.sqlite3`)."""
+    return SnapshotStore(f"{output_path}.snapshots.sqlite3")
+
+
+def snapshot_output(output_path,site=None):
+    """
+    Records the output file of a finished run in its snapshot store.
+
+    Returns:
+        dict: The run's change counts, see `SnapshotStore.record_run()`.
+    """
+    key = SITE_KEYS[site or site_of(output_path)]
+    store = open_for_output(output_path)
+    try:
+        return store.record_run(iter_records(output_path),key)
+    finally:
+        store.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Records output files as snapshots and shows what changed between runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="Record an output file as a new run.")
+    record.add_argument("output", help="Output file, e.g. ./output/traderjoes.json.")
+    record.add_argument("--site", choices=sorted(SITE_KEYS), help="Site of the output (default: from its file name).")
+    diff = commands.add_parser("diff", help="Print the added, removed and changed products as JSON.")
+    diff.add_argument("output", help="Output file whose snapshots to compare.")
+    diff.add_argument("--since", type=int, help="Run to compare against (default: the one before --until).")
+    diff.add_argument("--until", type=int, help="Last run to include (default: the latest).")
+    history = commands.add_parser("history", help="Print the price history of a product as JSON.")
+    history.add_argument("output", help="Output file whose snapshots to read.")
+    history.add_argument("product_id", help="Product id (Foreignfortune id, Lechocolat slug, Trader Joe's SKU).")
+    args = parser.parse_args(argv)
+    if args.command == "record":
+        print(json.dumps(snapshot_output(args.output,args.site), indent=4))
+        return 0
+    store = open_for_output(args.output)
+    try:
+        if args.command == "diff":
+            print(json.dumps(store.diff(args.since,args.until), indent=4))
+        else:
+            print(json.dumps(store.price_history(args.product_id), indent=4))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    sys.exit(main())
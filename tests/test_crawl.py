@@ -0,0 +1,32 @@
+import aiohttp
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+import crawl
+import metrics
+
+
+def throttled():
+    """aiohttp's error for a 429, whose `CIMultiDictProxy` headers cannot be pickled."""
+    url = URL("https://www.traderjoes.com/home/products/category/food-8")
+    request_info = aiohttp.RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url)
+    return aiohttp.ClientResponseError(request_info, (), status=429, message="Too Many Requests",
+                                       headers=CIMultiDictProxy(CIMultiDict({"Retry-After": "30"})))
+
+
+@pytest.mark.parametrize("error", [RuntimeError("blocked"), throttled()], ids=["RuntimeError", "ClientResponseError"])
+def test_failed_site_process_keeps_its_error_and_metrics(monkeypatch,error):
+    async def crawl_sites(names,**options):
+        # The site process runs with forked globals, so this stands in for the real crawl there.
+        metrics.count("crawl_requests_total", 3, site=names[0])
+        return {names[0]: error}
+    monkeypatch.setattr(crawl,"crawl_sites",crawl_sites)
+    metrics.REGISTRY.reset()
+
+    results = crawl.crawl_sites_in_processes(["traderjoes"])
+
+    assert isinstance(results["traderjoes"], crawl.SiteFailed)
+    assert str(results["traderjoes"]) == repr(error)
+    assert metrics.REGISTRY.counters[("crawl_requests_total", (("site", "traderjoes"),))] == 3
+    metrics.REGISTRY.reset()
@@ -0,0 +1,19 @@
+import utility
+import crawlstate
+import resilience
+
+
+def test_unchecked_previous_keeps_only_records_whose_pages_failed(tmp_path):
+    output_path = str(tmp_path / "foreignfortune.json")
+    utility.save_json_data([{"id": n, "title": f"Product {n}"} for n in (1, 2, 3)],output_path)
+    state = crawlstate.open_for_output(output_path)
+    for n in (1, 2, 3):
+        state.update(f"https://foreignfortune.com/products/{n}",n,{"id": n, "title": f"Product {n}"})
+    dead_letters = resilience.DeadLetters()
+    dead_letters.add("https://foreignfortune.com/products/2","product",RuntimeError("503"))
+
+    # "1" was found again, "2" could not be fetched, "3" was no longer listed.
+    assert [record["id"] for record in state.unchecked_previous({"1"},dead_letters)] == [2]
+    dead_letters.add("https://foreignfortune.com/collections/all","category",RuntimeError("503"))
+    assert [record["id"] for record in state.unchecked_previous({"1"},dead_letters)] == [2, 3]
+    state.close()
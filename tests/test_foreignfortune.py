@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+from urllib.parse import unquote
+
+import utility
+from conftest import ROOT, local_server
+from foreignfortune import Foreignfortune, shopify_product_to_record
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import replay_bench
+
+with open(os.path.join(ROOT, "output", "foreignfortune.json"), 'r') as file:
+    RECORDS = json.load(file)
+
+
+def shopify_price(cents):
+    return None if cents is None else f"{cents / 100:.2f}"
+
+
+def shopify_product(record):
+    """The `products.json` entry of a product, rebuilt from the record its product page gave."""
+    return {
+        "id": record["id"],
+        "title": record["title"],
+        "handle": record["handle"],
+        "body_html": record["content"],
+        "published_at": record["published_at"],
+        "created_at": record["created_at"],
+        "vendor": record["vendor"],
+        "product_type": record["type"],
+        "tags": record["tags"],
+        "variants": [{
+            "id": variant["id"],
+            "title": variant["title"],
+            "option1": variant["option1"],
+            "option2": variant["option2"],
+            "option3": variant["option3"],
+            "sku": variant["sku"],
+            "requires_shipping": variant["requires_shipping"],
+            "taxable": variant["taxable"],
+            "featured_image": variant["featured_image"] and dict(variant["featured_image"], src="https:" + variant["featured_image"]["src"]),
+            "available": variant["available"],
+            "price": shopify_price(variant["price"]),
+            "grams": variant["weight"],
+            "compare_at_price": shopify_price(variant["compare_at_price"]),
+        } for variant in record["variants"]],
+        "images": [{"id": media["id"], "position": media["position"], "alt": media["alt"], "width": media["width"],
+                    "height": media["height"], "src": "https:" + media["src"]} for media in record["media"]],
+        "options": [{"name": option} for option in record["options"]],
+    }
+
+
+def without_page_only_fields(record):
+    """`products.json` has no `inventory_management` or `barcode`; the converter leaves them None."""
+    return dict(record, variants=[dict(variant, inventory_management=None, barcode=None) for variant in record["variants"]])
+
+
+def test_shopify_product_to_record_matches_product_pages():
+    for record in RECORDS:
+        converted = shopify_product_to_record(shopify_product(record))
+        assert list(converted) == list(record)
+        assert converted == without_page_only_fields(record)
+
+
+class LocalForeignfortune(Foreignfortune):
+    REQUESTS_PER_SECOND = 1000
+
+
+async def crawl(crawl_mode,products_json):
+    """
+    Crawls the synthetic store of `benchmarks/replay_bench.py` from a local server, with
+    the `products.json` endpoints served only if `products_json`.
+
+    Returns:
+        tuple: The records and the paths requested.
+    """
+    bodies = {}
+    requested = []
+
+    async def handle(request):
+        requested.append(unquote(request.raw_path))
+        body = bodies.get(unquote(request.raw_path))
+        if body is None:
+            return web.Response(status=404)
+        return web.Response(text=body, content_type="text/html")
+
+    async with local_server(handle) as base_url:
+        bodies.update((replay_bench.path_key(url), text)
+                      for url,text in replay_bench.foreignfortune_pages(RECORDS, base_url).items())
+        if products_json:
+            for n,category in enumerate(replay_bench.chunks(RECORDS, 20), 1):
+                bodies[f"/collections/collection-{n}/products.json?limit=250&page=1"] = \
+                    json.dumps({"products": [shopify_product(record) for record in category]})
+        fetcher = utility.HttpFetcher()
+        await fetcher.start()
+        try:
+            scraper = LocalForeignfortune(base_url,crawl_mode=crawl_mode,shared_fetchers={"http": fetcher})
+            records = [record async for record in scraper.GetData()]
+        finally:
+            await fetcher.close()
+    return records, requested
+
+
+@pytest.fixture(autouse=True)
+def synthetic_xpaths(monkeypatch):
+    for name,value in replay_bench.SYNTHETIC_ENV.items():
+        monkeypatch.setenv(name, value)
+
+
+def test_json_mode_reads_the_endpoints():
+    records,requested = asyncio.run(crawl("json",products_json=True))
+    assert records == [without_page_only_fields(record) for record in {record["id"]: record for record in RECORDS}.values()]
+    assert not [path for path in requested if "/products/" in path]
+
+
+def test_json_mode_falls_back_to_product_pages_when_blocked():
+    records,requested = asyncio.run(crawl("json",products_json=False))
+    assert {record["id"]: record for record in records} == {record["id"]: record for record in RECORDS}
+    assert len(records) == len({record["id"] for record in RECORDS})
+    assert requested[1] == "/collections/collection-1/products.json?limit=250&page=1"
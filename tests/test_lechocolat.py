@@ -0,0 +1,36 @@
+import os
+import json
+import shutil
+import asyncio
+
+import utility
+import crawlstate
+from conftest import ROOT
+from lechocolat import Lechocolat
+
+
+class NotModifiedFetchers():
+    """Answers every product page with "304 Not Modified"."""
+    async def extract_response(self,page_type,url,spec=None,headers=None,**options):
+        return utility.ExtractResponse(url,304,None,{})
+
+
+def test_not_modified_product_reuses_its_own_record(tmp_path):
+    output_path = str(tmp_path / "lechocolat.json")
+    shutil.copy(os.path.join(ROOT, "output", "lechocolat.json"), output_path)
+    with open(output_path, 'r') as file:
+        urls = {record["url"] for record in json.load(file)}
+
+    scraper = Lechocolat("https://www.lechocolat-alainducasse.com/uk/")
+    scraper.state = crawlstate.open_for_output(output_path,key="url")
+    assert len(scraper.state.previous_records) == len(urls)
+    for url in urls:
+        scraper.state.update(url,url,scraper.state.previous_records[url],etag='"v1"')
+
+    async def crawl():
+        return {url: await scraper.get_product_data(NotModifiedFetchers(),url) for url in urls}
+
+    # Several products share an id such as "77-size-150g", the part of the URL after the last "/".
+    records = asyncio.run(crawl())
+    scraper.state.close()
+    assert all(record["url"] == url for url,record in records.items())
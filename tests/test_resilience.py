@@ -0,0 +1,121 @@
+import asyncio
+from functools import partial
+
+import pytest
+import aiohttp
+from aiohttp import web
+
+import utility
+import metrics
+import resilience
+from scheduler import Scheduler
+from conftest import local_server
+
+
+def scripted_handler(statuses,requests):
+    """Answers the n-th request with `statuses[n]`, and with 200 once they are used up."""
+    async def handle(request):
+        requests.append(request.path)
+        status = statuses[len(requests) - 1] if len(requests) <= len(statuses) else 200
+        return web.Response(status=status, text="ok" if status == 200 else "error")
+    return handle
+
+
+def fetcher_set(attempts=3,breaker=None):
+    fetchers = utility.FetcherSet({"page": "http"},scheduler=Scheduler(100,burst=10,default_retry_after=0.1),
+                                  retry_policy=resilience.RetryPolicy(attempts=attempts,backoff=0.01))
+    if breaker is not None:
+        fetchers.resilience.breaker = breaker
+    return fetchers
+
+
+def test_server_error_is_retried_until_it_succeeds():
+    requests = []
+    metrics.REGISTRY.reset()
+
+    async def run():
+        async with local_server(scripted_handler([500, 502],requests)) as base_url:
+            async with fetcher_set() as fetchers:
+                return await fetchers.fetch("page",f"{base_url}/flaky"), len(fetchers.dead_letters)
+
+    page,dead_letters = asyncio.run(run())
+    assert page == "ok"
+    assert len(requests) == 3
+    assert dead_letters == 0
+    assert metrics.REGISTRY.counters[("crawl_retries_total", (("kind", "server"), ("page_type", "page")))] == 2
+    metrics.REGISTRY.reset()
+
+
+def test_client_error_is_not_retried_and_becomes_a_dead_letter():
+    requests = []
+
+    async def run():
+        async with local_server(scripted_handler([404],requests)) as base_url:
+            async with fetcher_set() as fetchers:
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await fetchers.fetch("page",f"{base_url}/missing")
+                return list(fetchers.dead_letters.entries.values())
+
+    [entry] = asyncio.run(run())
+    assert len(requests) == 1
+    assert (entry["page_type"], entry["kind"], entry["attempts"]) == ("page", "client", 1)
+
+
+def test_circuit_opens_after_the_threshold_and_closes_after_a_trial():
+    requests = []
+    breaker = resilience.CircuitBreaker(failure_threshold=2,reset_after=0.3)
+
+    async def run():
+        # Two failures open the circuit; the first trial after `reset_after` fails and reopens it.
+        async with local_server(scripted_handler([500, 500, 500],requests)) as base_url:
+            async with fetcher_set(attempts=1,breaker=breaker) as fetchers:
+                fetch = partial(fetchers.fetch,"page")
+                for _ in range(2):
+                    with pytest.raises(aiohttp.ClientResponseError):
+                        await fetch(f"{base_url}/down")
+                with pytest.raises(resilience.CircuitOpen):
+                    await fetch(f"{base_url}/down")
+                assert len(requests) == 2
+                await asyncio.sleep(0.35)
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await fetch(f"{base_url}/down")
+                with pytest.raises(resilience.CircuitOpen):
+                    await fetch(f"{base_url}/down")
+                await asyncio.sleep(0.35)
+                return await fetch(f"{base_url}/down")
+
+    assert asyncio.run(run()) == "ok"
+    assert len(requests) == 4
+    assert breaker.opened_at == {}
+
+
+def test_dead_letters_are_retried_at_the_end():
+    requests = []
+
+    async def run():
+        async with local_server(scripted_handler([503],requests)) as base_url:
+            async with fetcher_set(attempts=1) as fetchers:
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await fetchers.fetch("page",f"{base_url}/product")
+                assert f"{base_url}/product" in fetchers.dead_letters
+                pages = [page async for page in fetchers.retry_dead_letters("page",partial(fetchers.fetch,"page"))]
+                return pages, len(fetchers.dead_letters)
+
+    pages,dead_letters = asyncio.run(run())
+    assert pages == ["ok"]
+    assert dead_letters == 0
+
+
+@pytest.mark.parametrize("error,kind", [
+    (resilience.CircuitOpen("host"), "circuit_open"),
+    (resilience.SelectorTimeout("//h1"), "selector_timeout"),
+    (asyncio.TimeoutError(), "timeout"),
+    (aiohttp.ClientConnectionError(), "network"),
+    (utility.BrowserResponseError("https://example.com", 429, {}), "throttled"),
+    (utility.BrowserResponseError("https://example.com", 503, {}), "throttled"),
+    (utility.BrowserResponseError("https://example.com", 500, {}), "server"),
+    (utility.BrowserResponseError("https://example.com", 404, {}), "client"),
+    (KeyError("details"), "other"),
+])
+def test_classify(error,kind):
+    assert resilience.classify(error) == kind
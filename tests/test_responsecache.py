@@ -0,0 +1,85 @@
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import utility
+from scheduler import Scheduler
+from responsecache import ResponseCache, CacheMiss
+from conftest import local_server
+
+
+def counting_handler(requests):
+    async def handle(request):
+        requests.append(request.path)
+        return web.Response(text=f"<h1>{request.path}</h1>", content_type="text/html")
+    return handle
+
+
+async def fetch_all(cache,urls):
+    async with utility.FetcherSet({"page": "http"},scheduler=Scheduler(100,burst=10),cache=cache) as fetchers:
+        pages = [await fetchers.fetch("page",url) for url in urls]
+        return pages, set(fetchers._fetchers)
+
+
+def test_replay_serves_the_recorded_crawl_without_the_network(tmp_path):
+    requests = []
+
+    async def run():
+        async with local_server(counting_handler(requests)) as base_url:
+            recorder = ResponseCache(str(tmp_path),mode="read-through")
+            await fetch_all(recorder,[f"{base_url}/a", f"{base_url}/b"])
+            recorder.close()
+            replay = ResponseCache(str(tmp_path),mode="replay")
+            try:
+                pages,started = await fetch_all(replay,[f"{base_url}/b", f"{base_url}/a"])
+                with pytest.raises(CacheMiss):
+                    await fetch_all(replay,[f"{base_url}/c"])
+            finally:
+                replay.close()
+            return pages, started
+
+    pages,started = asyncio.run(run())
+    assert pages == ["<h1>/b</h1>", "<h1>/a</h1>"]
+    # Served from the cache only: the HTTP backend was never started, and the server saw the recording alone.
+    assert started == set()
+    assert requests == ["/a", "/b"]
+
+
+def test_read_through_refetches_expired_entries(tmp_path):
+    requests = []
+
+    async def run():
+        async with local_server(counting_handler(requests)) as base_url:
+            cache = ResponseCache(str(tmp_path),mode="read-through",ttl=0.5)
+            try:
+                await fetch_all(cache,[f"{base_url}/a", f"{base_url}/a"])
+                await asyncio.sleep(0.6)
+                await fetch_all(cache,[f"{base_url}/a"])
+            finally:
+                cache.close()
+            return cache.stats
+
+    stats = asyncio.run(run())
+    assert requests == ["/a", "/a"]
+    assert (stats["hits"], stats["expired"], stats["stores"]) == (1, 1, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    text = "x" * 1000
+    cache = ResponseCache(str(tmp_path),mode="read-through",max_bytes=2500,compress=False)
+    cache.put("http:document","https://example.com/a",200,text,{})
+    time.sleep(0.01)
+    cache.put("http:document","https://example.com/b",200,text,{})
+    time.sleep(0.01)
+    cache.get("http:document","https://example.com/a")
+    time.sleep(0.01)
+    cache.put("http:document","https://example.com/c",200,text,{})
+
+    assert cache.get("http:document","https://example.com/b") is None
+    assert cache.get("http:document","https://example.com/a")["text"] == text
+    assert cache.get("http:document","https://example.com/c")["text"] == text
+    assert cache.stats["evictions"] == 1
+    assert cache.total_bytes <= 2500
+    cache.close()
@@ -0,0 +1,73 @@
+import time
+import asyncio
+from aiohttp import web
+
+import utility
+import resilience
+from scheduler import Scheduler, parse_retry_after, get_header
+from conftest import local_server
+
+
+async def fetch_all(scheduler,urls):
+    async with utility.FetcherSet({"page": "http"},scheduler=scheduler,
+                                  retry_policy=resilience.RetryPolicy(backoff=0.01)) as fetchers:
+        return await asyncio.gather(*[fetchers.fetch("page",url) for url in urls])
+
+
+def test_retry_after_pauses_the_host():
+    requests = []
+
+    async def handle(request):
+        requests.append(time.monotonic())
+        if len(requests) == 1:
+            return web.Response(status=429, headers={"retry-after": "0.5"})
+        return web.Response(text="ok")
+
+    scheduler = Scheduler(requests_per_second=100,burst=10,initial_concurrency=4)
+
+    async def run():
+        async with local_server(handle) as base_url:
+            return await fetch_all(scheduler,[f"{base_url}/page"]), scheduler.summary()
+
+    pages,summary = asyncio.run(run())
+    assert pages == ["ok"]
+    assert requests[1] - requests[0] >= 0.45
+    [host] = summary.values()
+    assert host["throttled"] == 1
+    # Halved from 4 by the 429, then raised by 1/2 by the successful retry.
+    assert host["concurrency_limit"] == 2.5
+
+
+def test_concurrency_grows_while_healthy_and_backs_off_when_slow():
+    in_flight = [0]
+    peak = [0]
+
+    async def handle(request):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(0.3 if request.path == "/slow" else 0.01)
+        in_flight[0] -= 1
+        return web.Response(text="ok")
+
+    scheduler = Scheduler(requests_per_second=1000,burst=100,initial_concurrency=2,max_concurrency=8,target_latency=0.2)
+
+    async def run():
+        async with local_server(handle) as base_url:
+            await fetch_all(scheduler,[f"{base_url}/fast"] * 60)
+            grown = scheduler.summary()
+            await fetch_all(scheduler,[f"{base_url}/slow"])
+            return grown, scheduler.summary()
+
+    grown,backed_off = asyncio.run(run())
+    [host] = grown
+    assert grown[host]["concurrency_limit"] > 4
+    assert peak[0] > 2
+    assert backed_off[host]["concurrency_limit"] == grown[host]["concurrency_limit"] / 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3", 5.0) == 3.0
+    assert parse_retry_after(None, 5.0) == 5.0
+    assert parse_retry_after("soon", 5.0) == 5.0
+    assert parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT", 5.0) == 0
+    assert get_header({"retry-after": "2"}, "Retry-After") == "2"
@@ -0,0 +1,45 @@
+import os
+import json
+import shutil
+import sqlite3
+
+import pytest
+
+import snapshots
+from conftest import ROOT
+
+
+def write_output(path,records):
+    with open(path, 'w') as file:
+        json.dump(records, file, indent=4)
+
+
+def test_failed_run_leaves_no_trace(tmp_path):
+    output_path = str(tmp_path / "traderjoes.json")
+    write_output(output_path, [{"id": "a-000001", "price": 1}, {"id": "b-000002", "price": 2}])
+    assert snapshots.snapshot_output(output_path)["added"] == 2
+
+    write_output(output_path, [{"id": "a-000001", "price": 5}, {"id": "c-000003", "price": 3}])
+    with open(output_path, 'r+') as file:
+        file.truncate(len(file.read()) - 10)
+    with pytest.raises(ValueError):
+        snapshots.snapshot_output(output_path)
+
+    connection = sqlite3.connect(f"{output_path}.snapshots.sqlite3")
+    assert connection.execute("SELECT run_id FROM runs").fetchall() == [(1,)]
+    assert connection.execute("SELECT DISTINCT run_id FROM changes").fetchall() == [(1,)]
+    assert connection.execute("SELECT product_id, price, removed_run FROM products ORDER BY product_id").fetchall() == \
+        [("000001", "1", None), ("000002", "2", None)]
+    connection.close()
+
+
+def test_every_lechocolat_product_is_tracked(tmp_path):
+    output_path = str(tmp_path / "lechocolat.json")
+    shutil.copy(os.path.join(ROOT, "output", "lechocolat.json"), output_path)
+    with open(output_path, 'r') as file:
+        urls = {record["url"] for record in json.load(file)}
+
+    # Products such as ".../almond-dragee-dark#/77-size-150g" and ".../croc#/77-size-150g"
+    # share the last "/" segment of their URL.
+    stats = snapshots.snapshot_output(output_path)
+    assert stats["added"] == len(urls) == 110
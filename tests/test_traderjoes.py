@@ -0,0 +1,54 @@
+import json
+import asyncio
+import utility
+from traderjoes import Traderjoes
+
+
+def product(slug,price="$1.99"):
+    return {"id": slug, "title": slug, "url": f"https://www.traderjoes.com/home/products/pdp/{slug}",
+            "price": price, "category": "Snacks", "unit": "1 Oz", "image": []}
+
+
+class StubTraderjoes(Traderjoes):
+    """Yields `products` instead of crawling, and fails the listing pages in `failed_pages`."""
+    def __init__(self,products,failed_pages=()):
+        super().__init__("https://www.traderjoes.com")
+        self.products = products
+        self.failed_pages = failed_pages
+
+    async def GetData(self):
+        for url in self.failed_pages:
+            self.dead_letters.add(url,"listing",RuntimeError("429"))
+        # As `get_prod_details()` does: recovered records are skipped, the rest are fetched again.
+        for record in self.products:
+            if not self.checkpoint.already_emitted(record["id"]):
+                yield record
+
+
+def crawl(scraper,output_path,resume=False):
+    asyncio.run(scraper.write_output(output_path,incremental=True,resume=resume))
+    with open(output_path, 'r') as file:
+        return json.load(file)
+
+
+def test_incremental_resume_does_not_repeat_recovered_records(tmp_path):
+    output_path = str(tmp_path / "traderjoes.json")
+    utility.save_json_data([product("a-000001"), product("b-000002"), product("c-000003")],output_path)
+    # The interrupted run had already written "a" to its NDJSON file.
+    with open(f"{output_path}.ndjson", 'w') as part:
+        part.write(json.dumps(product("a-000001")) + "\n")
+
+    # Page 2 still fails, so "c", which may be listed on it, is carried over.
+    scraper = StubTraderjoes([product("a-000001"), product("b-000002", price="$2.49")],
+                             failed_pages=[Traderjoes("https://www.traderjoes.com").listing_url(2)])
+    records = crawl(scraper,output_path,resume=True)
+    assert [record["id"] for record in records] == ["a-000001", "b-000002", "c-000003"]
+    assert records[1]["price"] == "$2.49"
+
+
+def test_incremental_crawl_drops_delisted_products(tmp_path):
+    output_path = str(tmp_path / "traderjoes.json")
+    utility.save_json_data([product("a-000001"), product("b-000002"), product("c-000003")],output_path)
+
+    records = crawl(StubTraderjoes([product("a-000001"), product("c-000003")]),output_path)
+    assert [record["id"] for record in records] == ["a-000001", "c-000003"]
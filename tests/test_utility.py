@@ -0,0 +1,191 @@
+import math
+import logging
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from aiohttp import web
+
+import utility
+import metrics
+import resilience
+import crawlstate
+import site_selectors
+from scheduler import Scheduler
+from conftest import local_server
+
+
+class FakeBrowser():
+    """Stands in for a pyppeteer browser: closing it fires its 'disconnected' handlers, as Chromium does."""
+    def __init__(self):
+        self.handlers = []
+
+    def on(self,event,handler):
+        if event == 'disconnected':
+            self.handlers.append(handler)
+
+    async def close(self):
+        for handler in self.handlers:
+            handler()
+
+
+def test_browser_pool_close_is_not_a_crash(monkeypatch):
+    async def get_browser():
+        return FakeBrowser()
+    monkeypatch.setattr(utility,"get_browser",get_browser)
+
+    async def run():
+        pool = utility.BrowserPool(no_of_browsers=2)
+        await pool.start()
+        crashed = pool._browsers[0]
+        await crashed.close()
+        await pool.close()
+        return pool.stats
+
+    stats = asyncio.run(run())
+    assert stats["launches"] == 2
+    assert stats["crashes"] == 1
+
+
+def test_sink_and_previous_output_keep_nan(tmp_path):
+    output_path = str(tmp_path / "lechocolat.json")
+    with utility.NdjsonSink(output_path) as sink:
+        sink.write({"id": 1, "weight": float("nan")})
+        sink.write({"id": 2, "weight": float("inf")})
+    with open(output_path) as file:
+        assert "NaN" in file.read()
+
+    state = crawlstate.open_for_output(output_path,key="id")
+    assert state.previous_records["2"]["weight"] == float("inf")
+    assert math.isnan(state.previous_records["1"]["weight"])
+    state.close()
+
+
+def test_fetcher_set_fetches_http_pages_over_one_connection():
+    peers = set()
+
+    async def handle(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.Response(text=f'<h1 class="title">{request.path}</h1>', content_type="text/html")
+
+    spec = site_selectors.Spec(title=site_selectors.Field('//h1[@class="title"]/text()'))
+
+    async def run():
+        async with local_server(handle) as base_url:
+            async with utility.FetcherSet({"category": "http", "product": "http"},scheduler=Scheduler(100,burst=10)) as fetchers:
+                pages = [await fetchers.fetch("category",f"{base_url}/category-{n}") for n in range(3)]
+                data = await fetchers.extract("product",f"{base_url}/product",spec)
+                started = set(fetchers._fetchers)
+        return pages, data, started
+
+    pages,data,started = asyncio.run(run())
+    assert pages == [f'<h1 class="title">/category-{n}</h1>' for n in range(3)]
+    assert data == {"title": "/product"}
+    # No page type needs JavaScript, so no browser was launched, and keep-alive reused the connection.
+    assert started == {"http"}
+    assert len(peers) == 1
+
+
+class FakeRequest():
+    def __init__(self,resourceType,url):
+        self.resourceType = resourceType
+        self.url = url
+        self.outcome = None
+
+    async def continue_(self):
+        self.outcome = "continued"
+
+    async def abort(self):
+        self.outcome = "aborted"
+
+
+class FakePage():
+    """Stands in for a pyppeteer page: records the interception flag and the event handlers."""
+    def __init__(self):
+        self.intercepting = False
+        self.handlers = {}
+
+    async def setRequestInterception(self,value):
+        self.intercepting = value
+
+    def on(self,event,handler):
+        self.handlers[event] = handler
+
+
+def test_resource_policy_blocks_assets_and_third_parties(monkeypatch,caplog):
+    metrics.REGISTRY.reset()
+    policy = utility.ResourcePolicy(allowed_types=("document", "script"), allowed_domains=("foreignfortune.com",))
+    requests = [
+        FakeRequest("document", "https://foreignfortune.com/products/joggers"),
+        FakeRequest("script", "https://cdn.foreignfortune.com/theme.js"),
+        FakeRequest("script", "https://www.googletagmanager.com/gtm.js"),
+        FakeRequest("image", "https://foreignfortune.com/joggers.jpg"),
+        FakeRequest("font", "https://foreignfortune.com/font.woff2"),
+        FakeRequest("image", "data:image/png;base64,iVBORw0KGgo="),
+    ]
+
+    async def get_browser():
+        return FakeBrowser()
+    monkeypatch.setattr(utility,"get_browser",get_browser)
+
+    async def run():
+        page = FakePage()
+        await policy.apply(page)
+        for request in requests:
+            page.handlers["request"](request)
+        await asyncio.sleep(0)
+        page.handlers["response"](type("Response", (), {"headers": {"content-length": "2048"}}))
+        # A pool shared by several scrapers reports its policy when it is closed.
+        pool = utility.BrowserPool(resource_policy=policy)
+        await pool.start()
+        await pool.close()
+        return page
+
+    with caplog.at_level(logging.INFO):
+        page = asyncio.run(run())
+    assert page.intercepting
+    assert [request.outcome for request in requests] == ["continued", "continued", "aborted", "aborted", "aborted", "continued"]
+    assert policy.summary() == {"requests_allowed": 3, "requests_blocked": 3,
+                                "blocked_by_type": {"script": 1, "image": 1, "font": 1}, "bytes_received": 2048}
+    assert f"Resource policy: {policy.summary()}" in caplog.messages
+    assert metrics.REGISTRY.counters[("crawl_browser_requests_blocked_total", (("resource_type", "image"),))] == 1
+    assert metrics.REGISTRY.counters[("crawl_browser_bytes_total", ())] == 2048
+    metrics.REGISTRY.reset()
+
+
+class ErrorPagePool():
+    """Stands in for a `BrowserPool` whose pages navigate to an error page without raising, as Chromium does."""
+    def __init__(self,status,headers):
+        self.response = type("Response", (), {"status": status, "headers": headers})
+        self.navigations = 0
+
+    @asynccontextmanager
+    async def page(self):
+        pool = self
+
+        class Page():
+            async def goto(self,url):
+                pool.navigations += 1
+                return pool.response
+        yield Page()
+
+
+def test_browser_error_status_is_a_failed_fetch():
+    pool = ErrorPagePool(429,{"retry-after": "7"})
+    scheduler = Scheduler(100,burst=10)
+
+    async def run():
+        fetcher = utility.BrowserFetcher(pool=pool)
+        async with utility.FetcherSet({"listing": "browser"},scheduler=scheduler,shared_fetchers={"browser": fetcher},
+                                      retry_policy=resilience.RetryPolicy(attempts=1)) as fetchers:
+            try:
+                await fetchers.fetch("listing","https://www.traderjoes.com/home/products/category/food-8",
+                                     wait_selector="//article")
+            except utility.BrowserResponseError as err:
+                return err, fetchers.dead_letters.entries
+
+    err,dead_letters = asyncio.run(run())
+    assert (err.status, err.headers) == (429, {"retry-after": "7"})
+    assert [entry["kind"] for entry in dead_letters.values()] == ["throttled"]
+    [host] = scheduler.hosts.values()
+    assert host.throttled == 1
+    assert host.blocked_until - time.monotonic() > 6
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import validation
+
+RECORDS = [
+    {"id": 1, "title": "Café \"noir\" 🍫", "price": -12.5e-3, "available": True, "tags": []},
+    {"id": 2, "title": "", "price": None, "available": False, "variants": [{"sku": "A-1", "weight": 1e10}]},
+]
+
+
+@pytest.mark.parametrize("indent", [4, None])
+def test_records_split_across_any_chunk_boundary(tmp_path,indent):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps(RECORDS, indent=indent, ensure_ascii=False), encoding="utf-8")
+    for chunk_size in range(1, 12):
+        assert list(validation.iter_records(str(path),chunk_size=chunk_size)) == RECORDS
+
+
+def test_invalid_record_is_reported_where_it_is(tmp_path):
+    path = tmp_path / "records.json"
+    text = json.dumps(RECORDS * 3, indent=4)
+    bad = text.index('"price"', text.index('"id": 2'))
+    path.write_text(text[:bad] + text[bad + 1:])
+    with pytest.raises(ValueError, match=f"invalid record 1 at offset {bad}:"):
+        list(validation.iter_records(str(path),chunk_size=64))
+
+
+def test_truncated_file(tmp_path):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps(RECORDS, indent=4)[:-20])
+    with pytest.raises(ValueError, match="ends in the middle of a record"):
+        list(validation.iter_records(str(path),chunk_size=64))
@@ -1,221 +1,280 @@
 import asyncio
+import sys
 import logging
-from parsel import Selector
-from functools import wraps
+from typing import NamedTuple
+import metrics
+import urlfrontier
 import utility
-
-def logger(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        log = logging.getLogger(fn.__name__)
-        log.info('About to run %s' % fn.__name__)
-        out = fn(*args, **kwargs)
-        log.info('Done running %s' % fn.__name__)
-        return out
-    return wrapper
+import site_selectors
+import checkpoint
+import scheduler
 
 FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LEVEL = logging.INFO
-logging.basicConfig(format=FORMAT, level=LEVEL)
 log = logging.getLogger(__name__)
 log.info('Entered module: %s' % __name__)
 
+class ProductCard(NamedTuple):
+    """One product of the listing; `_asdict()` gives the output record, in output key order."""
+    id: str
+    title: str
+    url: str
+    price: str
+    category: str
+    unit: str
+    image: list
+
 class Traderjoes():
-    def __init__(self,url):
+    # The product listing is rendered client-side by React, so it needs the browser.
+    PAGE_BACKENDS = {
+        "listing": "browser",
+    }
+    # Only the React bundle and its API calls are needed to render the product cards;
+    # images, fonts, media and third-party tags are blocked.
+    RESOURCE_POLICY = {
+        "allowed_types": ("document", "script", "xhr", "fetch"),
+        "allowed_domains": ("traderjoes.com",),
+    }
+    # Politeness limit: token-bucket rate per host, enforced by `scheduler.Scheduler` on every navigation.
+    REQUESTS_PER_SECOND = 1
+    LISTING_PATH = "/home/products/category/products-2"
+    PAGINATION_XPATH = '//ul[@class="Pagination_pagination__list__1JUIg"]'
+    # Product URLs are only normalised (tracking parameters, trailing slashes), see `urlfrontier`.
+    CANONICAL_PATH_RULES = ()
+    # Compiled selectors per page type, see `site_selectors`.
+    SELECTORS = site_selectors.TRADERJOES
+
+    def __init__(self,url,no_of_tabs=4,shared_fetchers=None,cache=None,serializer=None):
+        """
+        Args:
+            url (str): Site base URL.
+            no_of_tabs (int): Number of listing pages loaded concurrently.
+            shared_fetchers (dict): Started fetch backends shared with other scrapers, see `utility.FetcherSet`.
+            cache (responsecache.ResponseCache): Optional on-disk response cache used underneath every fetch.
+            serializer (serializers.Serializer): Encoding and compression of the output file, see `utility.NdjsonSink`.
+        """
         self.url = url
+        self.no_of_tabs = no_of_tabs
+        self.shared_fetchers = shared_fetchers
+        self.cache = cache
+        self.serializer = serializer
+        self.state = None
+        self.checkpoint = None
+        self.dead_letters = None
+        self.frontier = None
+        self.scheduler = scheduler.Scheduler(requests_per_second=self.REQUESTS_PER_SECOND)
+
+    def listing_url(self,page_no):
+        """Returns the URL of listing page `page_no` (1-based), as built by the site's own pagination links."""
+        if page_no == 1:
+            return f"{self.url}{self.LISTING_PATH}"
+        return f"{self.url}{self.LISTING_PATH}?filters=%7B%22page%22%3A{page_no}%7D"
+
+    def parse_page_count(self,listing):
+        """
+        Reads the number of listing pages from the last entry of the pagination list.
+
+        Raises:
+            ValueError: If the pagination list is missing or its last entry is not an integer.
+        """
+        no_of_pages = listing["no_of_pages"]
+        try:
+            return int(no_of_pages)
+        except (TypeError, ValueError):
+            logging.error("Expected No of Pages is not an integer.")
+            raise ValueError(no_of_pages)
 
-    @logger
-    async def get_prod_details(self,page):
+    def parse_product_card(self,card):
         """
-        Scrapes product details from multiple pages of a product listing.
+        Builds one product from the fields extracted from its `li` card of the listing.
 
         This method performs the following steps:
-        1. Extracts the total number of pages from the pagination list. 
-        2. Initializes lists to collect product details such as names, URLs, prices, categories, units, images, and IDs.
-        3. Iterates through each page, scraping product information including:
-        - Product names
-        - Product URLs
-        - Product prices
-        - Product categories
-        - Product units
-        - Product image URLs
-        - Product IDs
-        4. Data cleaning and data extraction is done to the respective lists.
-        5. Navigates to the next page and repeats the process until all pages are scraped.
-        7. Returns a dictionary containing the collected product details.
+        1. Derives the product ID from the last path segment of the product URL.
+        2. Takes the name, price, category and unit of the same card; a missing field is None
+           instead of shifting the fields of the following products.
+        3. Collects the image URLs from the `srcset` and `src` attributes, adding the base url and
+           the ".webp" extension where it is missing.
 
         Args:
-            page (pyppeteer.page.Page): The Pyppeteer page object used for interacting with the webpage.
+            card (dict): The fields of one product card, from the "cards" spec of `SELECTORS`.
 
         Returns:
-            dict: A dictionary with lists of product details:
-                - "product_names": List of product names
-                - "product_urls": List of product URLs
-                - "product_prices": List of product prices
-                - "product_categories": List of product categories
-                - "product_units": List of product units
-                - "product_image_urls": List of lists of product image URLs
-                - "Product_ids": List of product IDs
+            ProductCard: The product, or None if the card has no product link.
         """
+        href = card["href"]
+        if href is None:
+            return None
+        unit = card["unit"]
+        all_urls = card["srcset"] + card["src"]
+        return ProductCard(
+            id=href.split('/')[-1],
+            title=card["title"],
+            url=self.url+href, # Adding Base url
+            price=card["price"],
+            category=card["category"],
+            unit=unit.strip("/") if unit is not None else None, # Removing "/" from Unit
+            image=[self.url+i.strip() if i.strip().endswith(".webp") else self.url+i.strip()+".webp" for i in all_urls], # Adding Base url and Extentions.
+        )
 
+    def parse_listing_page(self,listing):
+        """
+        Builds the products of one listing page with one pass over its product cards.
 
-        html_content = await utility.get_html_data(page=page,wait_selector='//ul[@class="Pagination_pagination__list__1JUIg"]')
-        
-        selector =  Selector(text=html_content)
+        Args:
+            listing (dict): The listing page extracted with the "listing" spec of `SELECTORS`.
 
-        no_of_pages = selector.xpath('//ul[@class="Pagination_pagination__list__1JUIg"]/li[last()]/text()').get()
-        try:
-            ## UNCOMMENT THE BELOW LINE TO GET ALL DATA
-            # no_of_pages=int(no_of_pages)
-            no_of_pages = 3 #Comment this line
-            logging.info(f"Total No of Pages {no_of_pages}")
-        except:
-            logger.error("Expected No of Pages is not an integer.")
-            raise ValueError(no_of_pages)
-        
-        # Initializing lists to collect Product 
-        list_of_product_name  = []
-        list_of_product_url = []
-        list_of_product_price =[]
-        list_of_product_category=[]
-        list_of_product_unit=[]
-        list_of_product_image_urls=[]
-        list_of_product_ids=[]
-        
-        logging.info("Initializing Scraping process....")
-        # print("Products :\n")
-        for page_no in range(1,no_of_pages):
-            logging.info(f"Scraping page {page_no} started....")
-            await page.waitFor('//ul[@class="Pagination_pagination__list__1JUIg"]') # Waiting for the element to load
-            product_url = selector.xpath('//a[@class="Link_link__1AZfr ProductCard_card__img_link__2bBqA"]/@href').getall()
-            id = [i.split('/')[-1] for i in product_url]
-            product_url = [self.url+i for i in product_url] # Adding Base url
-            product_name = selector.xpath('.//h2[@class="ProductCard_card__title__text__uiWLe"]/a/text()').getall()
-            price = selector.xpath('.//span[@class="ProductPrice_productPrice__price__3-50j"]/text()').getall()
-            category = selector.xpath('.//a[@class="Link_link__1AZfr ProductCard_card__category__Hh3rT"]/text()').getall()
-            unit = selector.xpath('.//span[@class="ProductPrice_productPrice__unit__2jvkA"]/text()').getall()
-            unit = [i.strip("/") for i in unit] # Removing "/" from Unit
-            li_elements = selector.xpath('//ul[@class="ProductList_productList__list__3-dGs"]/li')
-            image_url = []
-            for index, li in enumerate(li_elements):
-                srcset_urls = li.xpath('.//source/@srcset').getall()
-                img_src_url = li.xpath('.//img/@src').getall()
-                all_urls = srcset_urls + img_src_url
-                image_url.append([self.url+i.strip() if i.strip().endswith(".webp") else self.url+i.strip()+".webp" for i in all_urls]) # Adding Base url and Extentions.
-
-            
-            if product_url:
-                list_of_product_name.extend(product_name)
-                list_of_product_url.extend(product_url)
-                list_of_product_price.extend(price)
-                list_of_product_unit.extend(unit)
-                list_of_product_category.extend(category)
-                list_of_product_image_urls.extend(image_url)
-                list_of_product_ids.extend(id)
-                # print("\n".join(product_name))
-                logging.info(f"Scraping page {page_no} Completed....")
-            else:
-                logger.error("Expected Product url missing...")
-
-            if page_no<no_of_pages:
-                await page.goto(f"{product_base_url}?filters=%7B%22page%22%3A{page_no+1}%7D")
-                await asyncio.sleep(5)
-            else:
-                break
-        return {
-            "product_names": list_of_product_name,
-            "product_urls": list_of_product_url,
-            "product_prices": list_of_product_price,
-            "product_categories": list_of_product_category,
-            "product_units": list_of_product_unit,
-            "product_image_urls": list_of_product_image_urls,
-            "Product_ids":list_of_product_ids
-        }
-        
-    @logger
-    def convert_to_custom_format(self,data):
-        """
-        Converts product data from a dictionary format to a custom JSON format.
+        Returns:
+            list: The `ProductCard` of every card that has a product link.
+        """
+        products = []
+        for card in listing["cards"]:
+            product = self.parse_product_card(card)
+            if product is None:
+                logging.warning("Skipping product card without a product url")
+                continue
+            products.append(product)
+        if not products:
+            logging.error("Expected Product url missing...")
+        return products
 
-        This method performs the following steps:
-        1. Maps the keys in the input dictionary to new keys defined in `key_mapping`.
-        2. Iterates through the list of product names and creates a new dictionary for each product.
-        3. For each product, it assigns values from the input dictionary to the new keys according to the mapping.
-        4. Collects all the product dictionaries into a list.
-        5. Returns the list of product dictionaries in the custom format.
+    async def fetch_listing_page(self,fetchers,url):
+        """
+        Loads one listing page and returns the page count and product card fields extracted
+        with the "listing" spec of `SELECTORS`.
 
-        Args:
-            data (dict): A dictionary containing product data with keys such as 'product_names', 'product_urls', etc.
+        The navigation goes through `self.scheduler` (and the response cache, if any), and the
+        extraction runs only once the product list has rendered, so every page is read from
+        its own content.
+        """
+        response = await fetchers.extract_response("listing",url,self.SELECTORS["listing"],wait_selector=self.PAGINATION_XPATH)
+        return response.data
 
-        Returns:
-            list: A list of dictionaries, each representing a product with keys in the custom format.
-        """
-
-        key_mapping = {
-            "Product_ids": "id",
-            'product_names': 'title',
-            'product_urls': 'url',
-            'product_prices': 'price',
-            'product_categories': 'category',
-            'product_units': 'unit',
-            'product_image_urls': 'image'
-        }
-
-        length = len(data['product_names'])
-        result = []
-        for i in range(length):
-            product = {}
-            for old_key, new_key in key_mapping.items():
-                product[new_key] = data[old_key][i]
-            result.append(product)
-
-        return result
-
-    @logger  
-    async def GetData(self):
+    @metrics.traced
+    async def get_prod_details(self,fetchers):
         """
-        Asynchronously retrieves product details from a specified category page using a headless browser.
+        Scrapes product details from every page of the product listing.
 
         This method performs the following steps:
-        1. Launches a headless browser and opens a new page.
-        2. Navigates to the product category page using the `base_url` attribute.
-        3. Calls `self.get_prod_details(page)` to fetch product details from all the pages.
-        4. Closes the browser.
-        5. Returns the product details as a dictionary.
+        1. Loads the first listing page and reads the total number of pages from its pagination list.
+        2. Builds the `?filters={"page":N}` URL of every remaining page and loads them concurrently,
+           at most `no_of_tabs` at a time, with `utility.iter_worker_pool()`. Only the card fields are
+           extracted in each page, and `parse_listing_page()` builds one `ProductCard` per product card.
+        3. Yields the products page by page in listing order, so only the pages in flight are held in memory.
+        4. With a checkpoint (`self.checkpoint`), saves the page count and the next page number after each
+           page; on resume the crawl starts at that page and skips products already written.
+        5. A listing page that still fails after the retries of `utility.FetcherSet` is skipped and becomes
+           a dead letter; failed pages are retried once more after the last page.
 
-        Returns:
-            dict: A dictionary containing product details retrieved from the page.
+        Args:
+            fetchers (utility.FetcherSet): The fetch backends declared in `PAGE_BACKENDS`.
+
+        Yields:
+            dict: One product record with the keys "id", "title", "url", "price", "category", "unit" and "image".
         """
-        browser = await utility.get_browser()
-        page = await browser.newPage()
+        start_page = self.checkpoint.get("next_page",1) if self.checkpoint else 1
+        no_of_pages = self.checkpoint.get("no_of_pages") if self.checkpoint else None
+        first_page = None
+        # Products move between listing pages while the crawl runs; each one is emitted once.
+        frontier = self.frontier or urlfrontier.Frontier(base=self.url,path_rules=self.CANONICAL_PATH_RULES)
+        if start_page == 1 or no_of_pages is None:
+            first_page = await self.fetch_listing_page(fetchers,self.listing_url(1))
+            logging.info('Sucessfull navigated to Products page...')
+            no_of_pages = self.parse_page_count(first_page)
+        logging.info(f"Total No of Pages {no_of_pages}")
 
-        global product_base_url
-        product_base_url = f'{self.url}/home/products/category/products-2'
-        await page.goto(product_base_url)
-        logging.info('Sucessfull navigated to Products page...')   
+        async def emit(page_no,products):
+            for product in products:
+                if not frontier.add(product.url):
+                    continue
+                if self.checkpoint and self.checkpoint.already_emitted(product.id):
+                    continue
+                yield product._asdict()
+            if self.checkpoint:
+                self.checkpoint.save(no_of_pages=no_of_pages,next_page=page_no+1)
+            logging.info(f"Scraping page {page_no} Completed....")
 
-        Product_dict = await self.get_prod_details(page)
+        logging.info("Initializing Scraping process....")
+        if start_page == 1:
+            async for product in emit(1,self.parse_listing_page(first_page)):
+                yield product
+            start_page = 2
+        elif start_page <= no_of_pages:
+            logging.info(f"Resuming at page {start_page}....")
 
-        await browser.close()
+        async def fetch_products(url):
+            return self.parse_listing_page(await self.fetch_listing_page(fetchers,url))
 
-        return Product_dict
-    
-    @logger
-    def output(self,output_path):
+        async def fetch_products_or_skip(url):
+            try:
+                return await fetch_products(url)
+            except Exception as err:
+                logging.error(f"Skipping listing page {url}: {err!r}")
+                if url not in fetchers.dead_letters:
+                    fetchers.dead_letters.add(url,"listing",err)
+                return []
+
+        page_numbers = list(range(start_page,no_of_pages+1))
+        urls = [self.listing_url(page_no) for page_no in page_numbers]
+        pages = utility.iter_worker_pool(urls,fetch_products_or_skip,no_of_workers=self.no_of_tabs)
+        page_no = start_page
+        async for products in pages:
+            async for product in emit(page_no,products):
+                yield product
+            page_no += 1
+        async for products in fetchers.retry_dead_letters("listing",fetch_products):
+            for product in products:
+                if not frontier.add(product.url):
+                    continue
+                if self.checkpoint and self.checkpoint.already_emitted(product.id):
+                    continue
+                yield product._asdict()
+
+    @metrics.traced
+    async def GetData(self):
         """
-        Retrieves product data asynchronously, converts it to a custom JSON format, and saves it to a specified file.
+        Asynchronously retrieves product details from a specified category page using a headless browser.
 
         This method performs the following steps:
-        1. Calls the asynchronous method `GetData()` to fetch product data.
-        2. Converts the fetched data into a custom JSON format using `convert_to_custom_format()`.
-        3. Saves the converted JSON data to a file at the path specified using `utility.output()`.
+        1. Opens a `utility.FetcherSet` for the backends declared in `PAGE_BACKENDS`.
+        2. Calls `self.get_prod_details(fetchers)` to fetch product details from all the listing pages.
+        3. Closes the fetch backends.
 
+        Yields:
+            dict: Product records retrieved from the listing pages, one at a time.
         """
-        Product_dict = asyncio.get_event_loop().run_until_complete(self.GetData())
-        json_data = self.convert_to_custom_format(Product_dict)
+        backend_options = {"browser": {"resource_policy": utility.ResourcePolicy(**self.RESOURCE_POLICY)}}
+        async with utility.FetcherSet(self.PAGE_BACKENDS,backend_options,scheduler=self.scheduler,shared_fetchers=self.shared_fetchers,cache=self.cache,dead_letters=self.dead_letters) as fetchers:
+            async for product in self.get_prod_details(fetchers):
+                yield product
 
-        return utility.output(json_data,output_path)
+    async def track_changes(self,records):
+        """Records each product's content hash in `self.state` while passing the records through."""
+        async for product in records:
+            self.state.update(product["url"],product["id"],product)
+            yield product
+    
+    async def write_output(self,output_path,incremental=False,resume=False):
+        """
+        Crawls the listing pages and writes the products to `output_path` with `utility.run_output()`.
 
+        With `incremental=True`, each product's content hash is recorded in the crawl state.
+        Products come from listing pages, so no fetch can be skipped here.
+        """
+        records = self.track_changes(self.GetData()) if incremental else self.GetData()
+        return await utility.run_output(self,records,output_path,checkpoint_key="id",incremental=incremental,resume=resume)
+
+    @metrics.traced
+    def output(self,output_path,incremental=False,resume=False):
+        """
+        Retrieves product data and saves it to a specified file by running `write_output()` on the event loop.
+
+        Returns:
+            int: Number of records written.
+        """
+        return asyncio.get_event_loop().run_until_complete(self.write_output(output_path,incremental=incremental,resume=resume))
 
 
-Traderjoes("https://www.traderjoes.com").output(output_path = "./output/traderjoes.json")
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    checkpoint.exit_on_sigterm()
+    Traderjoes("https://www.traderjoes.com").output(output_path = "./output/traderjoes.json",resume="--resume" in sys.argv)
@@ -0,0 +1,184 @@
+import os
+import re
+import math
+import struct
+import hashlib
+import logging
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+import metrics
+
+# Query parameters that identify a campaign, a click or a variant, never a different page.
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "mc_cid", "mc_eid", "srsltid", "ref", "ref_",
+                   "_pos", "_sid", "_ss", "_psq", "_fid", "_v", "variant"}
+TRACKING_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Shopify serves every product of a collection under /collections/<handle>/products/<product>
+# as well; the canonical page is /products/<product>.
+SHOPIFY_PATH_RULES = ((r"^/collections/[^/]+/products/", "/products/"),)
+
+
+def canonicalize_url(url,base=None,path_rules=()):
+    """
+    Returns the canonical form of a URL, used to recognise the same page behind different links.
+
+    This function performs the following steps:
+    1. Resolves `url` against `base` (e.g. a root-relative link of the page).
+    2. Lower-cases scheme and host, drops the default port and the fragment.
+    3. Collapses repeated slashes, applies the site's `path_rules` (regex, replacement)
+       and strips the trailing slash.
+    4. Drops tracking and variant parameters (`TRACKING_PARAMS`, "utm_*") and sorts the rest.
+    """
+    if base:
+        url = urljoin(base,url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    for pattern,replacement in path_rules:
+        path = re.sub(pattern, replacement, path)
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    query = sorted((key, value) for key,value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES))
+    return urlunsplit((scheme, netloc, path, urlencode(query), ""))
+
+
+def fingerprint(key):
+    """Returns a 64-bit fingerprint of a canonical URL; a set of these takes a fraction of the memory of the URLs."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class BloomFilter():
+    """
+    Fixed-size Bloom filter of strings, stored in a single file.
+
+    Membership tests can return false positives at about `error_rate` once `capacity`
+    items are added, never false negatives; one million URLs at 1% take 1.2 MB.
+
+    Args:
+        capacity (int): Number of items the filter is sized for.
+        error_rate (float): False positive rate at `capacity` items.
+    """
+    HEADER = struct.Struct("<4sQQQ")
+    MAGIC = b"BLM1"
+
+    def __init__(self,capacity=1_000_000,error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self,item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self,item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self,item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @classmethod
+    def load(cls,path):
+        with open(path, 'rb') as file:
+            magic,size,hashes,count = cls.HEADER.unpack(file.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            bloom = cls.__new__(cls)
+            bloom.size, bloom.hashes, bloom.count = size, hashes, count
+            bloom.capacity = round(size * math.log(2) / hashes)
+            bloom.bits = bytearray(file.read())
+        return bloom
+
+    def save(self,path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.size, self.hashes, self.count))
+            file.write(self.bits)
+        os.replace(tmp_path, path)
+
+
+class Frontier():
+    """
+    URL frontier shared by the scrapers: canonicalises and deduplicates the URLs they
+    discover, and puts pages that no earlier run has seen first.
+
+    Within a run deduplication is exact (a set of 64-bit fingerprints of the canonical
+    URLs). Across runs a `BloomFilter` kept in `seen_path` remembers every URL seen;
+    it only decides the order of the pages, so a false positive can delay a new page
+    but never skip it.
+
+    Args:
+        seen_path (str): File of the persistent seen-set, or None for a single run.
+        base (str): Base URL relative links are resolved against.
+        path_rules (tuple): (regex, replacement) pairs applied to the path, e.g. `SHOPIFY_PATH_RULES`.
+        capacity (int): Size of a new seen-set, see `BloomFilter`.
+    """
+    def __init__(self,seen_path=None,base=None,path_rules=(),capacity=1_000_000):
+        self.seen_path = seen_path
+        self.base = base
+        self.path_rules = path_rules
+        self.seen = set()
+        self.duplicates = 0
+        self.previously_seen = None
+        if seen_path and os.path.exists(seen_path):
+            try:
+                self.previously_seen = BloomFilter.load(seen_path)
+            except (OSError, ValueError, struct.error) as err:
+                logging.warning(f"Ignoring unreadable seen-set {seen_path}: {err}")
+        if self.previously_seen is None:
+            self.previously_seen = BloomFilter(capacity=capacity)
+
+    def canonical(self,url):
+        return canonicalize_url(url,base=self.base,path_rules=self.path_rules)
+
+    def _add(self,url):
+        """Returns (added, seen_before): whether `url` is new in this run and whether an earlier run saw it."""
+        canonical = self.canonical(url)
+        key = fingerprint(canonical)
+        if key in self.seen:
+            self.duplicates += 1
+            metrics.count("crawl_frontier_urls_total",result="duplicate")
+            return False, True
+        self.seen.add(key)
+        seen_before = canonical in self.previously_seen
+        if not seen_before:
+            self.previously_seen.add(canonical)
+        metrics.count("crawl_frontier_urls_total",result="seen_before" if seen_before else "unseen")
+        return True, seen_before
+
+    def add(self,url):
+        """Records `url`; returns False if a URL with the same canonical form was already added in this run."""
+        return self._add(url)[0]
+
+    def prioritise(self,urls):
+        """
+        Returns `urls` without the URLs already added in this run and without duplicates,
+        pages that no earlier run has seen first; the order is kept otherwise.
+        """
+        fresh,known = [],[]
+        for url in urls:
+            added,seen_before = self._add(url)
+            if added:
+                (known if seen_before else fresh).append(url)
+        if fresh and known:
+            logging.info(f"Frontier: {len(fresh)} unseen pages first, then {len(known)} seen in earlier runs")
+        return fresh + known
+
+    def save(self):
+        """Writes the persistent seen-set, which now includes every URL added in this run."""
+        if self.duplicates:
+            logging.info(f"Frontier: skipped {self.duplicates} duplicate URLs")
+        if not self.seen_path:
+            return
+        if self.previously_seen.count > self.previously_seen.capacity:
+            logging.warning(f"Seen-set {self.seen_path} holds {self.previously_seen.count} URLs, more than its "
+                            f"capacity of {self.previously_seen.capacity}; delete it to start a larger one")
+        self.previously_seen.save(self.seen_path)
@@ -1,12 +1,38 @@
+import os
+import gzip
 import json
 import asyncio
+import logging
+import aiohttp
 import pyppeteer
+import metrics
+import serializers
+import resilience
+import crawlstate
+import checkpoint
+import urlfrontier
+import columnar as columnar_output
+from scheduler import Scheduler
+from responsecache import CacheMiss
+from multidict import CIMultiDict
+from collections import namedtuple, Counter
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
 
-def save_json_data(data,file_path):
-    with open(file_path, 'w') as json_file:
-        json.dump(data, json_file, indent=4)
+def save_json_data(data,file_path,serializer=None):
+    """
+    Writes `data` as JSON through a temporary file and an atomic rename, with the default
+    layout of `json.dump(..., indent=4)` unless another `serializers.Serializer` is given.
+    """
+    (serializer or serializers.DEFAULT).write(data,file_path)
     return
 
+DEFAULT_HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/json;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-GB,en;q=0.9",
+}
+
 async def get_browser():
     return await pyppeteer.launch(
             {"args": 
@@ -24,6 +50,108 @@ async def get_browser():
             "headless": True,
             "ignoreHTTPSErrors": True,})
 
+class HostLimiter():
+    """
+    Caps the number of in-flight requests per host.
+
+    One `asyncio.Semaphore` is created lazily for every host seen, so tabs or
+    workers hitting different sites do not block each other while a single
+    storefront never receives more than `max_per_host` concurrent requests.
+    """
+    def __init__(self,max_per_host=4):
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+
+    def for_url(self,url):
+        host = urlsplit(url).netloc
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self._semaphores[host]
+
+async def iter_worker_pool(urls,handler,no_of_workers=8,host_limiter=None,window=None):
+    """
+    Processes a list of URLs with a bounded pool of concurrent workers and yields
+    the results in the order of `urls` as soon as they are available.
+
+    This function performs the following steps:
+    1. Puts every (index, url) pair on an `asyncio.Queue`.
+    2. Starts `no_of_workers` workers that drain the queue.
+    3. Each worker takes the next URL, acquires the per-host slot and calls `handler(url)`.
+    4. Finished results wait in a reorder buffer until every earlier result has been yielded.
+       Workers never run more than `window` URLs ahead of the consumer, so the buffer stays bounded.
+
+    Args:
+        urls (list[str]): URLs to process, in the order the results should be yielded.
+        handler (coroutine function): Called as `await handler(url)`, returns one result.
+        no_of_workers (int): Number of concurrent workers.
+        host_limiter (HostLimiter): Optional per-host concurrency cap.
+        window (int): Maximum distance between the oldest pending and newest started URL.
+            Defaults to four times `no_of_workers`.
+
+    Yields:
+        The result of `handler(url)` for each URL, in the same order as `urls`.
+
+    Raises:
+        Exception: The first exception raised by `handler`; the other workers are cancelled.
+    """
+    if not urls:
+        return
+    queue = asyncio.Queue()
+    for index,url in enumerate(urls):
+        queue.put_nowait((index,url))
+    host_limiter = host_limiter or HostLimiter(max_per_host=no_of_workers)
+    no_of_workers = max(1,min(no_of_workers,len(urls)))
+    window = window or no_of_workers * 4
+    finished = {}
+    failures = []
+    next_index = 0
+    condition = asyncio.Condition()
+
+    async def worker():
+        while True:
+            try:
+                index,url = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            async with condition:
+                await condition.wait_for(lambda: index < next_index + window)
+            try:
+                async with host_limiter.for_url(url):
+                    result = await handler(url)
+            except Exception as err:
+                async with condition:
+                    failures.append(err)
+                    condition.notify_all()
+                return
+            async with condition:
+                finished[index] = result
+                condition.notify_all()
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(no_of_workers)]
+    try:
+        while next_index < len(urls):
+            async with condition:
+                await condition.wait_for(lambda: next_index in finished or failures)
+                if failures:
+                    raise failures[0]
+                result = finished.pop(next_index)
+                next_index += 1
+                condition.notify_all()
+            yield result
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers,return_exceptions=True)
+
+async def run_worker_pool(urls,handler,no_of_workers=8,host_limiter=None):
+    """
+    Same as `iter_worker_pool()` but collects every result into a list.
+
+    Returns:
+        list: One result per URL, in the same order as `urls`.
+    """
+    return [result async for result in iter_worker_pool(urls,handler,no_of_workers,host_limiter)]
+
 async def get_html_data(page,wait_selector=None):
     """
     Waits for a specific element to load on the page and returns the page's HTML content.
@@ -64,13 +192,809 @@ async def get_full_html_data(page,wait_selector=None):
     html_content = await page.evaluate('document.documentElement.outerHTML')
     return html_content
 
-def output(json_data,output_path = "./output/traderjoes.json"):
+# status is 304 when a conditional request found the page unchanged; text is then None.
+FetchResponse = namedtuple("FetchResponse", ["url", "status", "text", "headers"])
+# Like FetchResponse, with only the data extracted from the page; data is None on a 304.
+ExtractResponse = namedtuple("ExtractResponse", ["url", "status", "data", "headers"])
+
+# Evaluates a `site_selectors.Spec` description (`Spec.in_page()`) against the live DOM and
+# returns only the matched strings: text and attribute nodes as their text, elements as outerHTML.
+SPEC_EXTRACT_JS = """(spec) => {
+    const snapshot = (xpath, context, limit) => {
+        const result = document.evaluate(xpath, context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        const count = limit ? Math.min(limit, result.snapshotLength) : result.snapshotLength;
+        const nodes = [];
+        for (let i = 0; i < count; i++) nodes.push(result.snapshotItem(i));
+        return nodes;
+    };
+    const text = (node) => node.nodeType === Node.ELEMENT_NODE ? node.outerHTML : node.textContent;
+    const evaluate = (field, context) => {
+        if (field[0] === "xpath") return snapshot(field[1], context, field[2]).map(text);
+        const [, container, fields] = field;
+        const extract = (node) => Object.fromEntries(
+            Object.entries(fields).map(([name, sub]) => [name, evaluate(sub, node)]));
+        return container ? snapshot(container, context, 0).map(extract) : extract(context);
+    };
+    return evaluate(spec, document);
+}"""
+
+async def extract_in_page(page,spec=None,script=None,args=()):
+    """
+    Extracts data inside the browser page and returns only that data, instead of
+    serialising the whole DOM over the DevTools connection and re-parsing it in Python.
+
+    Args:
+        page (pyppeteer.page.Page): The page to extract from.
+        spec (site_selectors.Spec): Selector spec; the result is the same as `spec.extract_page()`
+            on the page's HTML.
+        script (str): A JavaScript function evaluated instead of `spec`; its JSON-serialisable
+            return value is returned as it is.
+        args (tuple): Arguments passed to `script`.
+
+    Returns:
+        The extracted value.
+    """
+    if script is not None:
+        return await page.evaluate(script,*args)
+    return spec.from_in_page(await page.evaluate(SPEC_EXTRACT_JS,spec.in_page()))
+
+# Resolves once no DOM mutation has been observed for `quietMs`, or with false after `timeoutMs`.
+DOM_QUIET_JS = """(quietMs, timeoutMs) => new Promise((resolve) => {
+    let quietTimer;
+    const finish = (value) => { observer.disconnect(); clearTimeout(quietTimer); clearTimeout(hardTimer); resolve(value); };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => finish(true), quietMs);
+    });
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+    quietTimer = setTimeout(() => finish(true), quietMs);
+    const hardTimer = setTimeout(() => finish(false), timeoutMs);
+})"""
+
+async def wait_until_ready(page,wait_selector=None,quiet_ms=500,timeout=30000):
+    """
+    Waits until a page is ready to be scraped instead of sleeping for a fixed time.
+
+    This function performs the following steps:
+    1. Waits for `wait_selector` (CSS or XPath) to be present, up to `timeout` ms.
+    2. Waits until the DOM has had no mutation for `quiet_ms` (client-side rendering has settled),
+       giving up after the remaining `timeout`.
+
+    Args:
+        page (pyppeteer.page.Page): The page to wait on.
+        wait_selector (str): The CSS or XPath selector that marks the content as rendered.
+        quiet_ms (int): How long the DOM must stay unchanged.
+        timeout (int): Overall budget in milliseconds.
+
+    Returns:
+        bool: True if the DOM went quiet, False if the timeout was reached first.
+
+    Raises:
+        resilience.SelectorTimeout: If `wait_selector` did not appear within `timeout`.
+    """
+    started = asyncio.get_event_loop().time()
+    if wait_selector:
+        try:
+            await page.waitFor(wait_selector,{"timeout": timeout})
+        except pyppeteer.errors.TimeoutError as err:
+            raise resilience.SelectorTimeout(f"{wait_selector} not found on {page.url} within {timeout} ms") from err
+    remaining = max(quiet_ms,timeout - int((asyncio.get_event_loop().time() - started) * 1000))
+    quiet = await page.evaluate(DOM_QUIET_JS,quiet_ms,remaining)
+    if not quiet:
+        logging.warning(f"DOM still changing after {timeout} ms on {page.url}")
+    return quiet
+
+class HttpFetcher():
+    """
+    Fetch backend for server-rendered pages, built on a pooled `aiohttp` session.
+
+    A single `ClientSession` is kept open for the whole crawl so TCP/TLS
+    connections are reused (keep-alive) across requests to the same host.
+    `wait_selector` is accepted for interface compatibility and ignored: the
+    response body is complete as soon as it is received.
+    """
+    name = "http"
+
+    def __init__(self,limit=64,limit_per_host=8,timeout=30,headers=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.headers = headers or DEFAULT_HTTP_HEADERS
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=30,
+            ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def fetch_response(self,url,headers=None,wait_selector=None,full_page=False):
+        async with self.session.get(url,headers=headers) as response:
+            if response.status == 304:
+                return FetchResponse(url,304,None,response.headers.copy())
+            response.raise_for_status()
+            return FetchResponse(url,response.status,await response.text(),response.headers.copy())
+
+    async def fetch(self,url,wait_selector=None,full_page=False):
+        return (await self.fetch_response(url)).text
+
+    async def extract_response(self,url,spec=None,script=None,headers=None,wait_selector=None):
+        """Fetches `url` and evaluates `spec` on the response body; `script` needs the browser backend."""
+        if script is not None:
+            raise ValueError("JavaScript extractors need the browser backend")
+        response = await self.fetch_response(url,headers=headers)
+        data = None if response.text is None else spec.extract_page(response.text)
+        return ExtractResponse(url,response.status,data,response.headers)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class ResourcePolicy():
+    """
+    Allowlist of resource types and domains enforced on browser pages with request interception.
+
+    Requests whose resource type is not in `allowed_types`, or whose host is not one of
+    `allowed_domains` (or a subdomain of one), are aborted before they hit the network.
+    `data:` URLs are always allowed. The policy keeps per-crawl counters so the savings
+    can be reported with `summary()`, and counts every blocked request in `metrics`
+    (`crawl_browser_requests_blocked_total`, by resource type).
+
+    The savings are measured in requests only: a blocked request is aborted before its
+    response starts, so its size is never known. Bytes are counted for the allowed
+    requests alone (`crawl_browser_bytes_total`, from Content-Length).
+
+    Args:
+        allowed_types (iterable of str): Puppeteer resource types, e.g. "document", "script", "xhr".
+        allowed_domains (iterable of str): Hosts whose requests may pass. Empty allows every host.
+    """
+    def __init__(self,allowed_types=("document","script","xhr","fetch"),allowed_domains=()):
+        self.allowed_types = set(allowed_types)
+        self.allowed_domains = tuple(allowed_domains)
+        self.allowed = 0
+        self.blocked = 0
+        self.blocked_by_type = Counter()
+        self.bytes_received = 0
+
+    def allows(self,resource_type,url):
+        if url.startswith("data:"):
+            return True
+        if resource_type not in self.allowed_types:
+            return False
+        if not self.allowed_domains:
+            return True
+        host = urlsplit(url).hostname or ""
+        return any(host == domain or host.endswith("." + domain) for domain in self.allowed_domains)
+
+    async def apply(self,page):
+        """Turns on request interception for `page` and enforces the policy on every request."""
+        await page.setRequestInterception(True)
+        page.on('request',lambda request: asyncio.ensure_future(self._on_request(request)))
+        page.on('response',self._on_response)
+
+    async def _on_request(self,request):
+        if self.allows(request.resourceType,request.url):
+            self.allowed += 1
+            await request.continue_()
+        else:
+            self.blocked += 1
+            self.blocked_by_type[request.resourceType] += 1
+            metrics.count("crawl_browser_requests_blocked_total",resource_type=request.resourceType)
+            await request.abort()
+
+    def _on_response(self,response):
+        size = int(response.headers.get("content-length") or 0)
+        self.bytes_received += size
+        metrics.count("crawl_browser_bytes_total",size)
+
+    def summary(self):
+        """
+        Returns the requests allowed and blocked (saved) so far, the blocked ones by
+        resource type, and the bytes received for the allowed ones (from Content-Length);
+        the bytes of the blocked requests are not measured.
+        """
+        return {
+            "requests_allowed": self.allowed,
+            "requests_blocked": self.blocked,
+            "blocked_by_type": dict(self.blocked_by_type),
+            "bytes_received": self.bytes_received,
+        }
+
+class PooledPage():
+    def __init__(self,page,index,browser):
+        self.page = page
+        self.index = index
+        self.browser = browser
+        self.navigations = 0
+
+    def on_load(self):
+        self.navigations += 1
+
+class BrowserPool():
+    """
+    Pool of long-lived Chromium processes that hands out pages.
+
+    This class performs the following:
+    1. `start()` launches `no_of_browsers` browsers up front, so no fetch pays a cold start.
+    2. `page()` is an async context manager that checks out an idle page, or opens one on the
+       browser with the fewest pages; at most `pages_per_browser` pages per browser are in use.
+    3. On release, a page that has served `max_navigations` navigations or whose JS heap is above
+       `max_heap_mb` is closed instead of reused, which keeps memory flat on long crawls.
+    4. A browser that disconnects (crash, OOM kill) is dropped with its pages and relaunched
+       the next time a page is needed from it.
+
+    The pool can be shared by several scrapers through `BrowserFetcher(pool=...)`.
+
+    Args:
+        no_of_browsers (int): Number of browser processes.
+        pages_per_browser (int): Maximum pages checked out per browser.
+        max_navigations (int): Navigations after which a page is recycled.
+        max_heap_mb (int): JS heap size in MB after which a page is recycled.
+        resource_policy (ResourcePolicy): Optional policy applied to every new page.
+    """
+    def __init__(self,no_of_browsers=1,pages_per_browser=8,max_navigations=100,max_heap_mb=512,resource_policy=None):
+        self.no_of_browsers = no_of_browsers
+        self.pages_per_browser = pages_per_browser
+        self.max_navigations = max_navigations
+        self.max_heap_bytes = max_heap_mb * 1024 * 1024
+        self.resource_policy = resource_policy
+        self.stats = Counter()
+        self._browsers = [None] * no_of_browsers
+        self._page_counts = [0] * no_of_browsers
+        self._idle = asyncio.Queue()
+        self._slots = asyncio.Semaphore(no_of_browsers * pages_per_browser)
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        self._browsers = list(await asyncio.gather(*[self._launch(index) for index in range(self.no_of_browsers)]))
+
+    async def _launch(self,index):
+        browser = await get_browser()
+        browser.on('disconnected',lambda: self._on_disconnected(index,browser))
+        self._page_counts[index] = 0
+        self.stats["launches"] += 1
+        return browser
+
+    def _on_disconnected(self,index,browser):
+        if self._browsers[index] is browser:
+            logging.warning(f"Browser {index} disconnected, it will be relaunched on next use")
+            self._browsers[index] = None
+            self.stats["crashes"] += 1
+
+    def _healthy(self,entry):
+        return entry.browser is self._browsers[entry.index] and not entry.page.isClosed()
+
+    async def _new_page(self):
+        async with self._lock:
+            index = min(range(self.no_of_browsers),key=lambda i: self._page_counts[i])
+            if self._browsers[index] is None:
+                self._browsers[index] = await self._launch(index)
+            browser = self._browsers[index]
+            self._page_counts[index] += 1
+        try:
+            page = await browser.newPage()
+            if self.resource_policy is not None:
+                await self.resource_policy.apply(page)
+        except BaseException:
+            self._page_counts[index] -= 1
+            raise
+        entry = PooledPage(page,index,browser)
+        page.on('load',entry.on_load)
+        self.stats["pages_opened"] += 1
+        return entry
+
+    async def _discard(self,entry):
+        if entry.browser is self._browsers[entry.index]:
+            self._page_counts[entry.index] -= 1
+            try:
+                await entry.page.close()
+            except Exception:
+                pass
+
+    async def _release(self,entry):
+        if not self._healthy(entry):
+            await self._discard(entry)
+            return
+        reason = None
+        if entry.navigations >= self.max_navigations:
+            reason = "navigations"
+        else:
+            try:
+                metrics = await entry.page.metrics()
+                if metrics.get("JSHeapUsedSize",0) > self.max_heap_bytes:
+                    reason = "memory"
+            except Exception:
+                reason = "error"
+        if reason:
+            self.stats[f"recycled_{reason}"] += 1
+            await self._discard(entry)
+        else:
+            self._idle.put_nowait(entry)
+
+    @asynccontextmanager
+    async def page(self):
+        async with self._slots:
+            entry = None
+            while entry is None and not self._idle.empty():
+                candidate = self._idle.get_nowait()
+                if self._healthy(candidate):
+                    entry = candidate
+                else:
+                    await self._discard(candidate)
+            if entry is None:
+                entry = await self._new_page()
+            try:
+                yield entry.page
+            finally:
+                await self._release(entry)
+
+    async def close(self):
+        # Empty the slots first, so the 'disconnected' events of a normal shutdown are not counted as crashes.
+        browsers,self._browsers = self._browsers,[None] * self.no_of_browsers
+        self._page_counts = [0] * self.no_of_browsers
+        self._idle = asyncio.Queue()
+        for browser in browsers:
+            if browser is not None:
+                await browser.close()
+        logging.info(f"Browser pool: {dict(self.stats)}")
+        if self.resource_policy is not None:
+            logging.info(f"Resource policy: {self.resource_policy.summary()}")
+
+class BrowserResponseError(Exception):
+    """
+    Raised for a browser navigation answered with a 4xx or 5xx status, which `page.goto()`
+    returns without raising. Like aiohttp's `ClientResponseError` it carries `status` and
+    `headers`, so the retries and the scheduler treat both backends alike.
+    """
+    def __init__(self,url,status,headers):
+        super().__init__(url,status,headers)
+        self.url = url
+        self.status = status
+        self.headers = headers
+
+    def __str__(self):
+        return f"{self.status} for {self.url}"
+
+def raise_for_status(url,response):
+    if response is not None and response.status >= 400:
+        raise BrowserResponseError(url,response.status,response.headers)
+
+class BrowserFetcher():
+    """
+    Fetch backend for pages that need JavaScript, built on pyppeteer.
+
+    Pages come from a `BrowserPool`, either a shared one passed as `pool` or a private
+    one with a single browser and `no_of_tabs` pages started with the fetcher. When a
+    `ResourcePolicy` is given, every page of the private pool enforces it.
+    """
+    name = "browser"
+
+    def __init__(self,pool=None,no_of_tabs=8,resource_policy=None):
+        self.pool = pool
+        self._owns_pool = pool is None
+        self.no_of_tabs = no_of_tabs
+        self.resource_policy = resource_policy
+
+    async def start(self):
+        if self.pool is None:
+            self.pool = BrowserPool(pages_per_browser=self.no_of_tabs,resource_policy=self.resource_policy)
+            await self.pool.start()
+
+    def page(self):
+        """Async context manager checking out a page from the pool."""
+        return self.pool.page()
+
+    async def fetch_response(self,url,headers=None,wait_selector=None,full_page=False):
+        # Conditional headers are not sent from the browser; callers fall back to content hashes.
+        async with self.pool.page() as page:
+            response = await page.goto(url)
+            raise_for_status(url,response)
+            await wait_until_ready(page,wait_selector)
+            if full_page:
+                text = await get_full_html_data(page=page)
+            else:
+                text = await get_html_data(page=page)
+        if response is None:
+            return FetchResponse(url,200,text,{})
+        return FetchResponse(url,response.status,text,response.headers)
+
+    async def fetch(self,url,wait_selector=None,full_page=False):
+        return (await self.fetch_response(url,wait_selector=wait_selector,full_page=full_page)).text
+
+    async def extract_response(self,url,spec=None,script=None,headers=None,wait_selector=None):
+        """Navigates to `url` and returns only the data extracted in the page with `extract_in_page()`."""
+        async with self.pool.page() as page:
+            response = await page.goto(url)
+            raise_for_status(url,response)
+            await wait_until_ready(page,wait_selector)
+            async with metrics.span("extract",backend=self.name):
+                data = await extract_in_page(page,spec=spec,script=script)
+        if response is None:
+            return ExtractResponse(url,200,data,{})
+        return ExtractResponse(url,response.status,data,response.headers)
+
+    async def close(self):
+        if self.pool is None:
+            return
+        if self._owns_pool:
+            await self.pool.close()
+            self.pool = None
+
+FETCHER_BACKENDS = {
+    HttpFetcher.name: HttpFetcher,
+    BrowserFetcher.name: BrowserFetcher,
+}
+
+class FetcherSet():
+    """
+    Routes each page type of a scraper to the fetch backend it declares.
+
+    Scrapers declare a mapping such as `{"category": "http", "listing": "browser"}`.
+    Backends are started on first use only, so a scraper that never needs
+    JavaScript never launches Chromium.
+
+    Args:
+        page_backends (dict): Page type -> backend name (see `FETCHER_BACKENDS`).
+        backend_options (dict): Backend name -> keyword arguments for its constructor.
+        scheduler (scheduler.Scheduler): Per-host rate and concurrency control every fetch goes through.
+            A default `Scheduler()` is used when none is given.
+        shared_fetchers (dict): Backend name -> already started fetcher shared with other scrapers
+            (e.g. one HTTP session and one browser pool for a multi-site run). These are used
+            instead of starting a private backend and are left open by `close()`.
+        cache (responsecache.ResponseCache): Optional on-disk response cache consulted before
+            every fetch. With a cache, spec extractions run on the cached document, so a changed
+            selector can be re-run over a cached crawl without the network.
+        retry_policy (resilience.RetryPolicy): Per-attempt timeout and retries of every request.
+        dead_letters (resilience.DeadLetters): Collects the URLs that failed after every attempt.
+            A private list is used when none is given.
+    """
+    def __init__(self,page_backends,backend_options=None,scheduler=None,shared_fetchers=None,cache=None,
+                 retry_policy=None,dead_letters=None):
+        self.page_backends = page_backends
+        self.backend_options = backend_options or {}
+        self.scheduler = scheduler or Scheduler()
+        self.shared_fetchers = shared_fetchers or {}
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.resilience = resilience.Resilience(retry_policy,dead_letters=dead_letters)
+        self.dead_letters = self.resilience.dead_letters
+        self._fetchers = {}
+        self._lock = asyncio.Lock()
+
+    def backend_name(self,page_type):
+        return self.page_backends.get(page_type,BrowserFetcher.name)
+
+    async def get(self,page_type):
+        name = self.backend_name(page_type)
+        if name in self.shared_fetchers:
+            return self.shared_fetchers[name]
+        async with self._lock:
+            if name not in self._fetchers:
+                fetcher = FETCHER_BACKENDS[name](**self.backend_options.get(name,{}))
+                await fetcher.start()
+                self._fetchers[name] = fetcher
+        return self._fetchers[name]
+
+    async def fetch(self,page_type,url,wait_selector=None,full_page=False):
+        response = await self.fetch_response(page_type,url,wait_selector=wait_selector,full_page=full_page)
+        return response.text
+
+    async def fetch_response(self,page_type,url,headers=None,wait_selector=None,full_page=False):
+        # The browser returns either the body or the whole document; the HTTP body is always the whole document.
+        name = self.backend_name(page_type)
+        variant = f"{name}:document" if full_page or name == HttpFetcher.name else f"{name}:body"
+        if self.cache is not None:
+            # Looked up before the backend is started, so a replay never launches a browser.
+            cached = self.cache.get(variant,url,headers)
+            if cached is not None:
+                self.record_page("cache",page_type,cached["status"],cached["text"])
+                return FetchResponse(url,cached["status"],cached["text"],CIMultiDict(cached["headers"]))
+        fetcher = await self.get(page_type)
+
+        async def request():
+            async with self.scheduler.request(url) as ticket:
+                async with metrics.span("fetch",backend=name,page_type=page_type):
+                    response = await self.resilience.attempt(
+                        fetcher.fetch_response(url,headers=headers,wait_selector=wait_selector,full_page=full_page))
+                ticket.record(response.status,response.headers)
+            return response
+
+        response = await self.resilience.call(url,page_type,request)
+        self.record_page(name,page_type,response.status,response.text)
+        if self.cache is not None:
+            self.cache.put(variant,url,response.status,response.text,response.headers,request_headers=headers)
+        return response
+
+    async def extract(self,page_type,url,spec=None,script=None,wait_selector=None):
+        response = await self.extract_response(page_type,url,spec=spec,script=script,wait_selector=wait_selector)
+        return response.data
+
+    async def extract_response(self,page_type,url,spec=None,script=None,headers=None,wait_selector=None):
+        """
+        Like `fetch_response()`, but returns only the data selected by `spec` (a `site_selectors.Spec`)
+        or by a JavaScript `script`. On the browser backend the extraction runs inside the page.
+
+        With a response cache the whole document is fetched (or read from the cache) and `spec`
+        is evaluated on it in Python instead. `script` extractions bypass the cache, and are
+        refused in replay mode.
+        """
+        if self.cache is not None:
+            if script is None:
+                response = await self.fetch_response(page_type,url,headers=headers,wait_selector=wait_selector,full_page=True)
+                data = None if response.text is None else spec.extract_page(response.text)
+                return ExtractResponse(url,response.status,data,response.headers)
+            if self.cache.mode == "replay":
+                raise CacheMiss(f"{url}: JavaScript extractions are not cached")
+        fetcher = await self.get(page_type)
+        name = self.backend_name(page_type)
+
+        async def request():
+            async with self.scheduler.request(url) as ticket:
+                async with metrics.span("fetch",backend=name,page_type=page_type):
+                    response = await self.resilience.attempt(
+                        fetcher.extract_response(url,spec=spec,script=script,headers=headers,wait_selector=wait_selector))
+                ticket.record(response.status,response.headers)
+            return response
+
+        response = await self.resilience.call(url,page_type,request)
+        self.record_page(name,page_type,response.status)
+        return response
+
+    async def retry_dead_letters(self,page_type,handler):
+        """
+        Retry pass: calls `handler(url)` once more for every URL of `page_type` that failed so far,
+        after the circuit of its host has closed again.
+
+        Yields:
+            The result of `handler(url)` for every URL that succeeds now; the others stay dead letters.
+        """
+        entries = self.dead_letters.take(page_type)
+        if entries:
+            logging.info(f"Retrying {len(entries)} failed {page_type} pages...")
+        for entry in entries:
+            await self.resilience.breaker.wait_until_closed(entry["url"])
+            try:
+                result = await handler(entry["url"])
+            except Exception as err:
+                self.dead_letters.add(entry["url"],page_type,err,attempts=entry["attempts"] + 1)
+                continue
+            yield result
+
+    def record_page(self,backend,page_type,status,text=None):
+        """Counts a fetched page, and the bytes of its document if the whole document was transferred."""
+        metrics.count("crawl_pages_total",backend=backend,page_type=page_type,status=status)
+        if text is not None:
+            metrics.count("crawl_bytes_total",len(text.encode("utf-8")),backend=backend,page_type=page_type)
+
+    async def close(self):
+        if self.scheduler.hosts:
+            logging.info(f"Scheduler: {self.scheduler.summary()}")
+        for fetcher in self._fetchers.values():
+            await fetcher.close()
+        self._fetchers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,*exc_info):
+        await self.close()
+
+class NdjsonSink():
+    """
+    Streaming output writer that appends one JSON record per line as products are scraped.
+
+    Records go to `<output_path>.ndjson` (or `.ndjson.gz` with `compress=True`) and are
+    fsynced every `fsync_every` records, so a crash loses at most that many records.
+    `finalize()` converts the NDJSON file, line by line, into a JSON list written with
+    `serializer` (by default the indented layout used in `output/`, see
+    `serializers.Serializer`) and moves it over `output_path` atomically. Peak memory is
+    one record, independent of the catalog size.
+
+    Used as a context manager the sink is finalized on success only; after an error the
+    NDJSON file is kept as it is and `recover()` can continue it on the next run.
+    """
+    def __init__(self,output_path,compress=False,fsync_every=100,serializer=None):
+        self.output_path = output_path
+        self.compress = compress
+        self.serializer = serializer or serializers.DEFAULT
+        self.fsync_every = fsync_every
+        self.part_path = f"{output_path}.ndjson" + (".gz" if compress else "")
+        self.count = 0
+        self.resumed = False
+        self._file = None
+
+    def _open(self,path,mode):
+        if self.compress:
+            return gzip.open(path,mode + "t",encoding="utf-8")
+        return open(path,mode,encoding="utf-8")
+
+    def open(self):
+        self._file = self._open(self.part_path,"a" if self.resumed else "w")
+        return self
+
+    def recover(self,key):
+        """
+        Prepares the sink to continue the NDJSON file left by an interrupted run.
+
+        Complete lines are kept; a line cut off by the crash (or a truncated gzip member)
+        and everything after it is dropped. The file is rewritten through a temporary file
+        and the next `open()` appends to it.
+
+        Args:
+            key (str): Record field identifying an emitted record.
+
+        Returns:
+            collections.Counter: How many recovered records carry each `key` value.
+        """
+        emitted = Counter()
+        if not os.path.exists(self.part_path):
+            return emitted
+        tmp_path = f"{self.part_path}.tmp"
+        with self._open(self.part_path,"r") as part, self._open(tmp_path,"w") as recovered:
+            try:
+                for line in part:
+                    record = json.loads(line)
+                    recovered.write(line if line.endswith("\n") else line + "\n")
+                    emitted[record.get(key)] += 1
+                    self.count += 1
+            except (ValueError, EOFError, OSError):
+                pass
+        os.replace(tmp_path,self.part_path)
+        self.resumed = True
+        return emitted
+
+    def write(self,record):
+        self._file.write(json.dumps(record,ensure_ascii=False) + "\n")
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def finalize(self):
+        """
+        Writes `output_path` as a JSON list (same bytes as `save_json_data()` with the same
+        serializer) through a temporary file and `os.replace`, then removes the NDJSON file.
+        """
+        self.close()
+        tmp_path = f"{self.output_path}.tmp"
+        serializer = self.serializer
+        with metrics.span("finalize",output=os.path.basename(self.output_path)), self._open(self.part_path,"r") as part, \
+             serializers.open_compressed(tmp_path,'wb',serializer.compression,serializer.level) as json_file:
+            # The part file is written by stdlib `json`; orjson / msgspec would reject its NaN and Infinity.
+            serializer.write_items(json_file,(json.loads(line) for line in part))
+        with open(tmp_path,'rb') as json_file:
+            os.fsync(json_file.fileno())
+        os.replace(tmp_path,self.output_path)
+        os.remove(self.part_path)
+        return self.count
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.finalize()
+        else:
+            self.close()
+
+async def stream_output(records,output_path,compress=False,fsync_every=100,sink=None):
+    """
+    Writes every record of an async iterable to `output_path` through an `NdjsonSink`.
+
+    Args:
+        records (async iterable of dict): Records as the scraper yields them.
+        output_path (str): Final `.json` path.
+        compress (bool): Gzip the intermediate NDJSON file.
+        fsync_every (int): Number of records between two fsyncs.
+        sink (NdjsonSink): An existing sink, e.g. one prepared with `recover()`.
+
+    Returns:
+        int: Number of records written, including recovered ones.
+    """
+    sink = sink or NdjsonSink(output_path,compress=compress,fsync_every=fsync_every)
+    output_name = os.path.basename(output_path)
+    with sink:
+        async for record in records:
+            with metrics.span("write",output=output_name):
+                sink.write(record)
+    metrics.count("crawl_records_total",sink.count,output=output_name)
+    return sink.count
+
+async def carry_over_unchecked(scraper,records,state_key,checkpoint_key):
+    """
+    Passes a scraper's records through, then yields the previous records that the crawl could
+    not check (see `crawlstate.CrawlState.unchecked_previous()`), so an incremental output only
+    loses the products that were delisted.
+
+    Records recovered from an interrupted run's NDJSON file are already in the output and do
+    not pass through here; they are recognised by `checkpoint_key`.
+    """
+    seen_ids = set()
+    async for record in records:
+        seen_ids.add(str(record[state_key]))
+        yield record
+    recovered = scraper.checkpoint.emitted
+    for record in scraper.state.unchecked_previous(seen_ids,scraper.dead_letters):
+        if record.get(checkpoint_key) not in recovered:
+            yield record
+
+async def run_output(scraper,records,output_path,checkpoint_key,state_key="id",incremental=False,resume=False):
+    """
+    Runs a scraper's crawl and writes its records to `output_path`; the `write_output()` of every scraper.
+
+    This function performs the following steps:
+    1. With `incremental=True`, opens the crawl state next to `output_path` (keyed by `state_key`)
+       and indexes the previous output.
+    2. Opens the checkpoint next to `output_path`; with `resume=True` it continues the frontier and the
+       NDJSON file of the interrupted run, and retries the URLs that failed in that run.
+    3. Streams `records` to `output_path` with `stream_output()`; with `incremental=True`, followed
+       by the previous records the crawl could not check (`carry_over_unchecked()`).
+    4. Removes the checkpoint once the output is finalized, and saves the URLs that still failed
+       to `<output_path>.deadletter.json`.
+
+    The scraper's `state`, `checkpoint`, `dead_letters` and `frontier` are set for the crawl and
+    reset afterwards.
+
+    Args:
+        scraper: The scraper; it needs `url`, `serializer` and `CANONICAL_PATH_RULES`.
+        records (async iterable of dict): The scraper's records, e.g. `scraper.GetData()`; only
+            iterated once the crawl state and checkpoint are open.
+        output_path (str): Final `.json` path.
+        checkpoint_key (str): Record field identifying an emitted record, see `checkpoint.Checkpoint`.
+        state_key (str): Record field identifying a previous record, see `crawlstate.CrawlState`.
+
+    Returns:
+        int: Number of records written.
+    """
+    if incremental:
+        scraper.state = crawlstate.open_for_output(output_path,key=state_key)
+        records = carry_over_unchecked(scraper,records,state_key,checkpoint_key)
+    sink = NdjsonSink(output_path,serializer=scraper.serializer)
+    scraper.checkpoint = checkpoint.Checkpoint(output_path,sink,key=checkpoint_key,resume=resume)
+    dead_letter_path = f"{output_path}.deadletter.json"
+    scraper.dead_letters = resilience.DeadLetters.load(dead_letter_path) if resume else resilience.DeadLetters()
+    scraper.frontier = urlfrontier.Frontier(f"{output_path}.seen",base=scraper.url,path_rules=scraper.CANONICAL_PATH_RULES)
+    try:
+        count = await stream_output(records,output_path,sink=sink)
+        scraper.checkpoint.clear()
+        return count
+    finally:
+        scraper.dead_letters.save(dead_letter_path)
+        metrics.set_gauge("crawl_dead_letters",len(scraper.dead_letters),output=os.path.basename(output_path))
+        scraper.checkpoint = None
+        scraper.dead_letters = None
+        scraper.frontier.save()
+        scraper.frontier = None
+        if scraper.state:
+            scraper.state.close()
+            scraper.state = None
+
+def output(json_data,output_path = "./output/traderjoes.json",columnar=None,serializer=None):
         """
         saves it to a specified file.
 
         This method performs the following steps:
         1. Saves the converted JSON data to a file at the path specified using `save_data()`.
+        2. With `columnar="parquet"` or `"arrow"`, also writes the records as a products table and
+           a variants table next to it with `columnar.write_dataset()` (needs pyarrow).
 
+        `serializer` (`serializers.Serializer`) chooses the JSON backend, compact output and compression.
         """
 
-        save_json_data(json_data,output_path)
+        save_json_data(json_data,output_path,serializer)
+        if columnar:
+            columnar_output.write_dataset(lambda: json_data,output_path,format=columnar)
@@ -1,16 +1,206 @@
+import os
+import re
 import json
-import utility
+import codecs
+import argparse
+import time
+import logging
+import tempfile
+import serializers
+from concurrent.futures import ProcessPoolExecutor
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LEVEL = logging.INFO
+CHUNK_SIZE = 1 << 20
+DECODER = json.JSONDecoder()
+# What a record cut off inside a literal, number or escape ends with: no whitespace or structural character.
+PARTIAL_TOKEN = re.compile(r'[^\s,:\[\]{}]*\Z')
+
+
+def read_chunks(file_path,chunk_size=CHUNK_SIZE,start=0,end=None):
+    """Yields the text of a file (gzip or zstd-compressed if it ends in ".gz" / ".zst"), or of the byte range [start, end), in chunks."""
+    if serializers.compression_of(file_path):
+        with serializers.text_reader(file_path) as file:
+            for chunk in iter(lambda: file.read(chunk_size), ""):
+                yield chunk
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        remaining = (end - start) if end is not None else None
+        while remaining is None or remaining > 0:
+            data = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield decoder.decode(data)
+        yield decoder.decode(b"", final=True)
+
+
+def iter_records(file_path,chunk_size=CHUNK_SIZE,start=0,end=None,in_list=None):
+    """
+    Streams the records of a JSON list file (the `output/` layout) or of an NDJSON file
+    (the scrapers' `.ndjson` / `.ndjson.gz` part files), one record at a time.
+
+    The file is read in chunks of `chunk_size` characters and each record is decoded
+    as soon as it is complete, so memory is bounded by the largest record, not the file.
+
+    With `start` / `end` only the records of that byte range are read (a shard from
+    `find_shards()`); the range must begin at a record, and `in_list` tells whether
+    it is part of a JSON list.
+
+    Yields:
+        dict: One record.
+
+    Raises:
+        ValueError: If the file is not a JSON list or NDJSON, holds an invalid record
+            (reported with its index and character offset), or ends in the middle of a record.
+    """
+    chunks = read_chunks(file_path,chunk_size,start,end)
+    shard = in_list is not None
+    buffer = ""
+    position = 0
+    consumed = 0
+    index = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer,position,consumed,eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            chunk = ""
+        consumed += position
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip(characters):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    if not shard:
+        skip(" \t\r\n")
+        in_list = position < len(buffer) and buffer[position] == "["
+        if in_list:
+            position += 1
+    while True:
+        skip(" \t\r\n," if in_list else " \t\r\n")
+        if position >= len(buffer):
+            if in_list and not shard:
+                raise ValueError(f"{file_path}: unterminated JSON list")
+            return
+        if in_list and buffer[position] == "]":
+            return
+        try:
+            record,record_end = DECODER.raw_decode(buffer, position)
+        except json.JSONDecodeError as err:
+            # Only an error at the end of the buffer can be a record continuing in the next chunk.
+            if not err.msg.startswith("Unterminated string") and not PARTIAL_TOKEN.match(buffer, err.pos):
+                raise ValueError(f"{file_path}: invalid record {index} at offset {start + consumed + err.pos}: "
+                                 f"{err.msg}") from None
+            record,record_end = None,None
+        # A value reaching the end of the buffer may continue in the next chunk.
+        if record_end is None or (record_end == len(buffer) and not eof):
+            if eof:
+                raise ValueError(f"{file_path}: ends in the middle of a record")
+            fill()
+            continue
+        position = record_end
+        index += 1
+        yield record
+
+
+def find_shards(file_path,shard_bytes):
+    """
+    Splits a file into byte ranges of about `shard_bytes` that each begin at a record,
+    without parsing it: in the indented list layout written by the scrapers a record
+    starts on a line holding only "    {", in NDJSON on every line.
+
+    Compressed files and lists in any other layout are returned as a single shard.
+
+    Returns:
+        tuple: (shards, in_list) where shards is a list of (start, end) byte ranges, or
+        [(0, None)] with `in_list` None for a file that is read whole.
+    """
+    size = os.path.getsize(file_path)
+    if serializers.compression_of(file_path) or size <= shard_bytes:
+        return [(0, None)], None
+    with open(file_path, 'rb') as file:
+        first_line = file.readline()
+        in_list = first_line.strip() == b"["
+        if in_list:
+            is_start = lambda line: line.rstrip(b"\r\n") == b"    {"
+            if not is_start(file.readline()):
+                return [(0, None)], None
+            starts = [len(first_line)]
+        elif first_line.lstrip().startswith(b"{"):
+            is_start = lambda line: bool(line.strip())
+            starts = [0]
+        else:
+            return [(0, None)], None
+        for offset in range(shard_bytes, size, shard_bytes):
+            file.seek(offset)
+            file.readline()
+            while True:
+                position = file.tell()
+                line = file.readline()
+                if not line:
+                    break
+                if is_start(line):
+                    if position > starts[-1]:
+                        starts.append(position)
+                    break
+    ends = starts[1:] + [size]
+    return list(zip(starts, ends)), in_list
+
+
+def record_id(record):
+    return record.get("id") if isinstance(record,dict) else None
+
 
 class Validation():
     def read_json_from_path(self,file_path):
         """
-        Returns: JSON data 
+        Returns: JSON data, read with the fastest JSON backend installed (see `serializers.read_json()`)
         """
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        return data
+        return serializers.read_json(file_path)
+
+    def iter_records(self,file_path):
+        """
+        Returns: The records of a JSON list or NDJSON file, streamed one at a time (see `iter_records()`).
+        """
+        return iter_records(file_path)
 
     class FFValidation():
+        def missing_keys(self,entry,mandatory_keys):
+            """
+            Returns the mandatory keys missing from one record, in the order they are listed.
+            """
+            return [key for key in mandatory_keys if key not in entry]
+
+        def rate_difference(self,item):
+            """
+            Returns the price and the rate difference between price_min and price_max of one item.
+            """
+            price_min = item.get("price_min", 0)
+            price_max = item.get("price_max", 0)
+            return [{"price": price_min}, {"rate_difference": price_max - price_min}]
+
+        def variant_checks(self,item):
+            """
+            Returns, for each variant of one item, whether the item has images and the variant a price.
+            """
+            images_exist = bool(item.get("images", []))
+            return [{"images_exist": images_exist,
+                     "price_exists": "price" in variant and variant["price"] is not None}
+                    for variant in item.get("variants", [])]
+
         def validate_mandatory_keys(self,json_data, mandatory_keys):
             """
             Validates if each dictionary in the list contains all the mandatory keys.
@@ -23,13 +213,8 @@ class Validation():
             - bool: True if all dictionaries contain all mandatory keys, False otherwise.
             - list: List of dictionaries that do not contain all mandatory keys.
             """
-            invalid_entries = []
-            for entry in json_data:
-                if not all(key in entry for key in mandatory_keys):
-                    invalid_entries.append(entry)
+            return [entry for entry in json_data if self.missing_keys(entry, mandatory_keys)]
 
-            return invalid_entries
-        
         def calculate_rate_difference(self,json_data):
             """
             Calculates the rate difference between price_min and price_max for each item.
@@ -41,15 +226,8 @@ class Validation():
             - dict: A dictionary with item id as the key and a nested dictionary containing
                     the price and rate difference.
             """
-            result = {}
-            for item in json_data:
-                item_id = item["id"]
-                price_min = item.get("price_min", 0)
-                price_max = item.get("price_max", 0)
-                rate_difference = price_max - price_min
-                result[item_id] = [{"price": price_min}, {"rate_difference": rate_difference}]
-            return result
-        
+            return {item["id"]: self.rate_difference(item) for item in json_data}
+
         def check_variants_images_prices(self,json_data):
             """
             Checks if each variant has associated images and their respective prices.
@@ -61,64 +239,320 @@ class Validation():
             - dict: A dictionary with item id as the key and a list of boolean values indicating
                     if each variant has images and prices.
             """
-            result = {}
-            for item in json_data:
-                item_id = item["id"]
-                variants = item.get("variants", [])
-                images = item.get("images", [])
-                images_exist = bool(images)
-                variant_checks = []
-                for variant in variants:
-                    price_exists = "price" in variant and variant["price"] is not None
-                    variant_checks.append({"images_exist": images_exist, "price_exists": price_exists})
-                result[item_id] = variant_checks
-            return result
+            return {item["id"]: self.variant_checks(item) for item in json_data}
 
     class LCValidatioin(FFValidation):
         def validate_mandatory_keys(self,json_data, mandatory_keys):
             return super().validate_mandatory_keys(json_data, mandatory_keys)
-        
+
     class TJValidatioin(FFValidation):
         def validate_mandatory_keys(self,json_data, mandatory_keys):
             return super().validate_mandatory_keys(json_data, mandatory_keys)
 
-    
-validator = Validation()
-# Data Prepration 
-ff_data = validator.read_json_from_path(file_path="./output/foreignfortune.json")
-tj_data = validator.read_json_from_path(file_path="./output/traderjoes.json")
-lc_data = validator.read_json_from_path(file_path="./output/lechocolat.json")
-
-#Get all Class
-ff_validator = validator.FFValidation()
-lc_validator = validator.LCValidatioin()
-tj_validator = validator.TJValidatioin()
-
-# data without mandatory keys
-ff_invalid_data = ff_validator.validate_mandatory_keys(json_data=ff_data,mandatory_keys=["id","title","price","vendor"])
-lc_invalid_data = lc_validator.validate_mandatory_keys(json_data=lc_data,mandatory_keys=["id","title","price","description","categoty"])
-tj_invalid_data = tj_validator.validate_mandatory_keys(json_data=tj_data,mandatory_keys=["id","title","price","category","unit"])
-
-# Calculate Rate Difference
-ff_rate_diff = ff_validator.calculate_rate_difference(ff_data)
-
-# check variants 
-ff_variant = ff_validator.check_variants_images_prices(ff_data)
-
-
-consolidated_data = {
-    "ff_invalid_data": {
-        "invalid_entries": ff_invalid_data
-    },
-    "lc_invalid_data": {
-        "invalid_entries": lc_invalid_data
-    },
-    "tj_invalid_data": {
-        "invalid_entries": tj_invalid_data
-    },
-    "ff_rate_diff": ff_rate_diff,
-    "ff_variants": ff_variant
+
+class ReportSection():
+    """
+    One top-level section of the validation report, spilled to a temporary NDJSON file
+    while records are checked so the report never has to fit in memory.
+
+    Args:
+        name (str): Key of the section in the report.
+        kind (str): "entries" for `{"invalid_entries": [...]}`, "mapping" for `{id: value, ...}`.
+        path (str): File to spill to and keep, e.g. for a worker process to hand its part
+            of the section back; a temporary file in `directory` by default.
+    """
+    def __init__(self,name,kind,directory=None,path=None):
+        self.name = name
+        self.kind = kind
+        self.path = path
+        self.count = 0
+        self._keys = set()
+        self._file = open(path, 'w+') if path else tempfile.TemporaryFile('w+', dir=directory)
+
+    def add(self,value,key=None):
+        """Adds an entry, or a mapping value under `key`; a repeated key keeps its first value."""
+        if self.kind == "mapping":
+            key = str(key)
+            if key in self._keys:
+                return
+            self._keys.add(key)
+            value = [key, value]
+        self._file.write(json.dumps(value) + "\n")
+        self.count += 1
+
+    def values(self):
+        self._file.seek(0)
+        for line in self._file:
+            yield json.loads(line)
+
+    def merge(self,path,index_offset=0):
+        """
+        Adds the entries of a part of this section spilled to `path` by another process,
+        whose record positions start at `index_offset`; a repeated key keeps its first value.
+        """
+        with open(path, 'r') as file:
+            for line in file:
+                value = json.loads(line)
+                if self.kind == "mapping":
+                    self.add(value[1], key=value[0])
+                    continue
+                if isinstance(value,dict) and "index" in value:
+                    value["index"] += index_offset
+                self.add(value)
+
+    def write_json(self,file,indent=4,level=1):
+        """Writes the section value as `json.dump(..., indent=4)` would at nesting depth `level`."""
+        def nested(value,depth):
+            return json.dumps(value, indent=indent).replace("\n", "\n" + " " * (indent * depth))
+        pad = " " * indent
+        if self.kind == "entries":
+            file.write("{\n" + pad * (level + 1) + '"invalid_entries": ')
+            if not self.count:
+                file.write("[]")
+            else:
+                file.write("[")
+                for index,value in enumerate(self.values()):
+                    file.write(("," if index else "") + "\n" + pad * (level + 2) + nested(value, level + 2))
+                file.write("\n" + pad * (level + 1) + "]")
+            file.write("\n" + pad * level + "}")
+        elif not self.count:
+            file.write("{}")
+        else:
+            file.write("{")
+            for index,(key,value) in enumerate(self.values()):
+                file.write(("," if index else "") + "\n" + pad * (level + 1) + json.dumps(key) + ": " + nested(value, level + 1))
+            file.write("\n" + pad * level + "}")
+
+    def close(self):
+        self._file.close()
+
+
+class ValidationReport():
+    """
+    The report written to `validation.json`: sections in the order they are registered,
+    written with the same layout as `utility.output()`, through a temporary file.
+    """
+    def __init__(self,directory=None,prefix=None):
+        self.sections = {}
+        self.directory = directory
+        self.prefix = prefix
+
+    def section(self,name,kind):
+        """Returns the section `name`; with a `prefix` a new one is kept as `<directory>/<prefix>-<name>.ndjson`."""
+        if name not in self.sections:
+            path = os.path.join(self.directory, f"{self.prefix}-{name}.ndjson") if self.prefix else None
+            self.sections[name] = ReportSection(name,kind,self.directory,path)
+        return self.sections[name]
+
+    def write(self,output_path):
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write("{")
+            for index,section in enumerate(self.sections.values()):
+                file.write(("," if index else "") + "\n    " + json.dumps(section.name) + ": ")
+                section.write_json(file)
+            file.write("\n}" if self.sections else "}")
+        os.replace(tmp_path, output_path)
+
+    def close(self):
+        for section in self.sections.values():
+            section.close()
+
+
+class MandatoryKeysCheck():
+    """Reports the id of every record missing a mandatory key, and which keys are missing."""
+    kind = "entries"
+
+    def __init__(self,section,mandatory_keys,validator=None):
+        self.section = section
+        self.mandatory_keys = mandatory_keys
+        self.validator = validator or Validation.FFValidation()
+
+    def __call__(self,record,index,report):
+        missing = self.validator.missing_keys(record, self.mandatory_keys)
+        if missing:
+            report.add({"id": record_id(record), "index": index, "reason": f"missing keys: {', '.join(missing)}"})
+
+
+class RateDifferenceCheck():
+    """Reports the price and the price_max - price_min difference of every record by id."""
+    kind = "mapping"
+
+    def __init__(self,section,validator=None):
+        self.section = section
+        self.validator = validator or Validation.FFValidation()
+
+    def __call__(self,record,index,report):
+        report.add(self.validator.rate_difference(record), key=record["id"])
+
+
+class VariantsCheck():
+    """Reports whether each variant of every record has images and a price, by record id."""
+    kind = "mapping"
+
+    def __init__(self,section,validator=None):
+        self.section = section
+        self.validator = validator or Validation.FFValidation()
+
+    def __call__(self,record,index,report):
+        report.add(self.validator.variant_checks(record), key=record["id"])
+
+
+def validate_stream(records,checks,report):
+    """
+    Runs every check on each record in a single pass.
+
+    Args:
+        records (iterable of dict): Records, e.g. from `iter_records()`.
+        checks (list): Callables `check(record, index, section)` with `section` and `kind` attributes.
+        report (ValidationReport): Receives the results.
+
+    Returns:
+        int: Number of records checked.
+    """
+    sections = [(check, report.section(check.section, check.kind)) for check in checks]
+    count = 0
+    for index,record in enumerate(records):
+        for check,section in sections:
+            check(record, index, section)
+        count += 1
+    return count
+
+
+# Output file -> checks run on its records, all in the same pass.
+SITE_CHECKS = {
+    "./output/foreignfortune.json": [
+        MandatoryKeysCheck("ff_invalid_data", ["id","title","price","vendor"]),
+        RateDifferenceCheck("ff_rate_diff"),
+        VariantsCheck("ff_variants"),
+    ],
+    "./output/lechocolat.json": [
+        MandatoryKeysCheck("lc_invalid_data", ["id","title","price","description","categoty"]),
+    ],
+    "./output/traderjoes.json": [
+        MandatoryKeysCheck("tj_invalid_data", ["id","title","price","category","unit"]),
+    ],
 }
+# Order of the sections in validation.json.
+REPORT_SECTIONS = ("ff_invalid_data", "lc_invalid_data", "tj_invalid_data", "ff_rate_diff", "ff_variants")
+
+
+def new_report(site_checks=SITE_CHECKS,order=REPORT_SECTIONS):
+    """Returns an empty `ValidationReport` with a section for every check, in `order`."""
+    kinds = {check.section: check.kind for checks in site_checks.values() for check in checks}
+    report = ValidationReport()
+    for name in list(order) + [name for name in kinds if name not in order]:
+        if name in kinds:
+            report.section(name, kinds[name])
+    return report
+
+
+def run_validation(site_checks=SITE_CHECKS,output_path="./validation.json"):
+    """
+    Validates every output file in a single streaming pass per file and writes the report.
+
+    Invalid entries are reported by id, position and reason rather than copied whole, and
+    every section is spilled to disk while the records stream by, so memory stays bounded
+    by the largest record.
+
+    Returns:
+        dict: File path -> {"records", "seconds", "records_per_second"}.
+    """
+    report = new_report(site_checks)
+    stats = {}
+    try:
+        for file_path,checks in site_checks.items():
+            started = time.perf_counter()
+            count = validate_stream(iter_records(file_path), checks, report)
+            seconds = time.perf_counter() - started
+            stats[file_path] = {"records": count, "seconds": round(seconds, 3),
+                                "records_per_second": round(count / seconds) if seconds else None}
+            logging.info(f"Validated {count} records of {file_path} ({stats[file_path]['records_per_second']} records/s)")
+        report.write(output_path)
+    finally:
+        report.close()
+    return stats
+
+
+def validate_shard(file_path,start,end,in_list,checks,directory,prefix):
+    """
+    Runs the checks on the records of one shard of a file, in a worker process.
+
+    Returns:
+        dict: {"records": number of records, "sections": {name: path of the spilled part}}.
+    """
+    report = ValidationReport(directory,prefix)
+    try:
+        count = validate_stream(iter_records(file_path,start=start,end=end,in_list=in_list), checks, report)
+    finally:
+        report.close()
+    return {"records": count, "sections": {name: section.path for name,section in report.sections.items()}}
+
+
+def run_parallel_validation(site_checks=SITE_CHECKS,output_path="./validation.json",workers=None,shard_mb=64):
+    """
+    Validates the output files like `run_validation()`, with every file split into
+    shards of about `shard_mb` MB (see `find_shards()`) checked in parallel over a
+    `ProcessPoolExecutor` of `workers` processes.
+
+    This method performs the following steps:
+    1. Submits the shards of all files at once, so a large file keeps every worker busy.
+    2. Each worker spills its part of every section to a file of a temporary directory.
+    3. Merges the parts in file and shard order, shifting record positions by the records
+       of the shards before them, so validation.json is the same as a sequential run's.
+
+    Returns:
+        dict: File path -> {"records", "shards", "seconds", "records_per_second"}.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        return run_validation(site_checks,output_path)
+    started = time.perf_counter()
+    report = new_report(site_checks)
+    stats = {}
+    try:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as directory:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for file_no,(file_path,checks) in enumerate(site_checks.items()):
+                    shards,in_list = find_shards(file_path, int(shard_mb * 2**20))
+                    futures[file_path] = [executor.submit(validate_shard,file_path,shard_start,shard_end,in_list,checks,
+                                                          directory,f"{file_no}-{shard_no}")
+                                          for shard_no,(shard_start,shard_end) in enumerate(shards)]
+                for file_path,shard_futures in futures.items():
+                    count = 0
+                    for future in shard_futures:
+                        result = future.result()
+                        for name,path in result["sections"].items():
+                            report.sections[name].merge(path, index_offset=count)
+                            os.remove(path)
+                        count += result["records"]
+                    seconds = time.perf_counter() - started
+                    stats[file_path] = {"records": count, "shards": len(shard_futures), "seconds": round(seconds, 3),
+                                        "records_per_second": round(count / seconds) if seconds else None}
+                    logging.info(f"Validated {count} records of {file_path} in {len(shard_futures)} shards")
+            report.write(output_path)
+    finally:
+        report.close()
+    records = sum(file_stats["records"] for file_stats in stats.values())
+    seconds = time.perf_counter() - started
+    logging.info(f"Validated {records} records with {workers} workers in {seconds:.2f}s ({round(records / seconds) if seconds else None} records/s)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validates the scraped output files and writes validation.json.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes; 1 validates sequentially.")
+    parser.add_argument("--shard-mb", type=float, default=64, help="Approximate size of the shards a file is split into.")
+    parser.add_argument("--output-dir", default="./output", help="Directory of the scraped output files.")
+    parser.add_argument("--output", default="./validation.json", help="Path of the validation report.")
+    args = parser.parse_args(argv)
+    site_checks = {os.path.join(args.output_dir, os.path.basename(file_path)): checks
+                   for file_path,checks in SITE_CHECKS.items()}
+    run_parallel_validation(site_checks,args.output,workers=args.workers,shard_mb=args.shard_mb)
+
 
-utility.output(consolidated_data,"./validation.json")
-print("Completed Validation.....")
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(format=FORMAT, level=LEVEL)
+    main()
+    print("Completed Validation.....")